@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from q_helpers import filter_anomalous_Q_laps, return_ranked_Q_laps, pick_lead_driver, return_quali_ranks_per_session
+from quali_analysis import return_df_q_rankings
+from lineups import LINEUPS
+from synthetic_sessions import make_season
+from track_evolution import correct_track_evolution_batch
+from tyre_normalisation import fit_tyre_degradation
+from constants import *
+
+#### Benchmarks for the quali pipeline on synthetic sessions
+
+# Every stage is timed on synthetic seasons, so the suite runs offline on any machine.
+# Timings are compared with the stored baseline after scaling both by a fixed calibration workload,
+# which takes most of the difference between machines out of the comparison.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_BASELINE = os.path.join(ROOT_DIR, "benchmark_baseline.json")
+
+# Number of synthetic seasons per scale.
+BENCHMARK_SCALES = {"season": 1, "multi-season": 10}
+
+# A benchmark is a regression when its calibrated time is this many times the baseline's.
+REGRESSION_TOLERANCE = 1.3
+
+# Drivers without a valid lap in every synthetic session, so the poor quali paths are timed too.
+BENCHMARK_NO_TIME_DRIVERS = ("SAR",)
+
+
+def _quiet(func, *args, **kwargs):
+    """Call `func` with its progress prints suppressed."""
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def time_call(func, repeat: int = 3):
+    """Best wall time in seconds of `repeat` calls to `func`."""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _quiet(func)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def calibrate(repeat: int = 5):
+    """Time a fixed numpy/pandas workload (sort, grouped aggregation, rank) as a measure of machine speed."""
+
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({"key": rng.integers(0, 1000, 500_000), "value": rng.normal(size=500_000)})
+
+    def workload():
+        frame.sort_values("value")
+        frame.groupby("key")["value"].agg(["min", "mean"])
+        frame["value"].rank(method="min")
+
+    return time_call(workload, repeat)
+
+
+def build_inputs(seasons: int, seed: int = 0):
+    """
+    Generate the synthetic seasons and the intermediate outputs each benchmarked stage takes as input.
+
+    Returns:
+        list: One dict per season with "year", "sessions" ((event, quali_type) -> session),
+              "filtered" ((event, quali_type) -> (laps, poor_q_ranks)) and "ranks" (the scrape layout).
+    """
+
+    inputs = []
+    for year in range(SEASON - seasons + 1, SEASON + 1):
+        sessions = make_season(year, seed=seed, no_time_drivers=BENCHMARK_NO_TIME_DRIVERS)
+        for (event, _), session in sessions.items():
+            LINEUPS.add_results(year, event, session.results)
+
+        filtered = {key: _quiet(filter_anomalous_Q_laps, session) for key, session in sessions.items()}
+        ranks = {"Races": {}, "Sprints": {}}
+        for (event, quali_type), (laps, poor_q_ranks) in filtered.items():
+            ranks["Races" if quali_type == "Q" else "Sprints"][event] = return_ranked_Q_laps(laps, poor_q_ranks, event=event, season=year)
+
+        inputs.append({"year": year, "sessions": sessions, "filtered": filtered, "ranks": ranks})
+
+    return inputs
+
+
+def _stacked_ranks(season_inputs, table: str):
+    """All sessions' rank tables of one season stacked, as `return_long_q_ranks` passes them to `pick_lead_driver`."""
+
+    return pd.concat([
+        ranks[table].assign(Event=event, Session=session)
+        for session, session_ranks in (("Race", season_inputs["ranks"]["Races"]), ("Sprint", season_inputs["ranks"]["Sprints"]))
+        for event, ranks in session_ranks.items()
+    ], ignore_index=True)
+
+
+def run_benchmarks(scale: str = "season", repeat: int = 3, seed: int = 0):
+    """
+    Time every pipeline stage at one scale.
+
+    Args:
+        scale (str, optional): A key of BENCHMARK_SCALES. Defaults to "season".
+        repeat (int, optional): Runs per benchmark, the best is kept. Defaults to 3.
+        seed (int, optional): Seed for the synthetic seasons. Defaults to 0.
+
+    Returns:
+        dict: Benchmark name -> best time in seconds.
+    """
+
+    inputs = build_inputs(BENCHMARK_SCALES[scale], seed=seed)
+    stacked = [{table: _stacked_ranks(season, table) for table in ("Fastest Laps", "Average Laps")} for season in inputs]
+
+    benchmarks = {
+        "filter_anomalous_Q_laps": lambda: [
+            filter_anomalous_Q_laps(session) for season in inputs for session in season["sessions"].values()
+        ],
+        "return_ranked_Q_laps": lambda: [
+            return_ranked_Q_laps(laps, poor_q_ranks, event=event, season=season["year"])
+            for season in inputs for (event, _), (laps, poor_q_ranks) in season["filtered"].items()
+        ],
+        "correct_track_evolution": lambda: [
+            correct_track_evolution_batch([laps for laps, _ in season["filtered"].values()]) for season in inputs
+        ],
+        "fit_tyre_degradation": lambda: [
+            fit_tyre_degradation([laps for laps, _ in season["filtered"].values()], [event for event, _ in season["filtered"]]) for season in inputs
+        ],
+        "pick_lead_driver": lambda: [
+            pick_lead_driver(tables[table], selection=selection, by=["Event", "Session"])
+            for tables in stacked for table, selection in (("Fastest Laps", "FL"), ("Average Laps", "AV"))
+        ],
+        "return_quali_ranks_per_session": lambda: [
+            return_quali_ranks_per_session(session) for season in inputs for session in season["sessions"].values()
+        ],
+        "return_df_q_rankings": lambda: [
+            return_df_q_rankings(season["ranks"], downforce) for season in inputs for downforce in (0, *DF_RACES)
+        ]
+    }
+
+    results = {}
+    for name, benchmark in benchmarks.items():
+        results[name] = time_call(benchmark, repeat)
+        print(f"{scale:>12} {name:<32} {results[name]:8.3f}s")
+
+    return results
+
+
+def load_baseline(path: str = BENCHMARK_BASELINE):
+    """Load the stored baseline, or None if there is none yet."""
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as source:
+        return json.load(source)
+
+
+def save_baseline(calibration: float, results: dict, path: str = BENCHMARK_BASELINE):
+    """Store benchmark results as the new baseline, along with the calibration time and machine they came from."""
+
+    baseline = {
+        "calibration": calibration,
+        "machine": {
+            "platform": platform.platform(), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__
+        },
+        "scales": results
+    }
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as target:
+        json.dump(baseline, target, indent=2)
+    os.replace(tmp_path, path)
+
+
+def compare_to_baseline(calibration: float, results: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE):
+    """
+    Compare calibrated benchmark times with the baseline.
+
+    Args:
+        calibration (float): `calibrate()` time on this machine.
+        results (dict): Scale -> benchmark name -> seconds, as from `run_benchmarks`.
+        baseline (dict): As stored by `save_baseline`.
+        tolerance (float, optional): Ratio above which a benchmark counts as a regression.
+
+    Returns:
+        DataFrame: Scale, Benchmark, Seconds, Baseline, Ratio (calibrated time over calibrated baseline), Regression
+                   and Missing (no baseline timing, so the benchmark cannot be checked).
+    """
+
+    rows = []
+    for scale, timings in results.items():
+        for name, seconds in timings.items():
+            baseline_seconds = baseline["scales"].get(scale, {}).get(name)
+            ratio = np.nan
+            if baseline_seconds:
+                ratio = (seconds / calibration) / (baseline_seconds / baseline["calibration"])
+            rows.append({"Scale": scale, "Benchmark": name, "Seconds": seconds, "Baseline": baseline_seconds, "Ratio": ratio})
+
+    comparison = pd.DataFrame(rows, columns=["Scale", "Benchmark", "Seconds", "Baseline", "Ratio"])
+    comparison["Regression"] = comparison["Ratio"] > tolerance
+    comparison["Missing"] = comparison["Ratio"].isna()
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the quali pipeline on synthetic sessions and compare with the stored baseline.")
+    parser.add_argument("--scale", choices=[*BENCHMARK_SCALES, "all"], default="season")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these timings as the new baseline.")
+    args = parser.parse_args()
+
+    scales = list(BENCHMARK_SCALES) if args.scale == "all" else [args.scale]
+
+    calibration = calibrate()
+    print(f"Calibration workload: {calibration:.3f}s")
+    results = {scale: run_benchmarks(scale, repeat=args.repeat) for scale in scales}
+
+    if args.save_baseline:
+        save_baseline(calibration, results)
+        print(f"Saved baseline to {BENCHMARK_BASELINE}")
+        sys.exit(0)
+
+    baseline = load_baseline()
+    if baseline is None:
+        print("No baseline stored yet, run with --save-baseline to create one")
+        sys.exit(0)
+
+    comparison = compare_to_baseline(calibration, results, baseline, args.tolerance)
+    print(comparison.to_string(index=False))
+    
+    # A benchmark without a baseline is never checked, so the baseline has to be saved whenever the suite changes.
+    missing = comparison.loc[comparison["Missing"], "Benchmark"].tolist()
+    if missing:
+        print(f"No baseline for {', '.join(missing)}, run with --save-baseline to store one")
+    sys.exit(1 if comparison["Regression"].any() or missing else 0)
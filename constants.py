@@ -6,16 +6,17 @@ CONSTRUCTORS = {
     "Alfa Romeo": ("BOT", "ZHO"),
     "Alpine": ("GAS", "OCO"),
     "Williams": ("ALB", "SAR"),
-    "AlphaTauri": ("DEV", "TSU", "RIC"),
+    "AlphaTauri": ("DEV", "TSU", "RIC", "LAW"),
     "Haas F1 Team": ("HUL", "MAG"),
     "McLaren": ("NOR", "PIA")
 }
 
+# Driver -> constructor index, so lookups don't scan every constructor.
+# Drivers who changed team mid-season are resolved per event in lineups.py.
+DRIVER_CONSTRUCTORS = {driver: constructor for constructor, drivers in CONSTRUCTORS.items() for driver in drivers}
+
 def get_constructor(driver):
-    for constructor, drivers in CONSTRUCTORS.items():
-        if driver in drivers:
-            return constructor
-    return None
+    return DRIVER_CONSTRUCTORS.get(driver)
 
 DRIVERS = {
     "VER": "Verstappen",
@@ -38,9 +39,15 @@ DRIVERS = {
     "TSU": "Tsunoda",
     "DEV": "De Vries",
     "SAR": "Sargeant",
-    "RIC": "Ricciardo"
+    "RIC": "Ricciardo",
+    "LAW": "Lawson"
 }
 
+SEASON = 2023
+
+# Tyre compounds as named in FastF1 lap data.
+TYRE_COMPOUNDS = ["SOFT", "MEDIUM", "HARD", "INTERMEDIATE", "WET"]
+
 RACES = [
     'Sakhir',
     'Jeddah',
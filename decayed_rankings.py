@@ -0,0 +1,231 @@
+import json
+import math
+import os
+
+import pandas as pd
+
+from quali_analysis import return_long_q_ranks
+from lineups import LINEUPS
+from constants import *
+
+#### Form weighted season rankings
+
+# Every session's ranks are folded into exponentially weighted running means per driver, team and lead driver,
+# for both FL and AV ranks and pcts of pace, so recent sessions count more than the start of the season.
+# Instead of decaying every running mean when a session is added, each new session is given a weight that grows
+# by 2 ** (1 / half_life) per session, which weights the history identically relative to it. A session therefore
+# only touches the entries of the drivers and teams in it, however long the history. The weights are rescaled
+# once they grow large, which keeps them in floating point range.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DECAYED_RANKINGS_FILE = os.path.join(ROOT_DIR, "Cache", "decayed_rankings.json")
+
+# Sessions after which a session's weight has halved.
+DEFAULT_HALF_LIFE = 6
+
+# (rankings table, long rank frame, column the table is by)
+DECAYED_TABLES = [("Driver", "drivers", "Driver"), ("Team", "drivers", "Team"), ("Lead Driver", "lead drivers", "Team")]
+
+# Weight above which every running sum is rescaled.
+MAX_WEIGHT = 1e100
+
+
+class DecayedRankings:
+    """
+    Exponentially weighted FL / AV average ranks and pcts of pace, per track grouping.
+
+    Sessions are folded in calendar order with `add_session`. Each session's weight halves every `half_life`
+    sessions folded after it. Missing values (poor qualifying rows have no pct) are left out of the means
+    rather than making them nan.
+    """
+
+    def __init__(self, half_life: float = DEFAULT_HALF_LIFE, groupings=None):
+        """
+        Args:
+            half_life (float, optional): Sessions after which a session counts half as much. Defaults to DEFAULT_HALF_LIFE.
+            groupings (dict, optional): Grouping name -> list of tracks, as for `return_downforce_cube`, or None for
+                                        every event folded in. Defaults to 0 (every event) and every downforce level in DF_RACES.
+        """
+
+        self.half_life = half_life
+        self.groupings = {0: None, **{level: list(tracks) for level, tracks in DF_RACES.items()}} if groupings is None else groupings
+        self.sessions = []  # [season, event, session] of every folded session, in order
+        self.folded = set()  # (season, event, session) of every folded session, for the already folded check
+        self.exponent = 0  # Weight of the next session is 2 ** (exponent / half_life)
+        # grouping -> table -> "<selection> <Rank|pct>" -> name -> [weighted sum, total weight]
+        self.sums = {grouping: {table: {} for table, _, _ in DECAYED_TABLES} for grouping in self.groupings}
+
+    def add_session(self, q_ranks, event: str, session: str = "Qualifying", season: int = SEASON):
+        """
+        Fold one session's rank frames into the running means. Sessions already folded are skipped.
+
+        Args:
+            q_ranks (dict): {"Fastest Laps", "Average Laps"} as returned by `return_ranked_Q_laps`.
+            event (str): The event, which decides the groupings the session counts for.
+            session (str, optional): "Qualifying" or "Sprint". Defaults to "Qualifying".
+            season (int, optional): The season. Defaults to SEASON.
+
+        Returns:
+            bool: False if the session had already been folded in.
+        """
+
+        if (season, event, session) in self.folded:
+            return False
+
+        driver_ranks, lead_driver_ranks = return_long_q_ranks({event: q_ranks}, {})
+        frames = {"drivers": driver_ranks, "lead drivers": lead_driver_ranks}
+
+        weight = 2 ** (self.exponent / self.half_life)
+        groupings = [grouping for grouping, tracks in self.groupings.items() if tracks is None or event in tracks]
+        for table, frame, by in DECAYED_TABLES:
+            rows = frames[frame]
+            for selection, name, rank, pct in zip(rows["Selection"].values, rows[by].values, rows["Rank"].values, rows["pct"].values):
+                for value, statistic in ((rank, "Rank"), (pct, "pct")):
+                    if value != value:
+                        continue
+                    for grouping in groupings:
+                        entry = self.sums[grouping][table].setdefault(f"{selection} {statistic}", {}).setdefault(name, [0.0, 0.0])
+                        entry[0] += weight * value
+                        entry[1] += weight
+
+        self.sessions.append([season, event, session])
+        self.folded.add((season, event, session))
+        self.exponent += 1
+        if weight > MAX_WEIGHT:
+            self._rescale(weight)
+        return True
+
+    def _rescale(self, factor):
+        """Divide every running sum and weight by `factor`, which leaves the means unchanged."""
+
+        for tables in self.sums.values():
+            for statistics in tables.values():
+                for entries in statistics.values():
+                    for entry in entries.values():
+                        entry[0] /= factor
+                        entry[1] /= factor
+        self.exponent -= round(self.half_life * math.log2(factor))
+
+    def add_season(self, qualifying_ranks, season: int = SEASON):
+        """Fold a `scrape_all_quali_laps` output in calendar order, each race's qualifying before its sprint. Returns the sessions added."""
+
+        added = 0
+        for race in qualifying_ranks["Races"]:
+            added += self.add_session(qualifying_ranks["Races"][race], race, "Qualifying", season)
+            if race in qualifying_ranks["Sprints"]:
+                added += self.add_session(qualifying_ranks["Sprints"][race], race, "Sprint", season)
+        return added
+
+    def rankings(self, grouping=0):
+        """
+        Current form weighted rankings for one grouping.
+
+        Returns:
+            dict: {"Lead Driver", "Team", "Driver"} DataFrames in the `return_df_q_rankings` layout.
+        """
+
+        output = {}
+        for table, _, by in DECAYED_TABLES:
+            statistics = self.sums[grouping][table]
+            names = list(statistics.get("FL Rank", {}))
+            order = DRIVERS if by == "Driver" else CONSTRUCTORS
+            names = [name for name in order if name in names] + [name for name in names if name not in order]
+
+            columns = {by: names}
+            for selection, statistic, column in (("FL", "Rank", "FL Average Rank"), ("FL", "pct", "Avg pct of FL pace"),
+                                                 ("AV", "Rank", "AV Average Rank"), ("AV", "pct", "Avg pct of avg pace")):
+                entries = statistics.get(f"{selection} {statistic}", {})
+                columns[column] = [entries[name][0] / entries[name][1] if name in entries else float("nan") for name in names]
+
+            rankings = pd.DataFrame(columns, columns=[by, "FL Average Rank", "Avg pct of FL pace", "AV Average Rank", "Avg pct of avg pace"])
+            if table == "Driver":
+                latest_season = self.sessions[-1][0] if self.sessions else SEASON
+                rankings.insert(1, "Team", LINEUPS.season_teams(rankings["Driver"], latest_season).astype(object))
+            output[table] = rankings.sort_values("FL Average Rank").reset_index(drop=True)
+
+        return {table: output[table] for table in ("Lead Driver", "Team", "Driver")}
+
+    def to_dict(self):
+        """The state as plain JSON-serialisable values."""
+
+        return {
+            "half_life": self.half_life,
+            "exponent": self.exponent,
+            "sessions": self.sessions,
+            "groupings": [[grouping, tracks, self.sums[grouping]] for grouping, tracks in self.groupings.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        """Rebuild the state saved with `to_dict`."""
+
+        rankings = cls(state["half_life"], groupings={grouping: tracks for grouping, tracks, _ in state["groupings"]})
+        rankings.exponent = state["exponent"]
+        rankings.sessions = state["sessions"]
+        rankings.folded = {tuple(session) for session in state["sessions"]}
+        rankings.sums = {grouping: sums for grouping, _, sums in state["groupings"]}
+        return rankings
+
+    def save(self, path: str = DECAYED_RANKINGS_FILE):
+        """Write the state to `path`, replacing it atomically."""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as target:
+            json.dump(self.to_dict(), target)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = DECAYED_RANKINGS_FILE, half_life: float | None = None, groupings=None):
+        """
+        Load the state saved at `path`, or start an empty one with these settings if there is none.
+
+        Args:
+            path (str, optional): State file.
+            half_life (float, optional): Half life the state must have been saved with.
+                                         Defaults to the saved one, or DEFAULT_HALF_LIFE for a new state.
+            groupings (dict, optional): Groupings the state must have been saved with. Defaults to the saved ones,
+                                        or the `DecayedRankings` defaults for a new state.
+
+        Raises:
+            ValueError: If the saved state was built with a different half life or different groupings,
+                        whose running sums cannot be reweighted.
+        """
+
+        if not os.path.exists(path):
+            return cls(DEFAULT_HALF_LIFE if half_life is None else half_life, groupings)
+
+        with open(path, encoding="utf-8") as source:
+            rankings = cls.from_dict(json.load(source))
+
+        if half_life is not None and half_life != rankings.half_life:
+            raise ValueError(f"{path} was saved with a half life of {rankings.half_life} sessions, not {half_life}. "
+                             "Remove it to rebuild the rankings with the new half life.")
+        if groupings is not None and {grouping: None if tracks is None else list(tracks) for grouping, tracks in groupings.items()} != rankings.groupings:
+            raise ValueError(f"{path} was saved with different groupings. Remove it to rebuild the rankings with the new groupings.")
+        return rankings
+
+
+def update_decayed_rankings(qualifying_ranks, season: int = SEASON, half_life: float | None = None, path: str = DECAYED_RANKINGS_FILE):
+    """
+    Fold a scrape's new sessions into the saved form weighted rankings and save them again.
+
+    Sessions folded in an earlier run are skipped, so this can be called after every weekend's scrape.
+
+    Args:
+        qualifying_ranks (dict): Output of `scrape_all_quali_laps` (or one season of `return_warehouse_quali_ranks`).
+        season (int, optional): The season of the scrape. Defaults to SEASON.
+        half_life (float, optional): Half life in sessions. Defaults to the saved one, or DEFAULT_HALF_LIFE
+                                     if no state has been saved yet. A saved state with another half life raises ValueError.
+        path (str, optional): State file.
+
+    Returns:
+        DecayedRankings: The updated state, see `DecayedRankings.rankings`.
+    """
+
+    rankings = DecayedRankings.load(path, half_life)
+    added = rankings.add_season(qualifying_ranks, season)
+    print(f"Folded {added} new sessions into the form weighted rankings")
+    if added:
+        rankings.save(path)
+    return rankings
@@ -0,0 +1,137 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+#### Compact on-disk storage for analysis DataFrames
+
+# Frames are stored column by column in a compressed .npz archive, with a small JSON schema
+# recording each column's name and how it was encoded. No pickling is involved.
+
+
+def _encode_column(series):
+    """
+    Encode a Series as one or more plain numpy arrays.
+
+    Returns:
+        tuple: (kind, dict of arrays) where kind is used by `_decode_column` to rebuild the column.
+    """
+
+    if pd.api.types.is_timedelta64_dtype(series):
+        return "timedelta", {"values": series.values.astype("timedelta64[ns]").view("int64")}
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime", {"values": series.values.astype("datetime64[ns]").view("int64")}
+
+    if pd.api.types.is_categorical_dtype(series):
+        return "category", {"values": series.cat.codes.values, "categories": _encode_strings(series.cat.categories)[0]}
+
+    # Nullable integer, float and boolean columns (e.g. compact lap times) keep their dtype name alongside a mask.
+    if pd.api.types.is_extension_array_dtype(series) and series.dtype.kind in "iufb":
+        return f"masked:{series.dtype}", {
+            "values": series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0), "mask": series.isna().values
+        }
+
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return "numeric", {"values": series.values}
+
+    strings, mask = _encode_strings(series)
+    return "string", {"values": strings, "mask": mask}
+
+
+def _encode_strings(values):
+    """Encode string or None values as a unicode array and a missing mask."""
+
+    mask = pd.isna(pd.Series(values, dtype=object)).values
+    strings = np.array(["" if missing else str(value) for value, missing in zip(values, mask)], dtype=str)
+    return strings, mask
+
+
+def _decode_column(kind, arrays):
+    """Rebuild a column's values from the arrays written by `_encode_column`."""
+
+    values = arrays["values"]
+
+    if kind == "timedelta":
+        return values.view("timedelta64[ns]")
+
+    if kind == "datetime":
+        return values.view("datetime64[ns]")
+
+    if kind == "category":
+        return pd.Categorical.from_codes(values, categories=arrays["categories"].tolist())
+
+    if kind.startswith("masked:"):
+        decoded = pd.array(values, dtype=kind[len("masked:"):])
+        decoded[arrays["mask"]] = pd.NA
+        return decoded
+
+    if kind == "string":
+        decoded = values.astype(object)
+        decoded[arrays["mask"]] = None
+        return decoded
+
+    return values
+
+
+def save_frames(path, frames):
+    """
+    Save a dictionary of DataFrames to a single compressed columnar file.
+
+    Args:
+        path (str): Destination file path (conventionally ending in ".npz").
+        frames (dict): Mapping of name -> DataFrame.
+    """
+
+    arrays = {}
+    schema = {}
+
+    for name, df in frames.items():
+        columns = []
+        for i, column in enumerate([df.index.to_series()] + [df[c] for c in df.columns]):
+            kind, encoded = _encode_column(column)
+            for part, values in encoded.items():
+                arrays[f"{name}__{i}__{part}"] = values
+            columns.append(kind)
+
+        schema[name] = {"columns": [str(c) for c in df.columns], "kinds": columns}
+
+    arrays["__schema__"] = np.frombuffer(json.dumps(schema).encode(), dtype=np.uint8)
+
+    # Write to a temporary file first so a crash never leaves a half written frame behind.
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_frames(path, names=None):
+    """
+    Load a dictionary of DataFrames written by `save_frames`.
+
+    Args:
+        path (str): File path passed to `save_frames`.
+        names (iterable, optional): Only load these frames, the other frames' arrays are never read. Defaults to all.
+
+    Returns:
+        dict: Mapping of name -> DataFrame.
+    """
+
+    with np.load(path, allow_pickle=False) as archive:
+        schema = json.loads(archive["__schema__"].tobytes().decode())
+
+        frames = {}
+        for name, layout in schema.items():
+            if names is not None and name not in names:
+                continue
+            
+            decoded = []
+            for i, kind in enumerate(layout["kinds"]):
+                prefix = f"{name}__{i}__"
+                arrays = {key[len(prefix):]: archive[key] for key in archive.files if key.startswith(prefix)}
+                decoded.append(_decode_column(kind, arrays))
+
+            index, columns = decoded[0], decoded[1:]
+            frames[name] = pd.DataFrame(dict(zip(layout["columns"], columns)), index=index, columns=layout["columns"])
+
+    return frames
@@ -1,24 +1,18 @@
 ### Import Libraries ###
-import gspread
-import urllib.request
-import bs4 as bs
-import pandas as pd
-import threading as td
-from gspread_dataframe import set_with_dataframe, get_as_dataframe
-import json
-from google.oauth2 import service_account
+import argparse
+import functools
 import os
-import fastf1
 
-from secrets2.ss_key import sskey
-from quali_analysis import scrape_all_quali_laps, return_df_q_rankings #, Q_lap_pace_calculator
+from quali_analysis import scrape_all_quali_laps, return_downforce_cube #, Q_lap_pace_calculator
 from constants import *
-from q_helpers import return_quali_ranks_per_session
+from q_helpers import return_quali_ranks_per_session, ANALYSIS_VERSION
+from rank_cache import cached_frames, cache_stats
+from session_loader import get_quali_session, registry_stats
+from sheet_writer import SheetWriter
+from instrumentation import write_run_report
 
-
-fastf1.Cache.enable_cache(r"M:\Coding\F1DataAnalysis\FastF1Cache")
-
-#from constants import *
+# gspread, the Google auth libraries and FastF1 are only imported once they are needed,
+# so this module can be imported quickly and without network access.
 
 #######################################################################################################################################################################################
 
@@ -26,19 +20,30 @@ fastf1.Cache.enable_cache(r"M:\Coding\F1DataAnalysis\FastF1Cache")
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 CREDS = os.path.join(ROOT_DIR, r"secrets2/creds.json")
 
-# Load Google API Credentials
-with open(CREDS) as source:
-    info = json.load(source)
-credentials = service_account.Credentials.from_service_account_info(
-    info
-)  # Check GDrive Creds
+# Worksheet indexes in the Google Sheet
+QUALI_SHEET = 0
+RACES_SHEET = 1
+NEW_QUALI_SHEET = 2
 
-# Open Google Sheet and set pages as variables
-gc = gspread.service_account(filename=CREDS)  # Check GSheets Creds
-sh = gc.open_by_key(sskey)  # Get SpreadSheet
-quali = sh.get_worksheet(0)
-races = sh.get_worksheet(1)
-new_quali = sh.get_worksheet(2)
+
+@functools.lru_cache(maxsize=None)
+def get_spreadsheet():
+    """
+    Authenticate against Google and open the Google Sheet, on first use only.
+    """
+    import gspread
+    from secrets2.ss_key import sskey
+    
+    gc = gspread.service_account(filename=CREDS)  # Check GSheets Creds
+    return gc.open_by_key(sskey)  # Get SpreadSheet
+
+
+@functools.lru_cache(maxsize=None)
+def get_worksheet(index: int):
+    """
+    Return a worksheet of the Google Sheet, opening it on first use only.
+    """
+    return get_spreadsheet().get_worksheet(index)
 
     
 def record_quali_ranks():
@@ -55,46 +60,56 @@ def record_quali_ranks():
     print_coords = [2, 1]
     
     scrape = scrape_all_quali_laps()
+    cube = return_downforce_cube(scrape)
+    writer = SheetWriter(get_worksheet(QUALI_SHEET))
     
     for i in range(10):
         
-        data = return_df_q_rankings(scrape, i)
+        data = cube[i]
         
-        set_with_dataframe(quali, data["Lead Driver"], row=print_coords[0], col=print_coords[1])
+        writer.write_frame(data["Lead Driver"], row=print_coords[0], col=print_coords[1])
         print_coords[1]+=6
-        set_with_dataframe(quali, data["Team"], row=print_coords[0], col=print_coords[1])
+        writer.write_frame(data["Team"], row=print_coords[0], col=print_coords[1])
         print_coords[1]+=6
-        set_with_dataframe(quali, data["Driver"], row=print_coords[0], col=print_coords[1])
-
-        print("Sheet updated\n")
-            
+        writer.write_frame(data["Driver"], row=print_coords[0], col=print_coords[1])
         
         print_coords[0]+=23
         print_coords[1]=1       
+    
+    requests = writer.flush()
+    print(f"Sheet updated in {requests} requests\n")
 
 #record_quali_ranks()
 
 
+def return_session_pcts(race, quali_type):
+    """
+    Return the per session Q1/Q2/Q3 pct off pace for a race, reusing the rank cache where possible.
+    """
+    
+    cache_key = {"kind": "quali_pcts", "year": SEASON, "race": race, "quali_type": str(quali_type), "version": ANALYSIS_VERSION}
+    frames = cached_frames(cache_key, lambda: {"pcts": return_quali_ranks_per_session(get_quali_session(race, quali_type))})
+    
+    return frames["pcts"]
+
+
 def record_race_pcts():
 
     print_coords = [1, 1]
+    writer = SheetWriter(get_worksheet(RACES_SHEET))
 
     for race in RACES:
         try:
-            races.update_cell(row=print_coords[0], col=print_coords[1], value=race)
+            writer.write_cell(row=print_coords[0], col=print_coords[1], value=race)
             print_coords[0]+=1
-            Q = fastf1.get_session(2023, race, "Q") 
-            Q.load()
-            pcts = return_quali_ranks_per_session(Q)
+            pcts = return_session_pcts(race, "Q")
 
-            set_with_dataframe(races, pcts, row=print_coords[0], col=print_coords[1])
+            writer.write_frame(pcts, row=print_coords[0], col=print_coords[1])
 
             if race in SPRINTS:
                 print_coords[1]+=10
-                Q = fastf1.get_session(2023, race, 3) 
-                Q.load()
-                pcts = return_quali_ranks_per_session(Q)
-                set_with_dataframe(races, pcts, row=print_coords[0], col=print_coords[1])
+                pcts = return_session_pcts(race, 3)
+                writer.write_frame(pcts, row=print_coords[0], col=print_coords[1])
 
             
             print_coords[0]+=24
@@ -104,5 +119,21 @@ def record_race_pcts():
         except Exception as e:
             print(e)
             break
-        
-record_race_pcts()
\ No newline at end of file
+    
+    requests = writer.flush()
+    print(f"Sheet updated in {requests} requests")
+    print(f"Rank cache: {cache_stats()}")
+    print(f"Sessions: {registry_stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record qualifying analysis in the Google Sheet.")
+    parser.add_argument("report", nargs="?", choices=["race-pcts", "quali-ranks"], default="race-pcts")
+    args = parser.parse_args()
+    
+    if args.report == "quali-ranks":
+        record_quali_ranks()
+    else:
+        record_race_pcts()
+    
+    write_run_report()
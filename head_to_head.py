@@ -0,0 +1,339 @@
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from q_helpers import ANALYSIS_VERSION
+from lap_table import NANOSECONDS_PER_MS
+from constants import *
+
+#### Head to head delta tensor
+
+# The fastest lap and sector times of every ranked session are laid out as a dense (session, driver, metric) array,
+# and every pair of drivers is compared with one broadcast subtraction per session, giving a
+# (session, driver, driver, metric) tensor of deltas in ms (positive when the first driver was slower, NaN when
+# either had no time). The tensor is written as a .npy file and opened memory-mapped, with the session, driver and
+# team labels in a JSON file beside it, so queries such as "median delta VER vs PER at downforce level 4" only read
+# the slices they need and never rebuild anything. A fingerprint of the input times, labels and settings is stored with
+# it, so the tensor is rebuilt whenever any rank frame changes, not only when sessions are added.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAD_TO_HEAD_DIR = os.path.join(ROOT_DIR, "Cache", "head_to_head")
+
+# Fastest Laps columns compared head to head.
+HEAD_TO_HEAD_METRICS = ["FastestLapTime", "FastestSector1Time", "FastestSector2Time", "FastestSector3Time"]
+
+DELTAS_FILE = "deltas.npy"
+TIMES_FILE = "times.npy"
+METADATA_FILE = "metadata.json"
+
+
+def head_to_head_dir(key: dict, cache_dir: str = HEAD_TO_HEAD_DIR):
+    """Return the directory holding the tensor for `key`, named by a hash of its contents."""
+
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return os.path.join(cache_dir, digest)
+
+
+def _ranked_sessions(season_ranks):
+    """(season, event, session, Fastest Laps frame) of every session, in season and calendar order, each race's qualifying before its sprint."""
+
+    sessions = []
+    for season in sorted(season_ranks):
+        races, sprints = season_ranks[season]["Races"], season_ranks[season]["Sprints"]
+        events = [race for race in RACES if race in races or race in sprints]
+        events += [race for race in list(races) + list(sprints) if race not in events]
+        for race in dict.fromkeys(events):
+            if race in races:
+                sessions.append((int(season), race, "Qualifying", races[race]["Fastest Laps"]))
+            if race in sprints:
+                sessions.append((int(season), race, "Sprint", sprints[race]["Fastest Laps"]))
+    return sessions
+
+
+def _session_arrays(sessions):
+    """
+    Lay the ranked sessions out as arrays.
+
+    Returns:
+        tuple: (drivers, teams, times (session, driver, metric) in ms as float32, session_teams (session, driver) team
+                codes), NaN / -1 where the driver did not take part or set no time.
+    """
+
+    names = list(dict.fromkeys(driver for _, _, _, frame in sessions for driver in frame["Driver"].values))
+    drivers = [driver for driver in DRIVERS if driver in names] + [driver for driver in names if driver not in DRIVERS]
+    names = list(dict.fromkeys(team for _, _, _, frame in sessions for team in frame["Team"].values if team == team))
+    teams = [team for team in CONSTRUCTORS if team in names] + [team for team in names if team not in CONSTRUCTORS]
+    driver_codes = {driver: i for i, driver in enumerate(drivers)}
+    team_codes = {team: i for i, team in enumerate(teams)}
+
+    times = np.full((len(sessions), len(drivers), len(HEAD_TO_HEAD_METRICS)), np.nan, dtype=np.float32)
+    session_teams = np.full((len(sessions), len(drivers)), -1, dtype=np.int16)
+    for s, (_, _, _, frame) in enumerate(sessions):
+        rows = np.array([driver_codes[driver] for driver in frame["Driver"].values], dtype=int)
+        # Column by column, selecting several Timedelta columns at once copies them slowly in pandas 1.5.
+        values = np.stack([frame[metric].values.astype("timedelta64[ns]") for metric in HEAD_TO_HEAD_METRICS], axis=1)
+        times[s, rows] = np.where(np.isnat(values), np.nan, values.view("int64") / NANOSECONDS_PER_MS)
+        session_teams[s, rows] = [team_codes.get(team, -1) for team in frame["Team"].values]
+
+    return drivers, teams, times, session_teams
+
+
+def _fingerprint(sessions, drivers, teams, times, session_teams, key: dict | None = None):
+    """Hash of everything the tensor is built from: the session, driver and team labels, times, teams and settings."""
+
+    digest = hashlib.sha1()
+    labels = [[season, event, session] for season, event, session, _ in sessions]
+    digest.update(json.dumps([labels, drivers, teams, HEAD_TO_HEAD_METRICS, key or {}, ANALYSIS_VERSION], sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(times).tobytes())
+    digest.update(np.ascontiguousarray(session_teams).tobytes())
+    return digest.hexdigest()
+
+
+def build_head_to_head(season_ranks, path: str, key: dict | None = None):
+    """
+    Build the head to head tensor and write it to `path`, replacing any tensor already there.
+
+    Args:
+        season_ranks (dict): Season -> {"Races", "Sprints"} rank frames, as returned by `return_warehouse_quali_ranks`
+                             (a `scrape_all_quali_laps` output can be passed as {SEASON: output}).
+        path (str): Directory for the tensor files.
+        key (dict, optional): The settings the ranks were computed with, part of the stored fingerprint.
+
+    Returns:
+        HeadToHead: The tensor, opened memory-mapped.
+    """
+
+    sessions = _ranked_sessions(season_ranks)
+    drivers, teams, times, session_teams = _session_arrays(sessions)
+
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, DELTAS_FILE + ".tmp")
+    deltas = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                       shape=(len(sessions), len(drivers), len(drivers), len(HEAD_TO_HEAD_METRICS)))
+    for s in range(len(sessions)):
+        deltas[s] = times[s, :, None, :] - times[s, None, :, :]
+    deltas.flush()
+    del deltas
+    os.replace(tmp_path, os.path.join(path, DELTAS_FILE))
+
+    with open(os.path.join(path, TIMES_FILE + ".tmp"), "wb") as target:
+        np.save(target, times)
+    os.replace(os.path.join(path, TIMES_FILE + ".tmp"), os.path.join(path, TIMES_FILE))
+
+    # The metadata is written last, so a tensor is only picked up once all of its files are complete.
+    metadata = {
+        "version": ANALYSIS_VERSION,
+        "metrics": HEAD_TO_HEAD_METRICS,
+        "drivers": drivers,
+        "teams": teams,
+        "sessions": [[season, event, session, RACE_DF_RATING.get(event)] for season, event, session, _ in sessions],
+        "session_teams": session_teams.tolist(),
+        "fingerprint": _fingerprint(sessions, drivers, teams, times, session_teams, key)
+    }
+    with open(os.path.join(path, METADATA_FILE + ".tmp"), "w", encoding="utf-8") as target:
+        json.dump(metadata, target)
+    os.replace(os.path.join(path, METADATA_FILE + ".tmp"), os.path.join(path, METADATA_FILE))
+
+    return HeadToHead.load(path)
+
+
+def update_head_to_head(season_ranks, key: dict | None = None, cache_dir: str = HEAD_TO_HEAD_DIR):
+    """
+    Return the cached head to head tensor for these rank frames, building it only if they changed.
+
+    The times are laid out (a small fraction of the build) to fingerprint them, so changed ranks of the same
+    sessions rebuild the tensor too.
+
+    Args:
+        season_ranks (dict): Season -> {"Races", "Sprints"} rank frames, see `build_head_to_head`.
+        key (dict, optional): JSON-serialisable description of the settings the ranks were computed with
+                              (e.g. k, track_evolution), so differently computed ranks get their own tensor.
+        cache_dir (str, optional): Cache directory.
+
+    Returns:
+        HeadToHead: The tensor, opened memory-mapped.
+    """
+
+    path = head_to_head_dir({**(key or {}), "version": ANALYSIS_VERSION}, cache_dir)
+    sessions = _ranked_sessions(season_ranks)
+    fingerprint = _fingerprint(sessions, *_session_arrays(sessions), key)
+
+    # The fingerprint is checked before opening the tensor, a memory-mapped file cannot be replaced on Windows.
+    if os.path.exists(os.path.join(path, METADATA_FILE)):
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as source:
+            if json.load(source).get("fingerprint") == fingerprint:
+                return HeadToHead.load(path)
+
+    print(f"Building the head to head tensor for {len(sessions)} sessions")
+    return build_head_to_head(season_ranks, path, key)
+
+
+class HeadToHead:
+    """
+    A memory-mapped (session, driver, driver, metric) delta tensor and its labels.
+
+    Every query filters sessions by season, event, session type and downforce level first, then reads
+    only the selected slices of the tensor.
+    """
+
+    def __init__(self, deltas, times, metadata: dict):
+        """
+        Args:
+            deltas (ndarray): (session, driver, driver, metric) deltas in ms, usually memory-mapped.
+            times (ndarray): (session, driver, metric) times in ms.
+            metadata (dict): Labels as written by `build_head_to_head`.
+        """
+
+        self.deltas = deltas
+        self.times = times
+        self.metadata = metadata
+        self.drivers = {driver: i for i, driver in enumerate(metadata["drivers"])}
+        self.teams = {team: i for i, team in enumerate(metadata["teams"])}
+        self.session_teams = np.array(metadata["session_teams"], dtype=np.int16).reshape(len(metadata["sessions"]), len(self.drivers))
+        self.sessions = pd.DataFrame(metadata["sessions"], columns=["Season", "Event", "Session", "Downforce"])
+
+    @classmethod
+    def load(cls, path: str):
+        """Open the tensor written to `path` by `build_head_to_head`."""
+
+        with open(os.path.join(path, METADATA_FILE), encoding="utf-8") as source:
+            metadata = json.load(source)
+        deltas = np.load(os.path.join(path, DELTAS_FILE), mmap_mode="r")
+        times = np.load(os.path.join(path, TIMES_FILE))
+        return cls(deltas, times, metadata)
+
+    def _metric(self, metric: str):
+        """Index of a metric, "LapTime" and "FastestLapTime" both name the lap time."""
+
+        metrics = self.metadata["metrics"]
+        return metrics.index(metric) if metric in metrics else metrics.index("Fastest" + metric)
+
+    def select_sessions(self, seasons=None, events=None, sessions=None, downforce=None):
+        """
+        Indices of the sessions matching every given filter, in tensor order.
+
+        Args:
+            seasons (int or list, optional): Seasons to keep. Defaults to all.
+            events (str or list, optional): Events to keep. Defaults to all.
+            sessions (str or list, optional): "Qualifying" and/or "Sprint". Defaults to both.
+            downforce (int or list, optional): RACE_DF_RATING levels to keep. Defaults to all.
+        """
+
+        keep = np.ones(len(self.sessions), dtype=bool)
+        for column, values in (("Season", seasons), ("Event", events), ("Session", sessions), ("Downforce", downforce)):
+            if values is not None:
+                keep &= self.sessions[column].isin(values if isinstance(values, (list, tuple, set)) else [values]).values
+        return np.flatnonzero(keep)
+
+    def deltas_between(self, driver: str, other: str, metric: str = "FastestLapTime", **filters):
+        """
+        Per session deltas of `driver` to `other` in ms, positive when `driver` was slower.
+
+        Args:
+            driver (str): Driver abbreviation.
+            other (str): Driver abbreviation compared against.
+            metric (str, optional): A HEAD_TO_HEAD_METRICS column. Defaults to "FastestLapTime".
+            **filters: Passed to `select_sessions`.
+
+        Returns:
+            Series: Indexed by (Season, Event, Session), only sessions where both drivers set a time.
+        """
+
+        rows = self.select_sessions(**filters)
+        if driver not in self.drivers or other not in self.drivers:
+            rows = rows[:0]
+            driver = other = self.metadata["drivers"][0]
+
+        values = np.asarray(self.deltas[rows, self.drivers[driver], self.drivers[other], self._metric(metric)], dtype=float)
+        index = pd.MultiIndex.from_frame(self.sessions.iloc[rows][["Season", "Event", "Session"]])
+        deltas = pd.Series(values, index=index, name=f"{driver} - {other}")
+        return deltas.dropna()
+
+    def median_delta(self, driver: str, other: str, metric: str = "FastestLapTime", **filters):
+        """Median delta of `driver` to `other` in ms over the selected sessions, NaN if they never both set a time."""
+
+        deltas = self.deltas_between(driver, other, metric, **filters)
+        return float(deltas.median()) if len(deltas) else np.nan
+
+    def delta_matrix(self, metric: str = "FastestLapTime", statistic: str = "median", min_sessions: int = 1, **filters):
+        """
+        Every driver against every other over the selected sessions.
+
+        Args:
+            metric (str, optional): A HEAD_TO_HEAD_METRICS column. Defaults to "FastestLapTime".
+            statistic (str, optional): "median" or "mean" of the per session deltas. Defaults to "median".
+            min_sessions (int, optional): Pairs with fewer shared sessions are NaN. Defaults to 1.
+            **filters: Passed to `select_sessions`.
+
+        Returns:
+            DataFrame: Rows are drivers, columns the drivers compared against, values in ms.
+        """
+
+        rows = self.select_sessions(**filters)
+        values = np.asarray(self.deltas[rows, :, :, self._metric(metric)], dtype=float)
+        shared = (~np.isnan(values)).sum(axis=0)
+
+        # Pairs that never shared a session warn about all-NaN slices, they are NaN either way.
+        reduce = np.nanmedian if statistic == "median" else np.nanmean
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            matrix = reduce(values, axis=0) if len(rows) else np.full(shared.shape, np.nan)
+        matrix[shared < min_sessions] = np.nan
+
+        drivers = self.metadata["drivers"]
+        return pd.DataFrame(matrix, index=pd.Index(drivers, name="Driver"), columns=pd.Index(drivers, name="Other"))
+
+    def teammate_deltas(self, metric: str = "FastestLapTime", **filters):
+        """
+        Every driver against their teammates, over the selected sessions where both set a time.
+
+        Returns:
+            DataFrame: Driver, Teammate, Team, Sessions, Median Delta, Mean Delta and Ahead (share of sessions
+                       the driver was faster), deltas in ms, one row per driver pairing within a team.
+        """
+
+        rows = self.select_sessions(**filters)
+        values = np.asarray(self.deltas[rows, :, :, self._metric(metric)], dtype=float)
+        teams = self.session_teams[rows]
+
+        # Only teammates' deltas are kept, and a driver is never their own teammate.
+        teammates = (teams[:, :, None] == teams[:, None, :]) & (teams[:, :, None] >= 0)
+        teammates &= ~np.eye(len(self.drivers), dtype=bool)[None]
+        values = np.where(teammates, values, np.nan)
+
+        session, driver, other = np.nonzero(teammates & ~np.isnan(values))
+        pairs = pd.DataFrame({
+            "Driver": np.asarray(self.metadata["drivers"], dtype=object)[driver],
+            "Teammate": np.asarray(self.metadata["drivers"], dtype=object)[other],
+            "Team": np.asarray(self.metadata["teams"], dtype=object)[teams[session, driver]] if len(session) else np.empty(0, dtype=object),
+            "Delta": values[session, driver, other]
+        })
+
+        grouped = pairs.assign(Ahead=pairs["Delta"] < 0).groupby(["Driver", "Teammate", "Team"], sort=False)
+        output = grouped.agg(**{"Sessions": ("Delta", "size"), "Median Delta": ("Delta", "median"),
+                                "Mean Delta": ("Delta", "mean"), "Ahead": ("Ahead", "mean")})
+        return output.reset_index()
+
+    def team_deltas(self, team: str, other: str, metric: str = "FastestLapTime", **filters):
+        """
+        Per session delta of `team`'s fastest driver to `other`'s fastest driver in ms, positive when `team` was slower.
+
+        Returns:
+            Series: Indexed by (Season, Event, Session), only sessions where both teams set a time.
+        """
+
+        rows = self.select_sessions(**filters)
+        times = self.times[rows, :, self._metric(metric)].astype(float)
+        teams = self.session_teams[rows]
+
+        best = {}
+        for name in (team, other):
+            fastest = np.where((teams == self.teams.get(name, -2)) & ~np.isnan(times), times, np.inf).min(axis=1, initial=np.inf)
+            best[name] = np.where(np.isinf(fastest), np.nan, fastest)
+
+        index = pd.MultiIndex.from_frame(self.sessions.iloc[rows][["Season", "Event", "Session"]])
+        return pd.Series(best[team] - best[other], index=index, name=f"{team} - {other}").dropna()
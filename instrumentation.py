@@ -0,0 +1,168 @@
+import contextlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+#### Pipeline instrumentation: timing spans, counters and run reports
+
+# Spans time the pipeline stages (load, filter, rank, aggregate, upload) with labels naming the session,
+# and counters count laps kept/removed, cache hits and misses, sheet API requests and so on.
+# Both are kept in memory for the process and written out at the end of a run as a JSON report and a
+# Prometheus text file (for node_exporter's textfile collector or any scraper reading the format).
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+RUN_REPORT_DIR = os.path.join(ROOT_DIR, "Cache", "run_reports")
+
+# Overwritten by every run, so a textfile collector always sees the latest run.
+PROMETHEUS_FILE = "quali_pipeline.prom"
+METRIC_PREFIX = "quali"
+
+SPANS = []  # {"stage", "labels", "start", "seconds"}
+COUNTERS = {}  # (name, sorted label items) -> value
+RUN_STARTED = time.time()
+
+
+@contextlib.contextmanager
+def span(stage: str, **labels):
+    """
+    Time the enclosed block as one `stage` span.
+
+    Args:
+        stage (str): Pipeline stage, e.g. "load", "filter", "rank", "aggregate" or "upload".
+        **labels: Identify what was processed, e.g. event="Monaco", session="Qualifying".
+    """
+
+    start = time.perf_counter()
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        SPANS.append({"stage": stage, "labels": {key: str(value) for key, value in labels.items()},
+                      "start": started_at, "seconds": time.perf_counter() - start})
+
+
+def increment(name: str, value: float = 1, **labels):
+    """Add `value` to the counter `name` (with its labels)."""
+
+    key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+    COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+
+def reset_instrumentation():
+    """Drop every recorded span and counter and start a new run."""
+
+    global RUN_STARTED
+    SPANS.clear()
+    COUNTERS.clear()
+    RUN_STARTED = time.time()
+
+
+def instrumentation_snapshot():
+    """Spans and counters recorded so far, in a picklable form that `merge_instrumentation` accepts (e.g. from worker processes)."""
+
+    return {"spans": list(SPANS), "counters": list(COUNTERS.items())}
+
+
+def merge_instrumentation(snapshot):
+    """Add the spans and counters of a snapshot taken in another process."""
+
+    SPANS.extend(snapshot["spans"])
+    for (name, labels), value in snapshot["counters"]:
+        COUNTERS[(name, labels)] = COUNTERS.get((name, labels), 0) + value
+
+
+def stage_totals():
+    """Total seconds and number of spans per stage."""
+
+    totals = {}
+    for recorded in SPANS:
+        total = totals.setdefault(recorded["stage"], {"count": 0, "seconds": 0.0})
+        total["count"] += 1
+        total["seconds"] += recorded["seconds"]
+    return totals
+
+
+def run_report():
+    """
+    Summarise the run.
+
+    Returns:
+        dict: started and finished (ISO timestamps), seconds, stages (per stage totals), counters and spans.
+    """
+
+    finished = time.time()
+    return {
+        "started": datetime.fromtimestamp(RUN_STARTED, timezone.utc).isoformat(),
+        "finished": datetime.fromtimestamp(finished, timezone.utc).isoformat(),
+        "seconds": finished - RUN_STARTED,
+        "stages": stage_totals(),
+        "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(COUNTERS.items())],
+        "spans": list(SPANS)
+    }
+
+
+def _prometheus_labels(labels):
+    """Format labels as {key="value",...}, escaping as the text format requires."""
+
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def prometheus_text(report):
+    """
+    Render a run report in the Prometheus text exposition format.
+
+    Per session span labels are left out to keep series cardinality low, stages are reported as totals.
+    """
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_run_timestamp_seconds Time the run finished.",
+        f"# TYPE {METRIC_PREFIX}_run_timestamp_seconds gauge",
+        f"{METRIC_PREFIX}_run_timestamp_seconds {datetime.fromisoformat(report['finished']).timestamp():.3f}",
+        f"# HELP {METRIC_PREFIX}_run_duration_seconds Wall time of the run.",
+        f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+        f"{METRIC_PREFIX}_run_duration_seconds {report['seconds']:.6f}",
+        f"# HELP {METRIC_PREFIX}_stage_seconds Time spent per pipeline stage in the run.",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds gauge"
+    ]
+    lines += [f'{METRIC_PREFIX}_stage_seconds{{stage="{stage}"}} {total["seconds"]:.6f}' for stage, total in sorted(report["stages"].items())]
+    lines += [f"# HELP {METRIC_PREFIX}_stage_spans Spans recorded per pipeline stage in the run.", f"# TYPE {METRIC_PREFIX}_stage_spans gauge"]
+    lines += [f'{METRIC_PREFIX}_stage_spans{{stage="{stage}"}} {total["count"]}' for stage, total in sorted(report["stages"].items())]
+
+    named = {}
+    for counter in report["counters"]:
+        named.setdefault(counter["name"], []).append(counter)
+    for name, counters in named.items():
+        lines += [f"# TYPE {METRIC_PREFIX}_{name} gauge"]
+        lines += [f"{METRIC_PREFIX}_{name}{_prometheus_labels(sorted(counter['labels'].items()))} {counter['value']}" for counter in counters]
+
+    return "\n".join(lines) + "\n"
+
+
+def write_run_report(report_dir: str = RUN_REPORT_DIR):
+    """
+    Write the run's JSON report (one file per run) and the Prometheus text file (replaced every run).
+
+    Returns:
+        str: Path of the JSON report.
+    """
+
+    report = run_report()
+    os.makedirs(report_dir, exist_ok=True)
+
+    stamp = datetime.fromisoformat(report["started"]).strftime("%Y%m%dT%H%M%SZ")
+    json_path = os.path.join(report_dir, f"run-{stamp}.json")
+    prometheus_path = os.path.join(report_dir, PROMETHEUS_FILE)
+
+    for path, text in ((json_path, json.dumps(report, indent=2)), (prometheus_path, prometheus_text(report))):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as target:
+            target.write(text)
+        os.replace(tmp_path, path)
+
+    stages = ", ".join(f"{stage} {total['seconds']:.1f}s" for stage, total in report["stages"].items())
+    print(f"Run report written to {json_path} ({stages})")
+    return json_path
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+#### Compact columnar lap table
+
+# Lap frames are converted once, straight after filtering, to:
+#   - millisecond times as nullable Int32 (FastF1 timing has millisecond resolution),
+#   - categorical Driver, Team and Compound codes backed by DRIVERS, CONSTRUCTORS and TYRE_COMPOUNDS,
+#   - small-int tyre life.
+# Timedeltas are only rebuilt for display, on the aggregated tables.
+
+# Lap and sector times stored as milliseconds.
+COMPACT_TIME_COLUMNS = ["LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "Time"]
+
+NANOSECONDS_PER_MS = 1_000_000
+
+
+def _categories(values, known):
+    """
+    The names in constants plus any not in constants (e.g. reserve drivers), sorted so that grouping on the
+    categorical keys orders groups exactly as grouping on the plain strings would.
+    """
+
+    return sorted(set(known) | set(pd.Series(values).dropna().unique()))
+
+
+def timedelta_to_ms(values):
+    """Convert timedelta-like values to nullable Int32 milliseconds."""
+
+    nanoseconds = pd.to_timedelta(pd.Series(values)).values.astype("timedelta64[ns]").view("int64")
+    missing = nanoseconds == np.iinfo(np.int64).min
+    milliseconds = np.round(nanoseconds / NANOSECONDS_PER_MS).astype(np.int32)
+    return pd.arrays.IntegerArray(milliseconds, missing)
+
+
+def ms_to_timedelta(values):
+    """
+    Convert milliseconds (int, nullable int or float) back to timedelta64[ns] values for display.
+
+    Series, DataFrames and arrays are all accepted, and the result keeps their shape (NaT where missing).
+    """
+
+    if isinstance(values, (pd.Series, pd.DataFrame)):
+        milliseconds = values.to_numpy(dtype=float, na_value=np.nan)
+    else:
+        milliseconds = np.asarray(values, dtype=float)
+
+    nanoseconds = np.round(milliseconds * NANOSECONDS_PER_MS)
+    return np.where(np.isnan(nanoseconds), np.iinfo(np.int64).min, nanoseconds).astype(np.int64).view("timedelta64[ns]")
+
+
+def is_compact(laps):
+    """Whether a lap frame has already been converted by `compact_laps`."""
+
+    return pd.api.types.is_integer_dtype(laps["LapTime"])
+
+
+def compact_laps(laps):
+    """
+    Convert a lap frame to the compact representation.
+
+    Args:
+        laps (DataFrame): Lap data with Driver, Team, LapTime and sector times, optionally Compound, TyreLife and Time.
+                          Other columns are kept unchanged.
+
+    Returns:
+        DataFrame: The same laps with integer millisecond times, categorical Driver/Team/Compound and UInt8 TyreLife.
+    """
+
+    if is_compact(laps):
+        return laps
+
+    compact = {}
+    for column in laps.columns:
+        values = laps[column]
+
+        if column in COMPACT_TIME_COLUMNS:
+            compact[column] = timedelta_to_ms(values)
+        elif column == "Driver":
+            compact[column] = pd.Categorical(values, categories=_categories(values, DRIVERS))
+        elif column == "Team":
+            compact[column] = pd.Categorical(values, categories=_categories(values, CONSTRUCTORS))
+        elif column == "Compound":
+            compact[column] = pd.Categorical(values, categories=_categories(values, TYRE_COMPOUNDS))
+        elif column == "TyreLife":
+            compact[column] = pd.array(np.round(values.astype(float)).values, dtype="Float64").astype("UInt8")
+        else:
+            compact[column] = values.values
+
+    return pd.DataFrame(compact, index=laps.index)
+
+
+def expand_laps(laps):
+    """Convert a compact lap frame back to Timedelta times and string Driver/Team/Compound, e.g. for display."""
+
+    if not is_compact(laps):
+        return laps
+
+    expanded = laps.copy()
+    for column in COMPACT_TIME_COLUMNS:
+        if column in expanded:
+            expanded[column] = ms_to_timedelta(expanded[column])
+    for column in ("Driver", "Team", "Compound"):
+        if column in expanded:
+            expanded[column] = expanded[column].astype(object)
+
+    return expanded
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+#### Season aware driver -> team lineups
+
+# Lineups are held per (season, event) in one event x driver matrix of constructor codes,
+# so mapping a whole Driver column to teams is a couple of array lookups instead of a call per row.
+
+
+# Mid-season line-up changes: season -> [(first event, constructor, drivers)], in calendar order.
+# Each change holds until the constructor's next change. Drivers not listed keep their CONSTRUCTORS team.
+LINEUP_CHANGES = {
+    2023: [
+        ("Sakhir", "AlphaTauri", ("DEV", "TSU")),
+        ("Budapest", "AlphaTauri", ("RIC", "TSU")),
+        ("Zandvoort", "AlphaTauri", ("LAW", "TSU")),  # Ricciardo broke his hand in Zandvoort practice.
+        ("Austin", "AlphaTauri", ("RIC", "TSU"))
+    ]
+}
+
+NO_TEAM = -1
+
+
+def _factorize(values, n):
+    """Codes and uniques of `values`, broadcast to length `n` when a scalar. Categoricals reuse their codes."""
+
+    if np.ndim(values) == 0:
+        return np.zeros(n, dtype=np.intp), pd.Index([values], dtype=object)
+    if isinstance(values, (pd.Categorical, pd.Series)) and isinstance(values.dtype, pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        return values.codes, pd.Index(values.categories, dtype=object)
+
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return codes, pd.Index(uniques, dtype=object)
+
+
+def _codes(index, values, n=None):
+    """Positions of `values` in `index`, -1 where missing. Only the distinct values are looked up."""
+
+    codes, uniques = _factorize(values, len(values) if n is None else n)
+    positions = np.append(index.get_indexer(uniques), -1)
+    return positions[codes]  # Missing values have code -1, which picks the appended -1.
+
+
+class LineupRegistry:
+    """
+    Driver -> team affiliations per (season, event).
+
+    Built once, from constants (`from_constants`) or from session results (`add_results`), and reused for
+    every lookup. Events must be added in calendar order within a season for `season_teams` to return
+    the latest affiliation.
+    """
+
+    def __init__(self):
+        self.lineups = {}  # (season, event) -> {driver: team}
+        self._index = None
+
+    @classmethod
+    def from_constants(cls, season: int = SEASON, events=RACES, changes=LINEUP_CHANGES):
+        """Lineups for every event in `events`, from CONSTRUCTORS with the season's `changes` applied."""
+
+        registry = cls()
+        season_changes = {}
+        for event, constructor, drivers in changes.get(season, []):
+            season_changes.setdefault(event, []).append((constructor, drivers))
+
+        seated = {team: set(drivers) for team, drivers in CONSTRUCTORS.items()}
+        for event in events:
+            for constructor, drivers in season_changes.get(event, []):
+                seated[constructor] = set(drivers)
+            registry.add_lineup(season, event, {driver: team for driver, team in DRIVER_CONSTRUCTORS.items() if driver in seated[team]})
+
+        return registry
+
+    def add_lineup(self, season: int, event: str, lineup: dict):
+        """Register (or replace) the driver -> team mapping for one event."""
+
+        self.lineups[(season, event)] = dict(lineup)
+        self._index = None
+
+    def add_results(self, season: int, event: str, results):
+        """Register the lineup of an event from a FastF1 results DataFrame (Abbreviation and TeamName)."""
+
+        results = results.dropna(subset=["Abbreviation", "TeamName"])
+        self.add_lineup(season, event, dict(zip(results["Abbreviation"], results["TeamName"])))
+
+    def team(self, driver: str, event: str, season: int = SEASON):
+        """The team `driver` drove for at `event`, or None."""
+
+        return self.lineups.get((season, event), {}).get(driver)
+
+    def _build_index(self):
+        """Flatten the lineups into an event x driver matrix of team codes."""
+
+        events = pd.MultiIndex.from_tuples(list(self.lineups), names=["Season", "Event"])
+        seats = pd.DataFrame(
+            [(row, driver, team) for row, lineup in enumerate(self.lineups.values()) for driver, team in lineup.items()],
+            columns=["Row", "Driver", "Team"]
+        )
+        driver_codes, drivers = pd.factorize(seats["Driver"], sort=True)
+        team_codes, teams = pd.factorize(seats["Team"], sort=True)
+        drivers, teams = pd.Index(drivers, dtype=object), pd.Index(teams, dtype=object)
+
+        table = np.full((len(events), len(drivers)), NO_TEAM, dtype=np.int16)
+        table[seats["Row"].values, driver_codes] = team_codes
+
+        # Latest known team per season and driver, for season level tables.
+        latest = pd.DataFrame(np.where(table == NO_TEAM, np.nan, table), index=events).groupby(level="Season").ffill()
+        latest = latest.groupby(events.get_level_values("Season")).last().fillna(NO_TEAM).astype(np.int16)
+
+        self._index = events, drivers, teams, table, latest
+        return self._index
+
+    def map_teams(self, drivers, events, seasons=SEASON):
+        """
+        Map a whole column of drivers to the team they drove for at each row's event.
+
+        Args:
+            drivers (array-like): Driver abbreviations, plain or categorical.
+            events (str or array-like): Event of each row, or one event for every row.
+            seasons (int or array-like, optional): Season of each row, or one season for every row. Defaults to SEASON.
+
+        Returns:
+            Categorical: The team of each row, missing where the driver has no seat at that event.
+        """
+
+        events_index, drivers_index, teams, table, _ = self._index or self._build_index()
+
+        driver_codes = _codes(drivers_index, drivers)
+        n = len(driver_codes)
+
+        # Look up each distinct (season, event) pair once, then index by the pair code of every row.
+        season_codes, season_uniques = _factorize(seasons, n)
+        event_codes, event_uniques = _factorize(events, n)
+        pairs = pd.MultiIndex.from_product([season_uniques, event_uniques])
+        pair_positions = np.append(events_index.get_indexer(pairs), -1)
+        pair_codes = np.where((season_codes >= 0) & (event_codes >= 0), season_codes * len(event_uniques) + event_codes, -1)
+        event_codes = pair_positions[pair_codes]
+
+        team_codes = np.full(n, NO_TEAM, dtype=np.int16)
+        known = (driver_codes >= 0) & (event_codes >= 0)
+        team_codes[known] = table[event_codes[known], driver_codes[known]]
+
+        return pd.Categorical.from_codes(team_codes, categories=teams)
+
+    def season_teams(self, drivers, season: int = SEASON):
+        """Map drivers to their latest team among the registered events of `season`."""
+
+        _, drivers_index, teams, _, latest = self._index or self._build_index()
+
+        driver_codes = _codes(drivers_index, drivers)
+        team_codes = np.full(len(driver_codes), NO_TEAM, dtype=np.int16)
+        if season in latest.index:
+            known = driver_codes >= 0
+            team_codes[known] = latest.loc[season].values[driver_codes[known]]
+
+        return pd.Categorical.from_codes(team_codes, categories=teams)
+
+
+# Shared registry, seeded from constants and updated from the results of every session loaded for analysis.
+LINEUPS = LineupRegistry.from_constants()
@@ -0,0 +1,369 @@
+import argparse
+import collections
+import heapq
+import time
+from bisect import bisect_left, insort
+
+import numpy as np
+import pandas as pd
+
+from q_helpers import LAP_TIME_COLUMNS, build_rank_tables
+from lap_table import compact_laps, ms_to_timedelta
+from session_loader import load_quali_session
+from constants import *
+
+#### Live qualifying: rank tables updated lap by lap
+
+# Laps arrive as lap completion events, either from a replay of a recorded session or a timing feed.
+# Every driver keeps a running minimum, sum and count of their lap and sector times (milliseconds), so a
+# new lap updates their statistics in constant time however many laps they have set. Every rank table
+# column keeps a sorted list of the drivers' minimums or means (one value per driver), so a lap only moves
+# one value in each column and a rank is a bisection. Kept laps are counted by their times, so a lap deleted
+# later is found by its identity in constant time. Each driver's minimums come from a min-heap per column that
+# is cleaned lazily, so a removed minimum only pops the removed times off the top to reach the next one.
+
+LapCompleted = collections.namedtuple(
+    "LapCompleted", ["Time", "Driver", "Team", "LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "IsAccurate", "Deleted"]
+)
+LapCompleted.__doc__ = "One completed lap: session time, driver, team, lap and sector times in ms (NaN if missing) and the lap flags."
+
+# Rank table -> the statistic its columns hold, as in RANK_TABLES.
+LIVE_TABLES = {"Fastest Laps": "min", "Average Laps": "mean"}
+
+# Drivers with a lap needed before the anomalous lap cutoff is applied.
+LIVE_CUTOFF_MIN_DRIVERS = 4
+
+
+def _percentile(values, q):
+    """Linearly interpolated percentile of an already sorted list, as `np.percentile` computes it."""
+
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _move(values, old, new):
+    """Replace `old` (None if absent) with `new` (None to only remove) in a sorted list."""
+
+    if old is not None:
+        del values[bisect_left(values, old)]
+    if new is not None:
+        insort(values, new)
+
+
+class LiveQualiRanker:
+    """
+    Qualifying rank tables kept up to date one lap at a time.
+
+    Laps flagged inaccurate or deleted are ignored, as `filter_anomalous_Q_laps` ignores them. With `k` set,
+    laps slower than q3 + k * iqr of the drivers' current best laps are ignored too. That is the live stand-in
+    for the Q1 results the batch filter uses, and it only applies to laps arriving after it, so ranks can differ
+    slightly from the batch tables of the finished session. Given a pooled `sketch`, the cutoff is instead the
+    pooled relative cutoff times the current best lap, which applies from the first lap.
+    Laps later deleted are taken out with `remove_lap`.
+    """
+
+    def __init__(self, k: float | None = 2, event: str | None = None, season: int = SEASON, sketch=None):
+        """
+        Args:
+            k (float, optional): IQR multiplier for the anomalous lap cutoff, None to keep every valid lap. Defaults to 2.
+            event (str, optional): The event, for the team lookup of poor qualifying drivers in `rank_tables`.
+            season (int, optional): The season. Defaults to SEASON.
+            sketch (TDigest, optional): Pooled Q1 times relative to each session's fastest, see `q1_pace_sketch`.
+        """
+
+        self.k = k
+        self.relative_cutoff = sketch.iqr_cutoff(k) if sketch is not None and k is not None else None
+        self.event = event
+        self.season = season
+        self.teams = {}
+        self.laps = {}  # driver -> lap time -> (LapTime, Sector1Time, Sector2Time, Sector3Time) -> number of kept laps, None for missing times
+        self.sums = {}  # driver -> one sum per column
+        self.sizes = {}  # driver -> number of times per column
+        self.heaps = {}  # driver -> one min-heap of times per column, including removed times until they reach the top
+        self.kept_times = {}  # driver -> one time -> number of kept laps counter per column
+        self.stats = {"min": {}, "mean": {}}  # statistic -> driver -> one value per column (None if no time)
+        self.ordered = {stat: [[] for _ in LAP_TIME_COLUMNS] for stat in self.stats}  # statistic -> sorted values per column
+        self.counts = {"kept": 0, "ignored": 0, "cut": 0, "removed": 0}
+
+    def cutoff(self):
+        """Current anomalous lap cutoff in ms, or None while it is not applied."""
+
+        best_laps = self.ordered["min"][0]
+        if self.relative_cutoff is not None:
+            return best_laps[0] * self.relative_cutoff if best_laps else None
+        if self.k is None or len(best_laps) < LIVE_CUTOFF_MIN_DRIVERS:
+            return None
+        q1, q3 = _percentile(best_laps, 25), _percentile(best_laps, 75)
+        return q3 + self.k * (q3 - q1)
+
+    def update(self, lap: LapCompleted):
+        """
+        Fold one completed lap into the rank tables.
+
+        Returns:
+            bool: True if the lap was kept.
+        """
+
+        if not lap.IsAccurate or lap.Deleted or lap.LapTime != lap.LapTime:
+            self.counts["ignored"] += 1
+            return False
+
+        cutoff = self.cutoff()
+        if cutoff is not None and lap.LapTime > cutoff:
+            self.counts["cut"] += 1
+            return False
+
+        self._add(lap.Driver, tuple(None if value != value else value for value in lap[3:7]))
+        self.teams[lap.Driver] = lap.Team
+        self.counts["kept"] += 1
+        return True
+
+    def add_lap(self, driver: str, team: str, lap_time: float, sector_times=(np.nan, np.nan, np.nan)):
+        """Fold in a valid, accurate lap given as plain values (ms). Returns True if it was kept."""
+
+        return self.update(LapCompleted(np.nan, driver, team, lap_time, *sector_times, True, False))
+
+    def remove_lap(self, driver: str, lap_time: float, sector_times=None):
+        """
+        Take a kept lap back out, e.g. when it is deleted for track limits after it was set.
+
+        Args:
+            driver (str): The driver who set the lap.
+            lap_time (float): The lap time (ms) of the lap.
+            sector_times (tuple, optional): The lap's sector times (ms, NaN if missing), to tell apart laps of
+                                            the same lap time. Defaults to None (the first kept lap with `lap_time`).
+
+        Returns:
+            bool: False if the driver has no such lap.
+        """
+
+        laps = self.laps.get(driver, {})
+        same_lap_time = laps.get(lap_time)
+        if not same_lap_time:
+            return False
+
+        if sector_times is None:
+            times = next(iter(same_lap_time))
+        else:
+            times = (lap_time, *(None if value != value else value for value in sector_times))
+            if times not in same_lap_time:
+                return False
+
+        same_lap_time[times] -= 1
+        if not same_lap_time[times]:
+            del same_lap_time[times]
+            if not same_lap_time:
+                del laps[lap_time]
+
+        self._remove(driver, times)
+        if not laps:
+            self._drop_driver(driver)
+        self.counts["removed"] += 1
+        return True
+
+    def _add(self, driver, times):
+        """Fold one lap's times into the driver's running statistics and move them in the sorted columns."""
+
+        if driver not in self.laps:
+            self.laps[driver] = {}
+            self.sums[driver] = [0.0] * len(LAP_TIME_COLUMNS)
+            self.sizes[driver] = [0] * len(LAP_TIME_COLUMNS)
+            self.heaps[driver] = [[] for _ in LAP_TIME_COLUMNS]
+            self.kept_times[driver] = [collections.Counter() for _ in LAP_TIME_COLUMNS]
+            for stat in self.stats:
+                self.stats[stat][driver] = [None] * len(LAP_TIME_COLUMNS)
+
+        same_lap_time = self.laps[driver].setdefault(times[0], {})
+        same_lap_time[times] = same_lap_time.get(times, 0) + 1
+        sums, sizes, minimums = self.sums[driver], self.sizes[driver], self.stats["min"][driver]
+        for i, value in enumerate(times):
+            if value is None:  # No time for this column.
+                continue
+
+            sums[i] += value
+            sizes[i] += 1
+            heapq.heappush(self.heaps[driver][i], value)
+            self.kept_times[driver][i][value] += 1
+            self._set_stats(driver, i, value if minimums[i] is None or value < minimums[i] else minimums[i])
+
+    def _remove(self, driver, times):
+        """Take one already uncounted lap's times out of the driver's running statistics."""
+
+        sums, sizes, minimums = self.sums[driver], self.sizes[driver], self.stats["min"][driver]
+        for i, value in enumerate(times):
+            if value is None:
+                continue
+
+            sums[i] -= value
+            sizes[i] -= 1
+            kept_times, heap = self.kept_times[driver][i], self.heaps[driver][i]
+            kept_times[value] -= 1
+            if not kept_times[value]:
+                del kept_times[value]
+
+            # Removed times stay in the heap until they reach the top, where each is popped once.
+            while heap and heap[0] not in kept_times:
+                heapq.heappop(heap)
+            self._set_stats(driver, i, heap[0] if heap else None)
+
+    def _set_stats(self, driver, i, minimum):
+        """Store a driver's new minimum and current mean of column `i` and move them in the sorted columns."""
+
+        minimums, means = self.stats["min"][driver], self.stats["mean"][driver]
+        mean = self.sums[driver][i] / self.sizes[driver][i] if self.sizes[driver][i] else None
+        if minimum != minimums[i]:
+            _move(self.ordered["min"][i], minimums[i], minimum)
+            minimums[i] = minimum
+        _move(self.ordered["mean"][i], means[i], mean)
+        means[i] = mean
+
+    def _drop_driver(self, driver):
+        """Forget a driver whose last lap was removed."""
+
+        for stat, values in self.stats.items():
+            for i, value in enumerate(values.pop(driver)):
+                _move(self.ordered[stat][i], value, None)
+        del self.laps[driver], self.sums[driver], self.sizes[driver], self.heaps[driver], self.kept_times[driver], self.teams[driver]
+
+    def rank(self, driver: str, table: str = "Fastest Laps", column: str = "LapTime"):
+        """
+        A driver's current rank in one column, as `return_ranked_Q_laps` ranks it (ties share the best rank).
+
+        Drivers without a time in the column rank after every driver with one. Returns None for unknown drivers.
+        """
+
+        values = self.stats[LIVE_TABLES[table]].get(driver)
+        if values is None:
+            return None
+
+        i = LAP_TIME_COLUMNS.index(column)
+        ordered = self.ordered[LIVE_TABLES[table]][i]
+        return bisect_left(ordered, values[i]) + 1 if values[i] is not None else len(ordered) + 1
+
+    def pct_of_pace(self, driver: str, table: str = "Fastest Laps"):
+        """A driver's pct off the best lap time of the table. Returns None for unknown drivers."""
+
+        values = self.stats[LIVE_TABLES[table]].get(driver)
+        if values is None:
+            return None
+
+        best = self.ordered[LIVE_TABLES[table]][0][0]
+        return (values[0] - best) / best * 100
+
+    def standings(self, table: str = "Fastest Laps"):
+        """Drivers in lap time rank order, with their rank: [(driver, rank), ...]."""
+
+        stat = LIVE_TABLES[table]
+        ranked = sorted(self.stats[stat], key=lambda driver: (self.stats[stat][driver][0], driver))
+        return [(driver, self.rank(driver, table)) for driver in ranked]
+
+    def lap_stats(self):
+        """The current statistics in the `aggregate_lap_stats` layout."""
+
+        drivers = sorted(self.laps)
+        columns = {}
+        for i, column in enumerate(LAP_TIME_COLUMNS):
+            for stat in ("min", "mean"):
+                values = [self.stats[stat][driver][i] for driver in drivers]
+                columns[(column, stat)] = ms_to_timedelta(np.array([np.nan if value is None else value for value in values], dtype=float))
+
+        index = pd.MultiIndex.from_arrays([np.array(drivers, dtype=object), np.array([self.teams[driver] for driver in drivers], dtype=object)],
+                                          names=["Driver", "Team"])
+        return pd.DataFrame(columns, index=index, columns=pd.MultiIndex.from_product([LAP_TIME_COLUMNS, ["min", "mean"]]))
+
+    def rank_tables(self, poor_q_ranks=None):
+        """The full "Fastest Laps" and "Average Laps" tables, in the `return_ranked_Q_laps` layout."""
+
+        return build_rank_tables(self.lap_stats(), poor_q_ranks, event=self.event, season=self.season)
+
+
+#### Lap completion events
+
+def session_lap_events(session):
+    """
+    Yield a loaded session's laps as lap completion events, in the order they were completed.
+
+    Args:
+        session: A session with `laps` as returned by `load_quali_session` (or `synthetic_sessions.make_quali_session`).
+    """
+
+    laps = compact_laps(session.laps.dropna(subset=["Time"]).sort_values("Time", kind="mergesort"))
+    columns = [laps["Time"].to_numpy(dtype=float, na_value=np.nan), laps["Driver"].astype(object).values, laps["Team"].astype(object).values]
+    columns += [laps[column].to_numpy(dtype=float, na_value=np.nan) for column in LAP_TIME_COLUMNS]
+    columns += [laps["IsAccurate"].fillna(False).values.astype(bool), laps["Deleted"].fillna(False).values.astype(bool)]
+
+    for values in zip(*columns):
+        yield LapCompleted(*values)
+
+
+def load_live_timing_session(path: str, race: str, quali_type: str | int = "Q", year: int = SEASON):
+    """
+    Load a qualifying session from a file recorded with FastF1's live timing client (`python -m fastf1.livetiming save`).
+
+    Args:
+        path (str): The recorded live timing file.
+        race (str): The name of the race session.
+        quali_type (str or int, optional): "Q" for standard qualifying or 3 for sprint qualifying. Defaults to "Q".
+        year (int, optional): The season. Defaults to SEASON.
+    """
+
+    from fastf1.livetiming.data import LiveTimingData
+
+    return load_quali_session(race, quali_type, year=year, livedata=LiveTimingData(path))
+
+
+def replay(events, ranker: LiveQualiRanker, speed: float | None = None, on_update=None):
+    """
+    Feed lap completion events to a ranker.
+
+    Args:
+        events (iterable): LapCompleted events in completion order.
+        ranker (LiveQualiRanker): The ranker to update.
+        speed (float, optional): Replay at this multiple of real time, pacing events by their session Time.
+                                 Defaults to as fast as possible.
+        on_update (callable, optional): Called with (lap, ranker) after every kept lap.
+
+    Returns:
+        LiveQualiRanker: The ranker, after the last event.
+    """
+
+    started = None
+    for lap in events:
+        if speed and lap.Time == lap.Time:
+            started = started or (time.perf_counter() - lap.Time / 1000 / speed)
+            delay = started + lap.Time / 1000 / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        if ranker.update(lap) and on_update is not None:
+            on_update(lap, ranker)
+
+    return ranker
+
+
+def print_update(lap: LapCompleted, ranker: LiveQualiRanker):
+    """Print a kept lap with the driver's new ranks."""
+
+    minutes, seconds = divmod(lap.LapTime / 1000, 60)
+    print(f"{lap.Driver} {int(minutes)}:{seconds:06.3f} -> P{ranker.rank(lap.Driver)} fastest, "
+          f"P{ranker.rank(lap.Driver, 'Average Laps')} average ({ranker.pct_of_pace(lap.Driver):.3f}% off pace)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded live timing file and rank qualifying lap by lap.")
+    parser.add_argument("path", help="File recorded with `python -m fastf1.livetiming save`.")
+    parser.add_argument("race")
+    parser.add_argument("--quali-type", default="Q", help='"Q" or the sprint qualifying session number.')
+    parser.add_argument("--year", type=int, default=SEASON)
+    parser.add_argument("--k", type=float, default=2)
+    parser.add_argument("--speed", type=float, default=None, help="Replay at this multiple of real time.")
+    args = parser.parse_args()
+
+    quali_type = args.quali_type if args.quali_type == "Q" else int(args.quali_type)
+    session = load_live_timing_session(args.path, args.race, quali_type, year=args.year)
+
+    ranker = replay(session_lap_events(session), LiveQualiRanker(k=args.k, event=args.race, season=args.year),
+                    speed=args.speed, on_update=print_update)
+    print(ranker.rank_tables()["Fastest Laps"].to_string(index=False))
@@ -6,18 +6,74 @@ from functools import reduce
 # from sklearn.ensemble import IsolationForest
 
 from constants import *
+from lap_table import compact_laps, expand_laps, ms_to_timedelta
+from lineups import LINEUPS
+from instrumentation import increment
+from quantile_sketch import TDigest
 
 #### Helper functions for Quali analysis
 
+# Bump whenever the filtering or ranking logic changes, so cached rank frames computed by older versions are not reused.
+# Also bump when the filtered laps gain a column, warehouse partitions are never rewritten, so only a new version
+# re-ingests them (3: Time and Compound, which the track evolution and tyre corrections need).
+# 4: poor qualifying rows keep the Timedelta and float dtypes of the rest of the rank tables.
+ANALYSIS_VERSION = 4
+
 
 def check_average_laps(df, driver):
-    df = df[df["Driver"]==driver]
+    # Filtered laps are compact, show them with Timedelta times.
+    df = expand_laps(df[df["Driver"]==driver])
     print(df)
 
 # Three Sigma rule currently eliminates relevant efforts as a large anomalous result will affect 3*StDev
 # Using IQR instead and only removing the upper bound.
 
-def filter_anomalous_Q_laps(Q_session):
+def q1_pace_sketch(results):
+    """
+    A t-digest of a session's Q1 times relative to its fastest Q1 time.
+
+    Relative times from different sessions are comparable, so these digests can be merged into pooled
+    per track or per downforce cutoffs.
+    """
+    
+    q1_laptimes = results["Q1"].dropna().values
+    sketch = TDigest()
+    if len(q1_laptimes):
+        sketch.update(q1_laptimes / q1_laptimes.min())
+    return sketch
+
+
+def anomalous_lap_cutoff(results, k=2, sketch=None):
+    """
+    The anomalous lap cutoff q3 + k * iqr of a session's Q1 times.
+
+    Args:
+        results (DataFrame): The session results, with a Q1 column.
+        k (float or array, optional): IQR multiplier(s). Defaults to 2.
+        sketch (TDigest, optional): Pooled relative Q1 times, see `filter_anomalous_Q_laps`.
+
+    Returns:
+        timedelta64: The cutoff, or an array of cutoffs for an array of `k`.
+    """
+    
+    # Drivers without a Q1 time (NaT) are left out, otherwise the quartiles are NaT.
+    q1_laptimes = results["Q1"].dropna().values
+    
+    if sketch is not None:
+        # Quartiles of relative times scale with the fastest time, so this equals the exact cutoff for one session.
+        pooled = q1_pace_sketch(results).merge(sketch)
+        return q1_laptimes.min() * pooled.iqr_cutoff(k)
+    
+    # Calculate the first quartile (Q1) and third quartile (Q3)
+    q1 = np.percentile(q1_laptimes, 25)
+    q3 = np.percentile(q1_laptimes, 75)
+
+    # Calculate the IQR (Interquartile Range)
+    iqr = q3 - q1
+    return q3 + k * iqr
+
+
+def filter_anomalous_Q_laps(Q_session, k=2, sketch=None):
     """
     Filter and identify anomalies in Qualifying session lap data.
 
@@ -29,18 +85,23 @@ def filter_anomalous_Q_laps(Q_session):
     
     Args:
         Q_session: A Qualifying session object containing lap data.
+        k (float, optional): IQR multiplier for the anomaly cutoff, laps slower than q3 + k * iqr are removed.
+                             Defaults to 2.
+        sketch (TDigest, optional): Pooled Q1 times relative to each session's fastest (see `q1_pace_sketch`).
+                                    The session's own Q1 times are merged in and the cutoff is taken from the
+                                    streaming quartiles, scaled by the session's fastest Q1 time. Defaults to the
+                                    exact quartiles of the session's Q1 times.
 
     Returns:
         tuple: A tuple containing the following elements:
-            - filtered_laps (DataFrame): A DataFrame containing lap data after removing anomalies.
+            - filtered_laps (DataFrame): A DataFrame containing lap data after removing anomalies,
+              in the compact form of `lap_table.compact_laps`.
             - poor_q_ranks (dict or None): A dictionary mapping poor qualifying drivers to their positions
               or None if all drivers set competitive laps.
     """
     
-    k=2 # ************* Edit to adjust cutoff.
-    
-    
-    relevant_data = Q_session.laps[["Driver", "Team", "LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "TyreLife", "IsAccurate", "Deleted"]]
+    # Time (session time at the end of the lap) is kept for the track evolution correction, Compound and TyreLife for the tyre normalisation.
+    relevant_data = Q_session.laps[["Driver", "Team", "LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "Compound", "TyreLife", "Time", "IsAccurate", "Deleted"]]
     #IsAccurate removes inlaps and outlaps and some other non fast laps
     #Deleted records whether a lap time is deleted for track limits.
     accurate_laps = relevant_data[(relevant_data["IsAccurate"] == True) & (relevant_data["Deleted"] == False)]
@@ -48,15 +109,7 @@ def filter_anomalous_Q_laps(Q_session):
     
     # Not all anomalies are caught so remove laptimes that are larger than 3 times the Std dev. (None should be smaller)
     # laptime_anomaly_threshold = Q_session.results["Q1"].median() + Q_session.results["Q1"].std()
-    q1_laptimes = Q_session.results["Q1"].values
-    
-    # Calculate the first quartile (Q1) and third quartile (Q3)
-    q1 = np.percentile(q1_laptimes, 25)
-    q3 = np.percentile(q1_laptimes, 75)
-
-    # Calculate the IQR (Interquartile Range)
-    iqr = q3 - q1
-    laptime_anomaly_threshold = q3 + k * iqr
+    laptime_anomaly_threshold = anomalous_lap_cutoff(Q_session.results, k, sketch)
     
     nanoseconds = pd.Timedelta(laptime_anomaly_threshold).total_seconds() * 1e9
     # Convert nanoseconds to minutes, seconds, and milliseconds
@@ -76,6 +129,10 @@ def filter_anomalous_Q_laps(Q_session):
     # print(removed_laptimes)
     print(f"Removed {len(accurate_laps.values) - len(filtered_laps.values)} laps")
     
+    increment("laps_discarded", len(relevant_data) - len(accurate_laps))  # Inaccurate or deleted.
+    increment("laps_removed", len(accurate_laps) - len(filtered_laps))  # Slower than the cutoff.
+    increment("laps_kept", len(filtered_laps))
+    
    
     nc_drivers = [value for value in DRIVERS.keys() if value not in filtered_laps["Driver"].values]
     poor_q_drivers = [driver for driver in nc_drivers if driver in Q_session.laps["Driver"].values]
@@ -94,22 +151,37 @@ def filter_anomalous_Q_laps(Q_session):
     # def map_positions(df, values):
     #     return df.set_index('Abbreviation')['Position'].loc[values].to_dict()
     
+    # Pass the laps on in the compact form (integer ms times, categorical Driver/Team).
+    filtered_laps = compact_laps(filtered_laps)
 
     return (filtered_laps, poor_q_ranks)
 
 
 
-def return_ranked_Q_laps(df, poor_q_ranks=None):
+# Lap and sector time columns aggregated for each driver.
+LAP_TIME_COLUMNS = ["LapTime", "Sector1Time", "Sector2Time", "Sector3Time"]
+
+# (aggregation, column prefix, output key) for the two rank tables.
+RANK_TABLES = [("min", "Fastest", "Fastest Laps"), ("mean", "Average", "Average Laps")]
+
+
+def return_ranked_Q_laps(df, poor_q_ranks=None, event=None, season=SEASON):
     """
     Rank drivers based on qualifying lap data.
 
     This function takes a DataFrame `df` containing qualifying lap data and calculates ranks for drivers' fastest and
     average lap times as well as sector times. It also provides the percentage off pace compared to the fastest lap.
 
+    All minimums and means are taken in a single grouped aggregation and every column is ranked in one step.
+    Tied times share the best rank (method "min"), so equal lap times no longer break the ranking.
+
     Args:
         df (DataFrame): A DataFrame containing qualifying lap data for drivers.
         poor_q_ranks (dict, optional): A dictionary mapping drivers with poor qualifying laps to their positions.
                                        Defaults to None.
+        event (str, optional): The event the laps are from, used to look up the teams of poor qualifying drivers
+                               in the lineup registry. Defaults to None (their latest team in `season`).
+        season (int, optional): The season the laps are from. Defaults to SEASON.
 
     Returns:
         dict: A dictionary containing two DataFrames:
@@ -119,294 +191,531 @@ def return_ranked_Q_laps(df, poor_q_ranks=None):
               If `poor_q_ranks` is provided, drivers with poor qualifying laps are included with appropriate data.
     """
     
-    df['LapTime'] = pd.to_timedelta(df['LapTime'])
-
-    # Find the fastest lap time for each driver
-    fastest_lap_time = df.groupby(['Driver', 'Team'])['LapTime'].min().reset_index()
-    fastest_lap_time.rename(columns={'LapTime': 'FastestLapTime'}, inplace=True)
+    lap_stats = aggregate_lap_stats(df)
     
-    # To correct for ValueError generated by poor quali laps being excluded
-    tot_relevant_drivers = len(fastest_lap_time.values) + 1
-
-    # Sort the DataFrame by fastest lap time and assign ranks
-    df_sorted_by_fastest_lap = fastest_lap_time.sort_values('FastestLapTime').reset_index(drop=True)
-    df_sorted_by_fastest_lap["FastestLapRank"] = range(1, tot_relevant_drivers)
+    return build_rank_tables(lap_stats, poor_q_ranks, event=event, season=season)
 
-    # Find the fastest sector1 time for each driver
-    fastest_sector1_time = df.groupby(['Driver', 'Team'])['Sector1Time'].min().reset_index()
-    fastest_sector1_time.rename(columns={'Sector1Time': 'FastestSector1Time'}, inplace=True)
 
-    # Sort the DataFrame by fastest sector1 time and assign ranks
-    df_sorted_by_fastest_sector1 = fastest_sector1_time.sort_values('FastestSector1Time').reset_index(drop=True)
-    df_sorted_by_fastest_sector1["FastestSector1Rank"] = range(1, tot_relevant_drivers)
+def aggregate_lap_stats(df):
+    """
+    Aggregate the fastest and average lap and sector times for each driver in one grouped pass.
 
-    # Find the fastest sector2 time for each driver
-    fastest_sector2_time = df.groupby(['Driver', 'Team'])['Sector2Time'].min().reset_index()
-    fastest_sector2_time.rename(columns={'Sector2Time': 'FastestSector2Time'}, inplace=True)
+    Args:
+        df (DataFrame): A DataFrame containing qualifying lap data for drivers.
 
-    # Sort the DataFrame by fastest sector2 time and assign ranks
-    df_sorted_by_fastest_sector2 = fastest_sector2_time.sort_values('FastestSector2Time').reset_index(drop=True)
-    df_sorted_by_fastest_sector2["FastestSector2Rank"] = range(1, tot_relevant_drivers)
+    Returns:
+        DataFrame: One row per (Driver, Team) with a two level column index of
+                   (lap time column, "min" / "mean").
+    """
+    
+    # Aggregate on the compact table (integer milliseconds, categorical keys) and only
+    # convert the small per driver result back to Timedeltas.
+    laps = compact_laps(df[["Driver", "Team"] + LAP_TIME_COLUMNS])
+    
+    grouped = laps.groupby(["Driver", "Team"], observed=True)[LAP_TIME_COLUMNS]
+    fastest, average = grouped.min(), grouped.mean()
+    
+    return lap_stats_frame(fastest.index.get_level_values("Driver"), fastest.index.get_level_values("Team"), fastest, average)
 
-    # Find the fastest sector3 time for each driver
-    fastest_sector3_time = df.groupby(['Driver', 'Team'])['Sector3Time'].min().reset_index()
-    fastest_sector3_time.rename(columns={'Sector3Time': 'FastestSector3Time'}, inplace=True)
 
-    # Sort the DataFrame by fastest sector3 time and assign ranks
-    df_sorted_by_fastest_sector3 = fastest_sector3_time.sort_values('FastestSector3Time').reset_index(drop=True)
-    df_sorted_by_fastest_sector3["FastestSector3Rank"] = range(1, tot_relevant_drivers)
+def lap_stats_frame(drivers, teams, fastest, average):
+    """
+    Lay out per driver minimums and means (milliseconds, one column per LAP_TIME_COLUMNS) as `aggregate_lap_stats` returns them.
+    """
     
-    # Fastest Lap Rank df:
-    fl_ranks = pd.merge(fastest_lap_time, fastest_sector1_time, on=['Driver', 'Team'])
-    fl_ranks = pd.merge(fl_ranks, fastest_sector2_time, on=['Driver', 'Team'])
-    fl_ranks = pd.merge(fl_ranks, fastest_sector3_time, on=['Driver', 'Team'])
-    fl_ranks = pd.merge(fl_ranks, df_sorted_by_fastest_lap[['Driver', 'FastestLapRank']], on=['Driver'])
-    fl_ranks = pd.merge(fl_ranks, df_sorted_by_fastest_sector1[['Driver', 'FastestSector1Rank']], on=['Driver'])
-    fl_ranks = pd.merge(fl_ranks, df_sorted_by_fastest_sector2[['Driver', 'FastestSector2Rank']], on=['Driver'])
-    fl_ranks = pd.merge(fl_ranks, df_sorted_by_fastest_sector3[['Driver', 'FastestSector3Rank']], on=['Driver'])
+    # Interleave to (LapTime, min), (LapTime, mean), (Sector1Time, min), ... as agg(["min", "mean"]) lays them out.
+    times = np.stack([ms_to_timedelta(fastest), ms_to_timedelta(average)], axis=2).reshape(len(fastest), -1)
+    index = pd.MultiIndex.from_arrays([np.asarray(drivers).astype(object), np.asarray(teams).astype(object)], names=["Driver", "Team"])
     
-    fl_ranks = fl_ranks.sort_values('FastestLapRank').reset_index(drop=True)
+    return pd.DataFrame(times, index=index, columns=pd.MultiIndex.from_product([LAP_TIME_COLUMNS, ["min", "mean"]]))
+
+
+def build_rank_tables(lap_stats, poor_q_ranks=None, event=None, season=SEASON):
+    """
+    Build the "Fastest Laps" and "Average Laps" rank tables from aggregated lap stats.
+
+    Args:
+        lap_stats (DataFrame): Output of `aggregate_lap_stats`.
+        poor_q_ranks (dict, optional): A dictionary mapping drivers with poor qualifying laps to their positions.
+                                       These drivers are appended to the bottom of both tables with no times.
+        event (str, optional): The event, for the lineup lookup of poor qualifying drivers' teams.
+        season (int, optional): The season. Defaults to SEASON.
+
+    Returns:
+        dict: {"Fastest Laps": DataFrame, "Average Laps": DataFrame} in the `return_ranked_Q_laps` layout.
+    """
     
-    fastest_lap_time = pd.to_timedelta(fl_ranks.loc[0, "FastestLapTime"])  # type: ignore
-    fl_ranks["pct of pace"] = ((pd.to_timedelta(fl_ranks["FastestLapTime"]) - fastest_lap_time) / fastest_lap_time * 100)
+    output = {}
+    
+    if poor_q_ranks:
+        if event is None:
+            poor_q_teams = LINEUPS.season_teams(list(poor_q_ranks), season)
+        else:
+            poor_q_teams = LINEUPS.map_teams(list(poor_q_ranks), event, season)
+        poor_q_teams = np.asarray(poor_q_teams.astype(object), dtype=object)
+        poor_q_positions = np.asarray(list(poor_q_ranks.values()), dtype=float)
+    
+    drivers = lap_stats.index.get_level_values("Driver").values
+    teams = lap_stats.index.get_level_values("Team").values
+    
+    for agg, prefix, key in RANK_TABLES:
+        time_columns = [prefix + column for column in LAP_TIME_COLUMNS]
+        rank_columns = [prefix + column.replace("Time", "Rank") for column in LAP_TIME_COLUMNS]
+        
+        # Columns are picked by position, pandas' column selection re-indexes the Timedelta block (slowly, for NaT fill).
+        times = lap_stats.values[:, lap_stats.columns.get_indexer([(column, agg) for column in LAP_TIME_COLUMNS])].astype("timedelta64[ns]")
+        
+        # Drivers missing a sector time are ranked last for that sector, as the sort based ranking did.
+        ranks = pd.DataFrame(np.where(np.isnat(times), np.nan, times.view("int64"))).rank(method="min", na_option="bottom").values.astype(int)
+        
+        # The table is assembled column by column from arrays already in lap time rank order,
+        # which avoids pandas re-indexing the small frames on every concat and column selection.
+        order = np.argsort(ranks[:, 0], kind="mergesort")
+        times = times[order]
+        ranks = ranks[order]
+        
+        # Calculate pct off pace
+        lap_times = pd.Series(times[:, 0])
+        fastest_lap_time = lap_times.min()
+        pct_of_pace = ((lap_times - fastest_lap_time) / fastest_lap_time * 100).values
+        
+        columns = {"Driver": drivers[order], "Team": teams[order]}
+        for i, (time_column, rank_column) in enumerate(zip(time_columns, rank_columns)):
+            columns[time_column] = times[:, i]
+            columns[rank_column] = ranks[:, i]
+            if i == 0:
+                columns["pct of pace"] = pct_of_pace
+        
+        # If want to include failed qualis then can do. 
+        # If not then this is skipped (when comparing the car we do not want to take into account when the maximum of the car was not reached)
+        if poor_q_ranks:
+            poor_q_count = len(poor_q_ranks)
+            poor_q_columns = {"Driver": np.asarray(list(poor_q_ranks), dtype=object), "Team": poor_q_teams, rank_columns[0]: poor_q_positions}
+            for column, values in columns.items():
+                missing = np.full(poor_q_count, np.timedelta64("NaT", "ns")) if column in time_columns else np.full(poor_q_count, np.nan)
+                columns[column] = np.concatenate([values, poor_q_columns.get(column, missing)])
+        
+        output[key] = pd.DataFrame(columns)
     
+    return output
 
-    # Calculate average lap time for each driver
-    average_lap_time = df.groupby(['Driver', 'Team'])['LapTime'].mean().reset_index()
-    average_lap_time.rename(columns={'LapTime': 'AverageLapTime'}, inplace=True)
 
-    # Sort the DataFrame by average lap time and assign ranks
-    df_sorted_by_average_lap = average_lap_time.sort_values('AverageLapTime').reset_index(drop=True)
-    df_sorted_by_average_lap["AverageLapRank"] = range(1, tot_relevant_drivers)
+# (rank table, lap time rank column) compared between cutoffs in a sweep.
+SWEEP_RANK_COLUMNS = [("Fastest Laps", "FastestLapRank"), ("Average Laps", "AverageLapRank")]
 
-    # Calculate average sector1 time for each driver
-    average_sector1_time = df.groupby(['Driver', 'Team'])['Sector1Time'].mean().reset_index()
-    average_sector1_time.rename(columns={'Sector1Time': 'AverageSector1Time'}, inplace=True)
 
-    # Sort the DataFrame by average sector1 time and assign ranks
-    df_sorted_by_average_sector1 = average_sector1_time.sort_values('AverageSector1Time').reset_index(drop=True)
-    df_sorted_by_average_sector1["AverageSector1Rank"] = range(1, tot_relevant_drivers)
+def rank_spearman(tables, other_tables, table: str = "Fastest Laps", column: str = "FastestLapRank"):
+    """Spearman correlation of one rank column between two sets of rank tables, over the drivers timed in both."""
+    
+    def timed_ranks(tables):
+        ranked = tables[table]
+        timed = ~np.isnat(ranked[column.replace("Rank", "Time")].values)
+        return dict(zip(ranked["Driver"].values[timed], ranked[column].values[timed]))
+    
+    ranks, other_ranks = timed_ranks(tables), timed_ranks(other_tables)
+    common = [driver for driver in ranks if driver in other_ranks]
+    if len(common) < 2:
+        return np.nan
+    
+    # Pearson correlation of the (tie averaged) ranks within the common drivers.
+    paired = pd.DataFrame({"a": [ranks[driver] for driver in common], "b": [other_ranks[driver] for driver in common]}).rank()
+    return np.corrcoef(paired["a"].values, paired["b"].values)[0, 1]
+
 
-    # Calculate average sector2 time for each driver
-    average_sector2_time = df.groupby(['Driver', 'Team'])['Sector2Time'].mean().reset_index()
-    average_sector2_time.rename(columns={'Sector2Time': 'AverageSector2Time'}, inplace=True)
+def sweep_anomalous_Q_cutoffs(Q_session, ks, reference_k=2, includes_anomalous_quali=False, sketch=None, event=None, season=SEASON):
+    """
+    Filter and rank a session for many IQR multipliers at once.
 
-    # Sort the DataFrame by average sector2 time and assign ranks
-    df_sorted_by_average_sector2 = average_sector2_time.sort_values('AverageSector2Time').reset_index(drop=True)
-    df_sorted_by_average_sector2["AverageSector2Rank"] = range(1, tot_relevant_drivers)
+    The accurate laps are sorted once per driver by lap time. A cutoff then keeps a prefix of every driver's laps,
+    found with `searchsorted`, and grouped running minimums and sums over the sorted laps give each driver's
+    fastest and average times for any prefix. Every k is ranked from those without filtering the laps again,
+    with the same tables as `filter_anomalous_Q_laps` followed by `return_ranked_Q_laps`.
 
-    # Calculate average sector3 time for each driver
-    average_sector3_time = df.groupby(['Driver', 'Team'])['Sector3Time'].mean().reset_index()
-    average_sector3_time.rename(columns={'Sector3Time': 'AverageSector3Time'}, inplace=True)
+    Args:
+        Q_session: A Qualifying session object containing lap data.
+        ks (iterable): IQR multipliers to sweep.
+        reference_k (float, optional): Rank stability is measured against this k, which is added to the sweep
+                                       if it is missing. Defaults to 2.
+        includes_anomalous_quali (bool, optional): Append drivers without a competitive lap, as the scrape does.
+                                                   Defaults to False.
+        sketch (TDigest, optional): Pooled relative Q1 times, see `filter_anomalous_Q_laps`.
+        event (str, optional): The event, for the team lookup of poor qualifying drivers.
+        season (int, optional): The season. Defaults to SEASON.
 
-    # Sort the DataFrame by average sector3 time and assign ranks
-    df_sorted_by_average_sector3 = average_sector3_time.sort_values('AverageSector3Time').reset_index(drop=True)
-    df_sorted_by_average_sector3["AverageSector3Rank"] = range(1, tot_relevant_drivers)
+    Returns:
+        dict:
+            - "Summary": DataFrame with one row per k: k, Cutoff, Laps Kept, Laps Removed, Drivers Ranked, and
+              FL Spearman / AV Spearman, the rank correlation of the fastest and average lap ranks with `reference_k`.
+            - "Ranks": k -> {"Fastest Laps", "Average Laps"} as returned by `return_ranked_Q_laps`.
+              ks keeping exactly the same laps share the same tables.
+    """
     
+    ks = np.union1d(np.asarray(ks, dtype=float), [reference_k])
+    cutoffs = anomalous_lap_cutoff(Q_session.results, ks, sketch)
+    cutoffs_ms = cutoffs / np.timedelta64(1, "ms")
     
-    # Average Lap Rank df:
-   
-    av_ranks = pd.merge(average_lap_time, average_sector1_time, on=['Driver', 'Team'])
-    av_ranks = pd.merge(av_ranks, average_sector2_time, on=['Driver', 'Team'])
-    av_ranks = pd.merge(av_ranks, average_sector3_time, on=['Driver', 'Team'])
-    av_ranks = pd.merge(av_ranks, df_sorted_by_average_lap[['Driver', 'AverageLapRank']], on=['Driver'])
-    av_ranks = pd.merge(av_ranks, df_sorted_by_average_sector1[['Driver', 'AverageSector1Rank']], on=['Driver'])
-    av_ranks = pd.merge(av_ranks, df_sorted_by_average_sector2[['Driver', 'AverageSector2Rank']], on=['Driver'])
-    av_ranks = pd.merge(av_ranks, df_sorted_by_average_sector3[['Driver', 'AverageSector3Rank']], on=['Driver'])
-
-    av_ranks = av_ranks.sort_values('AverageLapRank').reset_index(drop=True)
-    
-    # Calculate pct off pace
-    fastest_lap_time = pd.to_timedelta(av_ranks.loc[0, "AverageLapTime"])  # type: ignore
-    av_ranks["pct of pace"] = ((pd.to_timedelta(av_ranks["AverageLapTime"]) - fastest_lap_time) / fastest_lap_time * 100)
-    
-    # # Reorder the columns as requested
-    av_ranks = av_ranks[[
-        'Driver', 'Team',  
-        'AverageLapTime', 'AverageLapRank', "pct of pace",
-        'AverageSector1Time', "AverageSector1Rank", 
-        'AverageSector2Time', "AverageSector2Rank", 
-        'AverageSector3Time', "AverageSector3Rank"
-    ]]
-    
-    #av_ranks = av_ranks.set_index("Driver")
-    
-    fl_ranks = fl_ranks[[
-        'Driver', 'Team',  
-        'FastestLapTime', 'FastestLapRank', "pct of pace",
-        'FastestSector1Time', "FastestSector1Rank",
-        'FastestSector2Time', "FastestSector2Rank",
-        'FastestSector3Time', "FastestSector3Rank"
-    ]]
-
-    #fl_ranks = fl_ranks.set_index("Driver")
-    
-    # If want to include failed qualis then can do. 
-    # If not then this is skipped (when comparing the car we do not want to take into account when the maximum of the car was not reached)
+    relevant_data = Q_session.laps[["Driver", "Team"] + LAP_TIME_COLUMNS + ["IsAccurate", "Deleted"]]
+    accurate_laps = relevant_data[(relevant_data["IsAccurate"] == True) & (relevant_data["Deleted"] == False)]
+    laps = compact_laps(accurate_laps[["Driver", "Team"] + LAP_TIME_COLUMNS])
+    laps = laps[laps["LapTime"].notna()]
+    
+    # Sort by driver, then lap time, so each driver's kept laps are a prefix of their block.
+    times = laps[LAP_TIME_COLUMNS].to_numpy(dtype=float, na_value=np.nan)
+    codes = laps["Driver"].cat.codes.values
+    order = np.lexsort((times[:, 0], codes))
+    times, codes = times[order], codes[order]
+    teams = laps["Team"].values[order]
+    
+    n_drivers = len(laps["Driver"].cat.categories)
+    starts = np.searchsorted(codes, np.arange(n_drivers))
+    
+    # Laps kept per (driver, k): lap times are offset per driver so one searchsorted covers every driver.
+    span = np.nanmax(np.concatenate([times[:, 0], cutoffs_ms])) + 1 if len(times) else 1
+    keys = codes * span + times[:, 0]
+    kept = np.searchsorted(keys, np.arange(n_drivers)[:, None] * span + cutoffs_ms[None, :], side="right") - starts[:, None]
+    
+    # Running minimums, sums and counts within each driver's block, missing sector times skipped.
+    present = ~np.isnan(times)
+    blocks = pd.DataFrame(np.where(present, times, np.inf)).groupby(codes)
+    running_min = blocks.cummin().values
+    running_sum = pd.DataFrame(np.where(present, times, 0.0)).groupby(codes).cumsum().values
+    running_count = pd.DataFrame(present.astype(np.int64)).groupby(codes).cumsum().values
+    
+    drivers = np.asarray(laps["Driver"].cat.categories, dtype=object)
+    session_drivers = set(Q_session.laps["Driver"].values)
+    positions = Q_session.results[["Abbreviation", "Position"]].set_index("Abbreviation")["Position"]
+    
+    summary = []
+    output = {}
+    tables = {}  # Laps kept per driver -> rank tables, neighbouring ks often keep exactly the same laps.
+    for i, k in enumerate(ks):
+        ranked = np.flatnonzero(kept[:, i] > 0)
+        summary.append({"k": k, "Cutoff": cutoffs[i], "Laps Kept": int(kept[:, i].sum()),
+                        "Laps Removed": len(accurate_laps) - int(kept[:, i].sum()), "Drivers Ranked": len(ranked)})
+        
+        key = kept[:, i].tobytes()
+        if key in tables:
+            output[k] = tables[key]
+            continue
+        last = starts[ranked] + kept[ranked, i] - 1
+        
+        counts = running_count[last]
+        fastest = np.where(counts > 0, running_min[last], np.nan)
+        with np.errstate(invalid="ignore"):
+            average = running_sum[last] / counts
+        
+        lap_stats = lap_stats_frame(drivers[ranked], teams[last], fastest, average)
+        
+        poor_q_ranks = None
+        if includes_anomalous_quali:
+            competitive = set(drivers[ranked])
+            poor_q_drivers = [driver for driver in DRIVERS if driver not in competitive and driver in session_drivers]
+            poor_q_ranks = positions.loc[poor_q_drivers].to_dict() if poor_q_drivers else None
+        
+        output[k] = tables[key] = build_rank_tables(lap_stats, poor_q_ranks, event=event, season=season)
     
-    if poor_q_ranks:
-        for driver in poor_q_ranks:
-            fldata = {
-                'Driver': driver,
-                'Team':get_constructor(driver),  
-                'FastestLapTime': None,
-                'FastestLapRank': poor_q_ranks[driver], 
-                'FastestSector1Time': None,
-                "FastestSector1Rank": None,
-                'FastestSector2Time': None,
-                "FastestSector2Rank": None,
-                'FastestSector3Time': None,
-                "FastestSector3Rank": None
-            }
-            
-            avdata = {
-                'Driver': driver,
-                'Team':get_constructor(driver),  
-                'AverageLapTime': None,
-                'AverageLapRank': poor_q_ranks[driver], 
-                'AverageSector1Time': None,
-                "AverageSector1Rank": None,
-                'AverageSector2Time': None,
-                "AverageSector2Rank": None,
-                'AverageSector3Time': None,
-                "AverageSector3Rank": None
-            }
-            
-            fl_ranks.loc[len(fl_ranks)] = fldata #type: ignore
-            av_ranks.loc[len(av_ranks)] = avdata #type: ignore
-
-    return {"Fastest Laps": fl_ranks, "Average Laps": av_ranks}
-
-
-def pick_lead_driver(df, selection = "FL" or "AV"):
+    summary = pd.DataFrame(summary)
+    for (table, column), name in zip(SWEEP_RANK_COLUMNS, ("FL Spearman", "AV Spearman")):
+        correlations = {id(ranks): rank_spearman(ranks, output[reference_k], table, column) for ranks in tables.values()}
+        summary[name] = [correlations[id(output[k])] for k in ks]
+    
+    return {"Summary": summary, "Ranks": output}
+
+
+def _sort_codes(values):
+    """Integer codes that sort like `values`, missing values last."""
+    
+    codes, uniques = pd.factorize(values, sort=True)
+    return np.where(codes < 0, len(uniques), codes)
+
+
+def pick_lead_driver(df, selection = "FL" or "AV", by=None):
     """
     Pick the lead driver from each team based on qualifying lap data.
 
     This function takes a DataFrame `df` containing qualifying lap data and selects the lead driver for each team
     based on either fastest lap or average lap time.
+    
+    The best ranked driver of each team is kept, so teams that ran three drivers in a session are handled too,
+    and the selection is vectorized (a sort and a de-duplication) rather than a callback per team.
 
     Args:
         df (DataFrame): A DataFrame containing ranked qualifying lap data for drivers.
         selection (str, optional): Selection criteria for picking the lead driver.
                                    Choose between "FL" (Fastest Lap) or "AV" (Average Lap).
                                    Defaults to "FL".
+        by (list, optional): Columns identifying sessions in a stacked multi-session table, e.g. ["Event", "Session"].
+                             Lead drivers are then picked and re-ranked within each session. Defaults to None.
 
     Returns:
         DataFrame: A DataFrame with the lead drivers for each team based on the specified selection criteria.
                    The DataFrame includes updated ranks and lap times according to the chosen selection.
     """
     
-    if selection == "FL":
-        result = df.groupby('Team').apply(lambda x: x.drop(x['FastestLapRank'].idxmax()) if len(x) > 1 else x)
-        result = result.sort_values('FastestLapTime').reset_index(drop=True)
-        result['FastestLapRank'] = result['FastestLapTime'].rank(method='min')
-        # result['FastestSector1Rank'] = result['FastestSector1Time'].rank(method='min')
-        # result['FastestSector2Rank'] = result['FastestSector2Time'].rank(method='min')
-        # result['FastestSector3Rank'] = result['FastestSector3Time'].rank(method='min')
-        return result
-        
-    if selection == "AV":
-        result = df.groupby('Team').apply(lambda x: x.drop(x['AverageLapRank'].idxmax()) if len(x) > 1 else x)
-        result = result.sort_values('AverageLapTime').reset_index(drop=True)
-        result['AverageLapRank'] = result['AverageLapTime'].rank(method='min')
-        return result
-
-
-def return_quali_ranks_per_session(Q_session):
-    
-    results = Q_session.results
-    
-    results = results.sort_values('Q1').reset_index(drop=True)
-    fastest_q1 = pd.to_timedelta(results.loc[0, "Q1"])  # type: ignore
-    results["Q1 pct"] = ((pd.to_timedelta(results["Q1"]) - fastest_q1) / fastest_q1 * 100)
-    
-    results = results.sort_values('Q2').reset_index(drop=True)
-    fastest_q2 = pd.to_timedelta(results.loc[0, "Q2"])  # type: ignore
-    results["Q2 pct"] = ((pd.to_timedelta(results["Q2"]) - fastest_q2) / fastest_q2 * 100)
+    rank_column, time_column = {"FL": ("FastestLapRank", "FastestLapTime"), "AV": ("AverageLapRank", "AverageLapTime")}[selection]
+    by = list(by or [])
     
-    results = results.sort_values('Q3').reset_index(drop=True)
-    fastest_q3 = pd.to_timedelta(results.loc[0, "Q3"])  # type: ignore
-    results["Q3 pct"] = ((pd.to_timedelta(results["Q3"]) - fastest_q3) / fastest_q3 * 100)
+    # Orders are worked out on arrays and the rows taken once, pandas' sort_values re-indexes the Timedelta columns slowly.
+    keys = [_sort_codes(df[column].values) for column in by + ["Team"]]
+    ranks = df[rank_column].to_numpy(dtype=float, na_value=np.nan)
+    times = df[time_column].values.astype("timedelta64[ns]")
+    times = np.where(np.isnat(times), np.nan, times.view("int64").astype(float))
     
+    # Best ranked driver per (session,) team: sort by (session, team, rank) and keep the first of each group.
+    order = np.lexsort([ranks] + keys[::-1])
+    group_keys = np.stack([key[order] for key in keys])
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (group_keys[:, 1:] != group_keys[:, :-1]).any(axis=0)
+    leads = order[first]
     
+    # Then by (session,) time, NaT last as sort_values puts it.
+    leads = leads[np.lexsort([times[leads]] + [key[leads] for key in keys[:-1]][::-1])]
+    result = pd.DataFrame({column: df[column].values[leads] for column in df.columns})
+    if by:
+        result[rank_column] = result.groupby(by)[time_column].rank(method='min')
+    else:
+        result[rank_column] = result[time_column].rank(method='min')
+    # result['FastestSector1Rank'] = result['FastestSector1Time'].rank(method='min')
+    # result['FastestSector2Rank'] = result['FastestSector2Time'].rank(method='min')
+    # result['FastestSector3Rank'] = result['FastestSector3Time'].rank(method='min')
     
-    # results["Av pct"] = results[["Q1 pct", "Q2 pct", "Q3 pct"]].mean(axis=1, skipna=True)
-    
-    # final = results[["Position", "Abbreviation", "Q1 pct",  "Q2 pct",  "Q3 pct", "Av pct"]]
-    # final = final.sort_values("Av pct")
-    
-    
-    threshold = 10  # Change this to the desired threshold value
+    return result
 
-    # Filter out values above the threshold
-    results.loc[
-        (results["Q1 pct"].abs() > threshold) |
-        (results["Q2 pct"].abs() > threshold) |
-        (results["Q3 pct"].abs() > threshold),
-        ["Q1 pct", "Q2 pct", "Q3 pct"]
-    ] = np.nan
 
+QUALI_SEGMENTS = ["Q1", "Q2", "Q3"]
 
-    # Calculate the average of the filtered percentage change columns using numpy.nanmean()
-    results["Av pct"] = results[["Q1 pct", "Q2 pct", "Q3 pct"]].apply(
-        lambda row: np.nan if np.isnan(row).all() else np.nanmean(row) if np.count_nonzero(~np.isnan(row)) > 0 else np.nan,
-        axis=1
-    )
 
-    final = results[["Position", "Abbreviation", "Q1 pct", "Q2 pct", "Q3 pct", "Av pct"]]
-    final = final.sort_values("Av pct")
+def return_quali_ranks_per_session(Q_session, threshold=10):
+    """
+    Calculate each driver's pct off the fastest time in Q1, Q2 and Q3 and their average.
+
+    Args:
+        Q_session: A Qualifying session object containing results.
+        threshold (float, optional): Drivers more than this pct off pace in any segment have all their pcts removed.
+                                     Defaults to 10.
+
+    Returns:
+        DataFrame: Position, Abbreviation, Q1 pct, Q2 pct, Q3 pct and Av pct, sorted by Av pct.
+    """
     
-    return final
+    return return_quali_ranks_batch({0: Q_session}, threshold=threshold)[0]
+
+
+def return_quali_ranks_batch(Q_sessions, threshold=10):
+    """
+    Calculate `return_quali_ranks_per_session` for many sessions in one vectorized pass.
 
+    All results are stacked into one int64 nanosecond matrix. Each session's fastest time per segment is a
+    column-wise reduction over its block of rows, and the threshold masking and nan-aware averaging are
+    single array operations over every session at once.
 
+    Args:
+        Q_sessions (dict): Key -> Qualifying session object (anything with a `results` DataFrame).
+        threshold (float, optional): Drivers more than this pct off pace in any segment have all their pcts removed.
+                                     Defaults to 10.
 
+    Returns:
+        dict: Key -> DataFrame as returned by `return_quali_ranks_per_session`.
+    """
     
-    # relevant_data = Q_session.laps # [["Driver", "Team", "LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "TyreLife", "IsAccurate", "Deleted"]]
-    # accurate_laps = relevant_data[(relevant_data["IsAccurate"] == True) & (relevant_data["Deleted"] == False)]
-      
-    # q1, q2, q3 = accurate_laps.split_qualifying_sessions()
+    keys = list(Q_sessions)
+    results = [Q_sessions[key].results for key in keys]
+    sizes = np.array([len(result) for result in results], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
     
-    # #q1
-    # q1_fastest = q1.pick_fastest()["LapTime"]
+    columns = ["Position", "Abbreviation", "Q1 pct", "Q2 pct", "Q3 pct", "Av pct"]
+    if not sizes.sum():
+        return {key: pd.DataFrame(columns=columns) for key in keys}
     
+    stacked = pd.concat(results, ignore_index=True)
+    session_ids = np.repeat(np.arange(len(keys)), sizes)
     
+    times = np.column_stack([pd.to_timedelta(stacked[segment]).values.astype("timedelta64[ns]").view("int64") for segment in QUALI_SEGMENTS])
+    missing = times == np.iinfo(np.int64).min
     
-    # #q2 
-    # q2_fastest = q2.pick_fastest()["LapTime"]
+    # Fastest time of each segment per session, nan where nobody set a time.
+    non_empty = sizes > 0
+    fastest = np.full((len(keys), len(QUALI_SEGMENTS)), np.nan)
+    fastest[non_empty] = np.minimum.reduceat(np.where(missing, np.iinfo(np.int64).max, times), starts[non_empty], axis=0)
+    fastest[fastest == np.iinfo(np.int64).max] = np.nan
     
+    fastest = fastest[session_ids]
+    pct = np.where(missing, np.nan, (times.astype(float) - fastest) / fastest * 100)
     
-    # #q3
-    # q3_fastest = q3.pick_fastest()["LapTime"]
+    # Remove drivers above the threshold in any segment.
+    with np.errstate(invalid="ignore"):
+        pct[(np.abs(pct) > threshold).any(axis=1)] = np.nan
     
+    # nan-aware mean, nan where a driver has no valid segments.
+    counts = (~np.isnan(pct)).sum(axis=1)
+    av_pct = np.where(counts > 0, np.nansum(pct, axis=1) / np.maximum(counts, 1), np.nan)
     
-    # TODO
-    # Want to calculate the laps undertaken in each session and create ranks/pct off pace in reference to the leader for each session.
-    # in this way we can attempt to overcome any anomalous data specifically per session
-    # we can also account for wet conditions and track improvment on a dry track
+    # Index each row by its position after sorting on Q1, then Q2, then Q3 (missing times last),
+    # then order by Av pct, as the frame has always been laid out.
+    sort_times = np.where(missing, np.inf, times.astype(float))
+    q_order = np.lexsort((np.arange(len(stacked)), sort_times[:, 0], sort_times[:, 1], sort_times[:, 2], session_ids))
+    q_position = np.empty(len(stacked), dtype=np.int64)
+    q_position[q_order] = np.arange(len(stacked)) - starts[session_ids[q_order]]
     
-    # to do this we want a generalised anomalous laptime removal for each Quali Session
+    final_order = np.lexsort((q_position, np.where(np.isnan(av_pct), np.inf, av_pct), session_ids))
     
+    final = pd.DataFrame({
+        "Position": stacked["Position"].values,
+        "Abbreviation": stacked["Abbreviation"].values,
+        "Q1 pct": pct[:, 0],
+        "Q2 pct": pct[:, 1],
+        "Q3 pct": pct[:, 2],
+        "Av pct": av_pct
+    }, index=q_position).iloc[final_order]
     
-    ####### 
-    ##### fastest_lap = q1.pick_fastest()
-    #### q2.pick_fastest()["LapTime"]
+    bounds = np.cumsum(sizes)
+    return {key: final.iloc[bound - size:bound] for key, size, bound in zip(keys, sizes, bounds)}
+
+
+
+#### Per qualifying segment (Q1/Q2/Q3) analysis
+
+# Laps are ranked in reference to the leader of each segment rather than the fastest lap of the day,
+# so anomalous data, wet conditions and track improvement are handled per segment.
+# Each segment gets its own IQR cutoff, built the same way as the session cutoff in filter_anomalous_Q_laps
+# (from each driver's best lap). The number of drivers decreases from Q1 to Q3, so drivers 11 - 15 have two
+# segment ranks and the top 10 have three; these are averaged per driver.
+# I think ultimately the better cars will tend towards the top, and this reduction in anomaly may prove a better
+# representation of the cars, but it is worth comparing methods.
+
+
+def return_segment_boundaries(session_status):
+    """
+    Return the session times splitting a qualifying session into Q1, Q2 and Q3.
+
+    Follows FastF1's `Laps.split_qualifying_sessions`: each segment starts at a 'Started' status,
+    ignoring restarts after a red flag, and the last status time closes the final segment.
+
+    Args:
+        session_status (DataFrame): Session status data with Status and Time columns.
+
+    Returns:
+        ndarray: Boundary times in nanoseconds, one more than the number of segments that took place.
+    """
     
-    # get fastest for each driver and calc pct off pace. 
+    split_times = []
+    session_suspended = False
+    for status, time in zip(session_status["Status"], session_status["Time"]):
+        if status == "Started":
+            if not session_suspended:
+                split_times.append(time)
+            else:
+                session_suspended = False
+        elif status == "Aborted":
+            session_suspended = True
+        elif status == "Finished":
+            session_suspended = False
     
+    split_times.append(session_status["Time"].iloc[-1])
     
-    # Then we want to generate the ranks for each session (the number of drivers will decrease from Q1 to Q2 rto Q3)
+    return pd.to_timedelta(split_times).values.astype("timedelta64[ns]").view("int64")
+
+
+def return_segment_ranks(Q_session, k=2):
+    """
+    Split a qualifying session into Q1/Q2/Q3, filter anomalies per segment and rank drivers within each segment.
+
+    Args:
+        Q_session: A Qualifying session object with `laps` (including Time) and `session_status`.
+        k (float, optional): IQR multiplier for each segment's anomaly cutoff. Defaults to 2.
+
+    Returns:
+        dict: As returned by `return_segment_ranks_batch`, without the Session column.
+    """
+    
+    output = return_segment_ranks_batch({0: Q_session}, k=k)
+    
+    return {name: df.drop(columns="Session") for name, df in output.items()}
+
+
+def return_segment_ranks_batch(Q_sessions, k=2):
+    """
+    Run the per segment anomaly filtering and ranking over many sessions in one vectorized pass.
+
+    Every lap of every session is labelled with its segment by comparing its session time against a
+    (session x boundary) matrix, the cutoffs come from grouped quantiles and the ranks from grouped ranks,
+    so there are no per session or per segment Python loops over the lap data.
+
+    Args:
+        Q_sessions (dict): Key -> Qualifying session object with `laps` (including Time) and `session_status`.
+        k (float, optional): IQR multiplier for each segment's anomaly cutoff. Defaults to 2.
+
+    Returns:
+        dict: A dictionary containing two DataFrames:
+            - "Segments": Session, Segment, Driver, Team, BestLapTime, SegmentRank, pct of pace and Laps,
+              one row per driver per segment they set a competitive lap in.
+            - "Drivers": Session, Driver, Team, Segments, Average Segment Rank and Avg pct of segment pace.
+    """
     
-    # Finally we are left with the question of what to do with the duplicate ranks.
-    # Averaging the ranks may take into account more poor performances, but the opposite affect happens when taking the best performances
-    # LAst five drivers clearly get their ranks decided in the Q1 session analysis, 
-    # drivers 11 - 15 have two sessions to choose from. They will have two ranks, which can be averaged.
-    # Each of these ranks are in comparison to the fastest laptime of the session, rather than the fastest laptime of the day
-    # This raises a question around strategy.
-    # I think ultimately the better cars will tend towards the top, and this reduction in anomaly may prove a better representation of the cars,
-    # but it is worth comparing methods
+    keys = list(Q_sessions)
     
+    # (session x boundary) matrix, padded with inf where a segment did not take place.
+    boundaries = np.full((len(keys), len(QUALI_SEGMENTS) + 1), np.inf)
+    boundary_counts = np.zeros(len(keys), dtype=np.int64)
+    for i, key in enumerate(keys):
+        session_boundaries = return_segment_boundaries(Q_sessions[key].session_status)[:len(QUALI_SEGMENTS) + 1]
+        boundaries[i, :len(session_boundaries)] = session_boundaries
+        boundary_counts[i] = len(session_boundaries)
     
-    # To remove anomalous laps, and then create a pace ranking, this would be combining the above two functions together, I propose a blank anomaly function
-    # followed by a ranking function. As in this case we are not concerned with the average laps (other method is fairer as it considers all laps)
-    # Ranking function to only consider percentage off pace per quali - should be simpler.
-    ...
\ No newline at end of file
+    laps = pd.concat(
+        [Q_sessions[key].laps[["Driver", "Team", "LapTime", "Time", "IsAccurate", "Deleted"]].assign(SessionId=i) for i, key in enumerate(keys)],
+        ignore_index=True
+    )
+    laps = laps[(laps["IsAccurate"] == True) & (laps["Deleted"] == False) & laps["LapTime"].notna() & laps["Time"].notna()]
+    
+    session_ids = laps["SessionId"].values
+    lap_times = pd.to_timedelta(laps["LapTime"]).values.astype("timedelta64[ns]").view("int64").astype(float)
+    session_times = pd.to_timedelta(laps["Time"]).values.astype("timedelta64[ns]").view("int64").astype(float)
+    
+    # Segment number = boundaries passed before the lap was completed, valid from 1 up to the segments that ran.
+    segments = (session_times[:, None] > boundaries[session_ids]).sum(axis=1)
+    in_segment = (segments >= 1) & (segments < boundary_counts[session_ids])
+    
+    laps = pd.DataFrame({
+        "SessionId": session_ids[in_segment],
+        "Segment": segments[in_segment],
+        "Driver": laps["Driver"].values[in_segment],
+        "Team": laps["Team"].values[in_segment],
+        "LapTime": lap_times[in_segment]
+    })
+    
+    # Per segment IQR cutoff over each driver's best lap.
+    best_laps = laps.groupby(["SessionId", "Segment", "Driver"])["LapTime"].min()
+    quartiles = best_laps.groupby(level=["SessionId", "Segment"]).quantile([0.25, 0.75]).unstack()
+    cutoffs = quartiles[0.75] + k * (quartiles[0.75] - quartiles[0.25])
+    
+    segment_index = pd.MultiIndex.from_arrays([laps["SessionId"], laps["Segment"]])
+    laps = laps[laps["LapTime"].values <= cutoffs.reindex(segment_index).values]
+    
+    # Rank every driver against the leader of their segment.
+    ranks = laps.groupby(["SessionId", "Segment", "Driver", "Team"])["LapTime"].agg(["min", "size"]).reset_index()
+    ranks.columns = ["SessionId", "Segment", "Driver", "Team", "BestLapTime", "Laps"]
+    
+    segment_groups = ranks.groupby(["SessionId", "Segment"])["BestLapTime"]
+    fastest = segment_groups.transform("min")
+    ranks["SegmentRank"] = segment_groups.rank(method="min")
+    ranks["pct of pace"] = (ranks["BestLapTime"] - fastest) / fastest * 100
+    
+    ranks = ranks.sort_values(["SessionId", "Segment", "SegmentRank"], kind="mergesort").reset_index(drop=True)
+    
+    drivers = ranks.groupby(["SessionId", "Driver", "Team"]).agg(
+        Segments=("Segment", "size"),
+        **{"Average Segment Rank": ("SegmentRank", "mean"), "Avg pct of segment pace": ("pct of pace", "mean")}
+    ).reset_index()
+    drivers = drivers.sort_values(["SessionId", "Avg pct of segment pace"], kind="mergesort").reset_index(drop=True)
+    
+    # Back to session keys, segment names and display Timedeltas.
+    session_keys = dict(enumerate(keys))
+    ranks.insert(0, "Session", ranks.pop("SessionId").map(session_keys))
+    drivers.insert(0, "Session", drivers.pop("SessionId").map(session_keys))
+    ranks["Segment"] = np.array(QUALI_SEGMENTS)[ranks["Segment"].values - 1]
+    ranks["BestLapTime"] = pd.to_timedelta(ranks["BestLapTime"].round().astype("int64"), unit="ns")
+    
+    ranks = ranks[["Session", "Segment", "Driver", "Team", "BestLapTime", "SegmentRank", "pct of pace", "Laps"]]
+    
+    return {"Segments": ranks, "Drivers": drivers}
@@ -1,18 +1,18 @@
-import fastf1
-from matplotlib import pyplot as plt
-import fastf1.plotting
-import fastf1.events
 import pandas as pd
 import numpy as np
-
-from statistics import mean
-from statistics import StatisticsError
-
-from q_helpers import filter_anomalous_Q_laps, return_ranked_Q_laps, check_average_laps, pick_lead_driver
+from concurrent.futures import ProcessPoolExecutor
+
+from q_helpers import filter_anomalous_Q_laps, return_ranked_Q_laps, check_average_laps, pick_lead_driver, return_segment_ranks_batch, q1_pace_sketch, sweep_anomalous_Q_cutoffs, ANALYSIS_VERSION
+from session_loader import get_quali_session, registry_stats, return_season_sessions
+from lineups import LINEUPS
+from warehouse import WAREHOUSE_DIR, ingest_session, query_catalog, read_partition
+from rank_cache import cached_frames, cache_stats
+from track_evolution import correct_track_evolution_batch
+from tyre_normalisation import season_tyre_coefficients, normalise_tyre_life
+from instrumentation import span, reset_instrumentation, instrumentation_snapshot, merge_instrumentation
+from scrape_manifest import MANIFEST_DIR, session_key, load_manifest, save_manifest, is_processed, record_session
 from constants import *
 
-fastf1.Cache.enable_cache(r"M:\Coding\F1DataAnalysis\FastF1Cache")
-
 
 # We want one scrape to then collate all data into one structure.
 # First we scrape the races into new function adapted from below:
@@ -20,7 +20,41 @@ fastf1.Cache.enable_cache(r"M:\Coding\F1DataAnalysis\FastF1Cache")
 
 # From this output each DF can be averaged and calculated. This prevents scraping the data more than once, which is the rate limiting step.
 
-def return_race_quali_ranks(race: str, quali_type: str | int = "Q" or 3, includes_anomalous_quali: bool = False):
+def load_filtered_session(race: str, quali_type: str | int = "Q", year: int = SEASON, laps_only: bool = True, k: float = 2,
+                          warehouse_dir: str | None = WAREHOUSE_DIR):
+    """
+    Load a qualifying session, filter its anomalous laps and add it to the lap warehouse.
+
+    The session's results also update the shared lineup registry.
+
+    Args:
+        race (str): The name of the race session.
+        quali_type (str or int, optional): "Q" for standard qualifying or the sprint qualifying session number. Defaults to "Q".
+        year (int, optional): The season. Defaults to SEASON.
+        laps_only (bool, optional): Load only the lap timing and results. Defaults to True.
+        k (float, optional): IQR multiplier for the anomalous lap cutoff. Defaults to 2.
+        warehouse_dir (str, optional): Lap warehouse to ingest into, None to skip ingestion.
+
+    Returns:
+        tuple: (filtered_laps, poor_q_ranks) as returned by `filter_anomalous_Q_laps`.
+    """
+    
+    Q = get_quali_session(race, quali_type, year=year, laps_only=laps_only) # Update logic here to stop trying to load races before the date of their arrival.
+    
+    LINEUPS.add_results(year, race, Q.results)
+    
+    with span("filter", year=year, event=race, session=quali_type):
+        quali_filtered_laps, poor_quali_ranks = filter_anomalous_Q_laps(Q, k=k)
+    
+    if warehouse_dir is not None:
+        session_name = "Qualifying" if quali_type == "Q" else "Sprint"
+        ingest_session(year, race, session_name, quali_filtered_laps, poor_quali_ranks, Q.results, k=k, version=ANALYSIS_VERSION, warehouse_dir=warehouse_dir)
+    
+    return quali_filtered_laps, poor_quali_ranks
+
+
+def return_race_quali_ranks(race: str, quali_type: str | int = "Q" or 3, includes_anomalous_quali: bool = False, laps_only: bool = True, k: float = 2, use_cache: bool = True,
+                            year: int = SEASON, track_evolution: bool = False, tyre_normalisation: bool = False):
     """
     Return ranked qualifying lap data for a specific race session.
 
@@ -34,6 +68,18 @@ def return_race_quali_ranks(race: str, quali_type: str | int = "Q" or 3, include
                                            Defaults to "Q".
         includes_anomalous_quali (bool, optional): Whether to include anomalies in lap times.
                                                    Defaults to False.
+        laps_only (bool, optional): Load only the lap timing and results needed for ranking,
+                                    skipping telemetry and weather. Defaults to True.
+        k (float, optional): IQR multiplier for the anomalous lap cutoff. Defaults to 2.
+        use_cache (bool, optional): Reuse rank frames stored in the rank cache for the same session and settings,
+                                    skipping the load and filter entirely (the event's lineup, stored alongside,
+                                    is still registered). Defaults to True.
+        year (int, optional): The season. Defaults to SEASON.
+        track_evolution (bool, optional): Correct lap and sector times for the track getting faster through the session
+                                          before ranking, see `track_evolution`. Defaults to False.
+        tyre_normalisation (bool, optional): Move lap and sector times to a fresh tyre before ranking, using the
+                                             cached degradation slopes of the track (fitted from this session if
+                                             none are cached), see `tyre_normalisation`. Defaults to False.
 
     Returns:
         dict: A dictionary containing two DataFrames:
@@ -42,30 +88,90 @@ def return_race_quali_ranks(race: str, quali_type: str | int = "Q" or 3, include
               Both DataFrames include columns for Driver, Team, lap times, ranks, and percentage off pace.
     """    
     
-    Q = fastf1.get_session(2023, race, quali_type) # Update logic here to stop trying to load races before the date of their arrival.
-    Q.load()
-    
-    quali_filtered_laps, poor_quali_ranks = filter_anomalous_Q_laps(Q)
-    
-    if includes_anomalous_quali:
-        Q_ranks = return_ranked_Q_laps(quali_filtered_laps, poor_quali_ranks)
+    def rank_session():
+        quali_filtered_laps, poor_quali_ranks = load_filtered_session(race, quali_type, year=year, laps_only=laps_only, k=k)
+        
+        if track_evolution or tyre_normalisation:
+            quali_filtered_laps, = correct_sessions([(year, race, quali_filtered_laps)], track_evolution=track_evolution, tyre_normalisation=tyre_normalisation)
         
+        with span("rank", year=year, event=race, session=quali_type):
+            if includes_anomalous_quali:
+                Q_ranks = return_ranked_Q_laps(quali_filtered_laps, poor_quali_ranks, event=race, season=year)
+            else:
+                Q_ranks = return_ranked_Q_laps(quali_filtered_laps, event=race, season=year)
+        
+        # The event's lineup is stored with the ranks, so a cache hit registers it just as loading the session does.
+        lineup = LINEUPS.lineups.get((year, race), {})
+        Q_ranks["Lineup"] = pd.DataFrame({"Abbreviation": pd.Series(list(lineup), dtype=object),
+                                          "TeamName": pd.Series(list(lineup.values()), dtype=object)})
+        return Q_ranks
+    
+    if not use_cache:
+        Q_ranks = rank_session()
     else:
-        Q_ranks = return_ranked_Q_laps(quali_filtered_laps)
+        cache_key = {
+            "kind": "quali_ranks", "year": year, "race": race, "quali_type": str(quali_type),
+            "k": k, "includes_anomalous_quali": includes_anomalous_quali, "track_evolution": track_evolution,
+            "tyre_normalisation": tyre_normalisation, "version": ANALYSIS_VERSION
+        }
+        Q_ranks = cached_frames(cache_key, rank_session, required=["Lineup"])
+    
+    LINEUPS.add_results(year, race, Q_ranks.pop("Lineup"))
     
     return Q_ranks
 
 
 
-def scrape_all_quali_laps(includes_anomalous_quali: bool = False):   
+def correct_sessions(sessions, track_evolution: bool = False, tyre_normalisation: bool = False):
+    """
+    Apply the lap time corrections to many sessions' filtered laps, batched across them.
+
+    Tyre slopes are fitted per season from all of its sessions at once, so both sessions of a sprint weekend
+    count towards their track's slopes, then every session's track evolution is removed in one batched fit.
+
+    Args:
+        sessions (list): (season, event, filtered laps) of every session.
+        track_evolution (bool, optional): Correct for track evolution, see `correct_track_evolution_batch`. Defaults to False.
+        tyre_normalisation (bool, optional): Move every lap to a fresh tyre first, see `season_tyre_coefficients`. Defaults to False.
+
+    Returns:
+        list: The corrected laps of every session, in the order of `sessions`.
+    """
+    
+    lap_frames = [laps for _, _, laps in sessions]
+    
+    if tyre_normalisation:
+        with span("tyre_normalisation", sessions=len(sessions)):
+            for season in dict.fromkeys(season for season, _, _ in sessions):
+                positions = [i for i, (session_season, _, _) in enumerate(sessions) if session_season == season]
+                coefficients = season_tyre_coefficients([lap_frames[i] for i in positions], [sessions[i][1] for i in positions], season=season)
+                for i in positions:
+                    lap_frames[i] = normalise_tyre_life(lap_frames[i], coefficients[sessions[i][1]])
+    
+    if track_evolution:
+        with span("track_evolution", sessions=len(sessions)):
+            lap_frames, _ = correct_track_evolution_batch(lap_frames)
+    
+    return lap_frames
+
+
+
+def scrape_all_quali_laps(includes_anomalous_quali: bool = False, year: int = SEASON, track_evolution: bool = False, tyre_normalisation: bool = False):
     """
     Scrape qualifying data for races and sprints.
 
     This function scrapes qualifying data for all specified races and associated sprints, if applicable.
     It uses the provided parameters to fetch qualifying ranks for each race and sprint.
 
+    Without corrections every session goes through `return_race_quali_ranks` and its rank cache. With track
+    evolution or tyre normalisation, every session's filtered laps are loaded first and corrected together
+    with `correct_sessions`, so the tyre slopes come from the whole season, then each session is ranked.
+
     Args:
         includes_anomalous_quali (bool, optional): If True, includes anomalous qualifying data. Defaults to False.
+        year (int, optional): The season, its sessions come from `return_season_sessions`. Defaults to SEASON.
+        track_evolution (bool, optional): Correct every session for track evolution before ranking. Defaults to False.
+        tyre_normalisation (bool, optional): Move every lap to a fresh tyre before ranking. Defaults to False.
 
     Returns:
         dict: A dictionary containing scraped qualifying data for races and sprints.
@@ -82,33 +188,396 @@ def scrape_all_quali_laps(includes_anomalous_quali: bool = False):
                       ...
                   }
               }
-              If scraping encounters an error for any race, it will be omitted from the dictionary.
+              If scraping encounters an error for any session (e.g. one that has not happened yet), it is omitted
+              from the dictionary and the rest of the season is still scraped.
+              "Status" holds one row per session with columns Event, Session, Success and Error,
+              as in `scrape_all_quali_laps_parallel`.
     """
     print("Scraping qualifying data")
    
     race_output = {}
     sprint_output = {}
+    status = []
+    corrected = track_evolution or tyre_normalisation
+    loaded = []  # (race, output, filtered laps, poor quali ranks) of every session to correct
     
-    for race in RACES:
-        print(f"Scraping {race}")
-        try:    
-            quali_ranks = return_race_quali_ranks(race=race, quali_type="Q", includes_anomalous_quali=includes_anomalous_quali)
-            race_output[race] = quali_ranks
-
-            if race in SPRINTS:
-                sprint_ranks = return_race_quali_ranks(race=race, quali_type=3, includes_anomalous_quali=includes_anomalous_quali)
-                sprint_output[race] = sprint_ranks
-                
+    for race, quali_type in return_season_sessions(year):
+        output = race_output if quali_type == "Q" else sprint_output
+        session_name = "Qualifying" if quali_type == "Q" else "Sprint"
+        print(f"Scraping {race} {session_name}")
+        
+        error = None
+        try:
+            if corrected:
+                loaded.append((race, output, *load_filtered_session(race, quali_type, year=year)))
+            else:
+                output[race] = return_race_quali_ranks(race=race, quali_type=quali_type, includes_anomalous_quali=includes_anomalous_quali, year=year)
         except Exception as e:
-            print(f"Cannot scrape {race} as: {e}")
-            break
+            error = f"{type(e).__name__}: {e}"
+            print(f"Cannot scrape {race} {session_name} as: {error}")
+        
+        status.append({"Event": race, "Session": session_name, "Success": error is None, "Error": error})
+    
+    if loaded:
+        lap_frames = correct_sessions([(year, race, laps) for race, _, laps, _ in loaded], track_evolution=track_evolution, tyre_normalisation=tyre_normalisation)
+        for (race, output, _, poor_quali_ranks), laps in zip(loaded, lap_frames):
+            with span("rank", year=year, event=race):
+                output[race] = return_ranked_Q_laps(laps, poor_quali_ranks if includes_anomalous_quali else None, event=race, season=year)
+    
+    status = pd.DataFrame(status, columns=["Event", "Session", "Success", "Error"])
+    print(f"Scraped {status['Success'].sum()} of {len(status)} sessions")
+    print(f"Rank cache: {cache_stats()}")
+    print(f"Sessions: {registry_stats()}")
+    
+    return {"Races": race_output, "Sprints": sprint_output, "Status": status}
+
+
+
+def _scrape_session(race: str, quali_type: str | int, includes_anomalous_quali: bool, year: int = SEASON, k: float = 2):
+    """
+    Worker for `scrape_all_quali_laps_parallel`.
+
+    Loads and ranks a single session inside a pool process. Only the small rank DataFrames are sent back,
+    along with the event's lineup (the worker's lineup registry is lost with the process) and the session's
+    instrumentation, and any exception is returned as a message so one bad session cannot stop the rest of the season.
+    """
+    # Pool processes are reused, so only this session's spans and counters go back to the parent.
+    reset_instrumentation()
+    try:
+        quali_ranks = return_race_quali_ranks(race=race, quali_type=quali_type, includes_anomalous_quali=includes_anomalous_quali, k=k, year=year)
+        return quali_ranks, LINEUPS.lineups.get((year, race)), None, instrumentation_snapshot()
+    
+    except Exception as e:
+        return None, None, f"{type(e).__name__}: {e}", instrumentation_snapshot()
+
+
+
+def scrape_all_quali_laps_parallel(includes_anomalous_quali: bool = False, workers: int | None = None, year: int = SEASON, k: float = 2):
+    """
+    Scrape qualifying data for races and sprints across a pool of worker processes.
+
+    Every race and sprint session is loaded and ranked independently, so a failing event
+    (or one that has not happened yet) is recorded and skipped rather than ending the scrape.
+
+    Args:
+        includes_anomalous_quali (bool, optional): If True, includes anomalous qualifying data. Defaults to False.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        year (int, optional): The season, its sessions come from `return_season_sessions`. Defaults to SEASON.
+        k (float, optional): IQR multiplier for the anomalous lap cutoff. Defaults to 2.
+
+    Returns:
+        dict: The same "Races" and "Sprints" dictionaries as `scrape_all_quali_laps`, plus:
+            - "Status": DataFrame with one row per session and columns Event, Session, Success and Error.
+    """
+    print("Scraping qualifying data in parallel")
+    
+    sessions = return_season_sessions(year)
+    
+    race_output = {}
+    sprint_output = {}
+    status = []
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_scrape_session, race, quali_type, includes_anomalous_quali, year, k) for race, quali_type in sessions]
+        
+        # Collect in submission order so the outputs keep the calendar ordering.
+        for (race, quali_type), future in zip(sessions, futures):
+            try:
+                quali_ranks, lineup, error, snapshot = future.result()
+                merge_instrumentation(snapshot)
+            except Exception as e:  # The worker process itself died.
+                quali_ranks, lineup, error = None, None, f"{type(e).__name__}: {e}"
+            
+            # Register the lineup here, so the downforce cube built afterwards maps drivers to the right teams.
+            if lineup:
+                LINEUPS.add_lineup(year, race, lineup)
+            
+            session_name = "Qualifying" if quali_type == "Q" else "Sprint"
+            
+            if error is None:
+                if quali_type != "Q":
+                    sprint_output[race] = quali_ranks
+                else:
+                    race_output[race] = quali_ranks
+            else:
+                print(f"Cannot scrape {race} {session_name} as: {error}")
+            
+            status.append({"Event": race, "Session": session_name, "Success": error is None, "Error": error})
+    
+    status = pd.DataFrame(status, columns=["Event", "Session", "Success", "Error"])
+    print(f"Scraped {status['Success'].sum()} of {len(status)} sessions")
     
+    return {"Races": race_output, "Sprints": sprint_output, "Status": status}
+
+
 
+def scrape_all_quali_laps_incremental(includes_anomalous_quali: bool = False, k: float = 2, year: int = SEASON, manifest_dir: str = MANIFEST_DIR):
+    """
+    Scrape qualifying data for races and sprints, only loading sessions that have not been processed before.
+
+    A manifest in `manifest_dir` records every processed session alongside the inputs it was ranked with
+    (season, event, session type, k, includes_anomalous_quali and ANALYSIS_VERSION). The rank frames themselves
+    are read back from the rank cache, so processed sessions are not loaded again and the output matches a full
+    rescrape. A session whose cached frames were evicted is simply ranked again.
+
+    Args:
+        includes_anomalous_quali (bool, optional): If True, includes anomalous qualifying data. Defaults to False.
+        k (float, optional): IQR multiplier for the anomalous lap cutoff. Defaults to 2.
+        year (int, optional): The season, its sessions come from `return_season_sessions`. Defaults to SEASON.
+        manifest_dir (str, optional): Directory holding the manifest.
+
+    Returns:
+        dict: The same "Races" and "Sprints" dictionaries as `scrape_all_quali_laps`.
+              Sessions that cannot be scraped are omitted and retried on the next call.
+    """
+    print("Scraping new qualifying data")
+    
+    manifest = load_manifest(manifest_dir)
+    
+    race_output = {}
+    sprint_output = {}
+    processed = 0
+    
+    for race, quali_type in return_season_sessions(year):
+        output = race_output if quali_type == "Q" else sprint_output
+        session_id, key = session_key(year, race, quali_type, k=k, includes_anomalous_quali=includes_anomalous_quali, version=ANALYSIS_VERSION)
+        processed_before = is_processed(manifest, session_id, key)
+        
+        if not processed_before:
+            print(f"Scraping {session_id}")
+        try:
+            quali_ranks = return_race_quali_ranks(race=race, quali_type=quali_type, includes_anomalous_quali=includes_anomalous_quali, k=k, year=year)
+        except Exception as e:
+            print(f"Cannot scrape {session_id} as: {e}")
+            continue
+        
+        if not processed_before:
+            record_session(manifest, session_id, key)
+            processed += 1
+        
+        output[race] = quali_ranks
+    
+    save_manifest(manifest, manifest_dir)
+    print(f"Scraped {processed} new sessions")
     
     return {"Races": race_output, "Sprints": sprint_output}
 
 
 
+def ingest_seasons(seasons, k: float = 2, warehouse_dir: str = WAREHOUSE_DIR):
+    """
+    Fill the lap warehouse with every qualifying session of the given seasons.
+
+    Sessions already in the warehouse for this k and ANALYSIS_VERSION are skipped without loading them,
+    and sessions that cannot be loaded are reported and left for the next call.
+
+    Args:
+        seasons (iterable): Seasons to ingest, e.g. range(2018, 2024).
+        k (float, optional): IQR multiplier for the anomalous lap cutoff. Defaults to 2.
+        warehouse_dir (str, optional): Warehouse root directory.
+
+    Returns:
+        int: The number of sessions ingested.
+    """
+    
+    ingested = query_catalog(k=k, version=ANALYSIS_VERSION, warehouse_dir=warehouse_dir)
+    done = set(zip(ingested["Season"], ingested["Event"], ingested["Session"]))
+    
+    count = 0
+    for year in seasons:
+        for race, quali_type in return_season_sessions(year):
+            session_name = "Qualifying" if quali_type == "Q" else "Sprint"
+            if (year, race, session_name) in done:
+                continue
+            
+            print(f"Ingesting {year} {race} {session_name}")
+            try:
+                load_filtered_session(race, quali_type, year=year, k=k, warehouse_dir=warehouse_dir)
+            except Exception as e:
+                print(f"Cannot ingest {year} {race} {session_name} as: {e}")
+                continue
+            count += 1
+    
+    print(f"Ingested {count} new sessions")
+    return count
+
+
+
+def return_warehouse_quali_ranks(seasons=SEASON, events=None, downforce=None, includes_anomalous_quali: bool = False, k: float = 2,
+                                 warehouse_dir: str = WAREHOUSE_DIR, track_evolution: bool = False, tyre_normalisation: bool = False):
+    """
+    Rank qualifying sessions straight from the lap warehouse, without loading anything through FastF1.
+
+    Args:
+        seasons (int or list, optional): Seasons to rank. Defaults to SEASON.
+        events (str or list, optional): Events to rank. Defaults to all ingested events.
+        downforce (int or list, optional): Only rank events with these RACE_DF_RATING levels. Defaults to all.
+        includes_anomalous_quali (bool, optional): If True, includes drivers without a competitive lap. Defaults to False.
+        k (float, optional): IQR multiplier the laps were filtered with. Defaults to 2.
+        warehouse_dir (str, optional): Warehouse root directory.
+        track_evolution (bool, optional): Correct every session for track evolution first, in one batched fit. Defaults to False.
+        tyre_normalisation (bool, optional): Move every lap to a fresh tyre first, fitting the uncached tracks of each
+                                             season in one batch. Defaults to False.
+
+    Returns:
+        dict: Season -> {"Races", "Sprints"} dictionaries in the `scrape_all_quali_laps` layout,
+              so each season can be passed to `return_downforce_cube`.
+    """
+    
+    catalog = query_catalog(seasons, events, downforce=downforce, k=k, warehouse_dir=warehouse_dir)
+    partitions = [(int(entry["Season"]), entry["Event"], entry["Session"], read_partition(entry, frames=("Laps", "Results", "PoorQuali"), warehouse_dir=warehouse_dir))
+                  for _, entry in catalog.iterrows()]
+    
+    # Register every lineup first, so the lineup index is only built once.
+    for season, race, _, frames in partitions:
+        LINEUPS.add_results(season, race, frames["Results"])
+    
+    if track_evolution or tyre_normalisation:
+        corrected = correct_sessions([(season, race, frames["Laps"]) for season, race, _, frames in partitions],
+                                     track_evolution=track_evolution, tyre_normalisation=tyre_normalisation)
+        for (_, _, _, frames), laps in zip(partitions, corrected):
+            frames["Laps"] = laps
+    
+    output = {}
+    for season, race, session_name, frames in partitions:
+        poor_quali_ranks = None
+        if includes_anomalous_quali and len(frames["PoorQuali"]):
+            poor_quali_ranks = dict(zip(frames["PoorQuali"]["Driver"], frames["PoorQuali"]["Position"]))
+        
+        season_ranks = output.setdefault(season, {"Races": {}, "Sprints": {}})
+        session_ranks = season_ranks["Races"] if session_name == "Qualifying" else season_ranks["Sprints"]
+        with span("rank", year=season, event=race, session=session_name):
+            session_ranks[race] = return_ranked_Q_laps(frames["Laps"], poor_quali_ranks, event=race, season=season)
+    
+    # Keep calendar order for the current season, as the scrape functions do.
+    if SEASON in output:
+        for sessions in output[SEASON].values():
+            ordered = {race: sessions[race] for race in RACES if race in sessions}
+            sessions.clear()
+            sessions.update(ordered)
+    
+    return output
+
+
+
+def return_pooled_cutoff_sketches(seasons=None, by: str = "Event", k: float = 2, warehouse_dir: str = WAREHOUSE_DIR):
+    """
+    Pool the warehouse's Q1 times (relative to each session's fastest) into one t-digest per track or downforce level.
+
+    The digests can be passed as `sketch` to `filter_anomalous_Q_laps` or `LiveQualiRanker`, so a session's cutoff
+    also reflects how that track usually spreads the field, and a live session has a cutoff from its first lap.
+
+    Args:
+        seasons (int or list, optional): Seasons to pool. Defaults to every ingested season.
+        by (str, optional): "Event" for per track digests or "Downforce" for per RACE_DF_RATING level. Defaults to "Event".
+        k (float, optional): IQR multiplier the warehouse laps were filtered with, only used to pick the partitions. Defaults to 2.
+        warehouse_dir (str, optional): Warehouse root directory.
+
+    Returns:
+        dict: Event or downforce level -> TDigest.
+    """
+    
+    catalog = query_catalog(seasons, k=k, warehouse_dir=warehouse_dir)
+    
+    sketches = {}
+    for _, entry in catalog.iterrows():
+        sketch = q1_pace_sketch(read_partition(entry, frames=("Results",), warehouse_dir=warehouse_dir)["Results"])
+        if entry[by] in sketches:
+            sketches[entry[by]].merge(sketch)
+        else:
+            sketches[entry[by]] = sketch
+    
+    return sketches
+
+
+
+def _ranking_spearman(ranking, reference, column: str):
+    """Spearman correlation of a column between two driver rankings, over the drivers ranked in both."""
+    
+    paired = ranking.merge(reference, on="Driver")[[f"{column}_x", f"{column}_y"]].dropna().rank()
+    return np.corrcoef(paired.values.T)[0, 1]
+
+
+def sweep_season_cutoffs(ks, reference_k: float = 2, year: int = SEASON, includes_anomalous_quali: bool = False):
+    """
+    Rank a whole season for many IQR multipliers, loading and sorting every session only once.
+
+    Args:
+        ks (iterable): IQR multipliers to sweep, e.g. np.linspace(1, 4, 20).
+        reference_k (float, optional): Rank stability is measured against this k. Defaults to 2.
+        year (int, optional): The season. Defaults to SEASON.
+        includes_anomalous_quali (bool, optional): If True, includes drivers without a competitive lap. Defaults to False.
+
+    Returns:
+        dict:
+            - "Sessions": Every session's `sweep_anomalous_Q_cutoffs` summary with Event and Session columns added.
+            - "Stability": One row per k with the season's Laps Kept and Laps Removed, the mean session FL / AV Spearman,
+              and Season FL / AV Spearman, the rank correlation of the season driver ranking with `reference_k`'s.
+            - "Ranks": k -> {"Races", "Sprints"} in the `scrape_all_quali_laps` layout.
+    """
+    
+    summaries = []
+    ranks = {}
+    for race, quali_type in return_season_sessions(year):
+        session_name = "Qualifying" if quali_type == "Q" else "Sprint"
+        try:
+            Q = get_quali_session(race, quali_type, year=year)
+        except Exception as e:
+            print(f"Cannot sweep {year} {race} {session_name} as: {e}")
+            continue
+        LINEUPS.add_results(year, race, Q.results)
+        
+        with span("sweep", year=year, event=race, session=quali_type):
+            sweep = sweep_anomalous_Q_cutoffs(Q, ks, reference_k=reference_k, includes_anomalous_quali=includes_anomalous_quali, event=race, season=year)
+        summaries.append(sweep["Summary"].assign(Event=race, Session=session_name))
+        for k, tables in sweep["Ranks"].items():
+            ranks.setdefault(k, {"Races": {}, "Sprints": {}})["Races" if quali_type == "Q" else "Sprints"][race] = tables
+    
+    sessions = pd.concat(summaries, ignore_index=True)
+    stability = sessions.groupby("k").agg({"Laps Kept": "sum", "Laps Removed": "sum", "FL Spearman": "mean", "AV Spearman": "mean"}).reset_index()
+    
+    # Season driver rankings over every track, compared with the reference in the same way as single sessions.
+    season_ranks = {k: return_df_q_rankings(qualifying_ranks, 0)["Driver"] for k, qualifying_ranks in ranks.items()}
+    for selection in ("FL", "AV"):
+        column = f"{selection} Average Rank"
+        stability[f"Season {selection} Spearman"] = [
+            _ranking_spearman(season_ranks[k], season_ranks[reference_k], column) for k in stability["k"]
+        ]
+    
+    return {"Sessions": sessions, "Stability": stability, "Ranks": ranks}
+
+
+
+def return_season_segment_ranks(k: float = 2):
+    """
+    Rank drivers within Q1, Q2 and Q3 of every race and sprint qualifying session of the season.
+
+    All loadable sessions are passed through `return_segment_ranks_batch` together. Sessions that cannot be loaded
+    are skipped.
+
+    Args:
+        k (float, optional): IQR multiplier for each segment's anomaly cutoff. Defaults to 2.
+
+    Returns:
+        dict: "Segments" and "Drivers" DataFrames as returned by `return_segment_ranks_batch`,
+              with Session holding the race name (suffixed with " Sprint" for sprint qualifying).
+    """
+    print("Ranking qualifying segments")
+    
+    sessions = {}
+    for race in RACES:
+        for quali_type, name in (("Q", race), (3, f"{race} Sprint")):
+            if quali_type == 3 and race not in SPRINTS:
+                continue
+            try:
+                sessions[name] = get_quali_session(race, quali_type)
+            except Exception as e:
+                print(f"Cannot load {name} as: {e}")
+    
+    return return_segment_ranks_batch(sessions, k=k)
+
+
+
 def filter_ranks_by_downforce(qualifying_ranks, downforce: int):
     """
     Filter qualifying ranks based on downforce level.
@@ -139,210 +608,226 @@ def filter_ranks_by_downforce(qualifying_ranks, downforce: int):
         return race_ranks, sprint_ranks
 
 
-def return_df_q_rankings(qualifying_ranks, downforce: int):
+# Rank and pct columns of the "Fastest Laps" / "Average Laps" frames, keyed by selection.
+SELECTION_COLUMNS = {"FL": ("Fastest Laps", "FastestLapRank"), "AV": ("Average Laps", "AverageLapRank")}
+
+
+def return_long_q_ranks(race_ranks, sprint_ranks):
     """
-    Calculate pace rankings based on qualifying lap data.
+    Stack race and sprint rank frames into one long-format table.
 
-    This function calculates pace rankings based on the provided qualifying rank data.
-    Rankings are calculated for drivers and teams based on fastest lap and average lap times.
-    Lead driver rankings are also calculated for both fastest and average lap times.
+    Sprints are only included alongside their race, as in `return_df_q_rankings`.
 
     Args:
-        qualifying_ranks (dict): A dictionary containing qualifying rank data for races and sprints.
-        downforce (int): The downforce level to filter by.
+        race_ranks (dict): Race name -> {"Fastest Laps", "Average Laps"} rank frames.
+        sprint_ranks (dict): Race name -> sprint {"Fastest Laps", "Average Laps"} rank frames.
 
     Returns:
-        dict: A dictionary containing DataFrames for different ranking categories:
-            - "Lead Driver": DataFrame containing lead driver rankings for fastest and average lap times.
-            - "Team": DataFrame containing team rankings for fastest and average lap times.
-            - "Driver": DataFrame containing driver rankings for fastest and average lap times.
-              Each DataFrame includes columns for Team/Driver, FL Average Rank, Avg pct of FL pace,
-              AV Average Rank, and Avg pct of avg pace.
-    """    
+        tuple: Two DataFrames with columns Event, Session, Selection ("FL" or "AV"), Driver, Team, Rank and pct:
+            - all drivers' ranks.
+            - lead drivers' ranks, as picked by `pick_lead_driver`.
+    """
     
-    print("Calculating pace rankings")
-    #filter races by DF here
-    race_ranks, sprint_ranks = filter_ranks_by_downforce(qualifying_ranks, downforce)
-    # print(f"sprint ranks: {sprint_ranks}")
+    sessions = [("Race", race, race_ranks[race]) for race in race_ranks]
+    sessions += [("Sprint", race, sprint_ranks[race]) for race in race_ranks if race in sprint_ranks]
     
-    # DFs for output
-    driver_df = pd.DataFrame(columns=["Driver", "Team", "FL Average Rank", "Avg pct of FL pace", "AV Average Rank"])
-    team_df = pd.DataFrame(columns=["Team", "FL Average Rank", "Avg pct of FL pace", "AV Average Rank"])
-    lead_driver_df = pd.DataFrame(columns=["Team", "FL Average Rank", "Avg pct of FL pace", "AV Average Rank"])
+    columns = ["Event", "Session", "Selection", "Driver", "Team", "Rank", "pct"]
+    if not sessions:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=columns)
     
-    # setting up averaging lists for variabls.
-    driver_names = DRIVERS.keys()
-    team_names = CONSTRUCTORS.keys()
+    driver_frames = []
+    lead_driver_frames = []
     
-    driver_fl_ranks, driver_av_ranks, driver_fl_pct, driver_av_pct = {name: [] for name in driver_names}, {name: [] for name in driver_names}, {name: [] for name in driver_names}, {name: [] for name in driver_names}
-    team_fl_ranks, team_av_ranks, team_fl_pct, team_av_pct = {name: [] for name in team_names}, {name: [] for name in team_names}, {name: [] for name in team_names}, {name: [] for name in team_names}
-    lead_driver_fl_ranks, lead_driver_av_ranks, lead_driver_fl_pct, lead_driver_av_pct = {name: [] for name in team_names}, {name: [] for name in team_names}, {name: [] for name in team_names}, {name: [] for name in team_names}
+    for selection, (table, rank_column) in SELECTION_COLUMNS.items():
+        # Only the columns used below are stacked, straight from the arrays, which saves pandas aligning
+        # and re-indexing every session's frame (rank columns are promoted to float where poor quali rows made them so).
+        time_column = rank_column.replace("Rank", "Time")
+        frames = [q_ranks[table] for _, _, q_ranks in sessions]
+        sizes = [len(frame) for frame in frames]
+        stacked = pd.DataFrame({
+            **{column: np.concatenate([frame[column].to_numpy() for frame in frames]) for column in ["Driver", "Team", time_column, rank_column, "pct of pace"]},
+            "Event": np.repeat(np.array([race for _, race, _ in sessions], dtype=object), sizes),
+            "Session": np.repeat(np.array([session_kind for session_kind, _, _ in sessions], dtype=object), sizes)
+        })
+        lead_ranks = pick_lead_driver(stacked, selection=selection, by=["Event", "Session"])
+        
+        renamed = {rank_column: "Rank", "pct of pace": "pct"}
+        driver_frames.append(stacked.rename(columns=renamed).assign(Selection=selection))
+        lead_driver_frames.append(lead_ranks.rename(columns=renamed).assign(Selection=selection))
     
+    driver_ranks = pd.concat(driver_frames, ignore_index=True)[columns]
+    lead_driver_ranks = pd.concat(lead_driver_frames, ignore_index=True)[columns]
     
-    ## TODO Refactor with .groupby pandas function. Currently manually works as sprints can be added easily.
-    # There should be a way to include sprint results while also simplifying code
+    driver_ranks[["Rank", "pct"]] = driver_ranks[["Rank", "pct"]].astype(float)
+    lead_driver_ranks[["Rank", "pct"]] = lead_driver_ranks[["Rank", "pct"]].astype(float)
     
-    for race in race_ranks.keys():
-        
-        #if selection == "Driver":
-        for index, row in race_ranks[race]["Fastest Laps"].iterrows():
-            team = row['Driver']
-            rank = row['FastestLapRank']
-            pct = row['pct of pace']
-            driver_fl_ranks[team].append(rank)
-            driver_fl_pct[team].append(pct)
-            
-        for index, row in race_ranks[race]["Average Laps"].iterrows():
-            team = row['Driver']
-            rank = row['AverageLapRank']
-            pct = row['pct of pace']
-            driver_av_ranks[team].append(rank)  
-            driver_av_pct[team].append(pct)   
-
-
-        # if selection == "Team":
-        for index, row in race_ranks[race]["Fastest Laps"].iterrows():
-            team = row['Team']
-            rank = row['FastestLapRank']
-            pct = row['pct of pace']
-            team_fl_ranks[team].append(rank)
-            team_fl_pct[team].append(pct)
-
-
-        for index, row in race_ranks[race]["Average Laps"].iterrows():
-            team = row['Team']
-            rank = row['AverageLapRank']
-            pct = row['pct of pace']
-            team_av_ranks[team].append(rank)
-            team_av_pct[team].append(pct)
-        
-        
-        # elif selection == "Lead Driver": 
-        FL_LD_ranks = pick_lead_driver(race_ranks[race]["Fastest Laps"], selection="FL")
-        AV_LD_ranks = pick_lead_driver(race_ranks[race]["Average Laps"], selection="AV")
-        
-        for index, row in FL_LD_ranks.iterrows(): #type: ignore
-            team = row['Team']
-            rank = row['FastestLapRank']
-            pct = row['pct of pace']
-            lead_driver_fl_ranks[team].append(rank)
-            lead_driver_fl_pct[team].append(pct)
-            
-        for index, row in AV_LD_ranks.iterrows(): #type: ignore
-            team = row['Team']
-            rank = row['AverageLapRank']
-            pct = row['pct of pace']
-            lead_driver_av_ranks[team].append(rank)
-            lead_driver_av_pct[team].append(pct)
-        
-        print(f"Calculated {race} averages")
-        
-        if race in SPRINTS:
-            try:
-                #if selection == "Driver":
-                for index, row in sprint_ranks[race]["Fastest Laps"].iterrows():
-                    team = row['Driver']
-                    rank = row['FastestLapRank']
-                    pct = row['pct of pace']
-                    driver_fl_ranks[team].append(rank)
-                    driver_fl_pct[team].append(pct)
-
-                for index, row in sprint_ranks[race]["Average Laps"].iterrows():
-                    team = row['Driver']
-                    rank = row['AverageLapRank']
-                    pct = row['pct of pace']
-                    driver_av_ranks[team].append(rank)  
-                    driver_av_pct[team].append(pct)   
-
-
-                # if selection == "Team":
-                for index, row in sprint_ranks[race]["Fastest Laps"].iterrows():
-                    team = row['Team']
-                    rank = row['FastestLapRank']
-                    pct = row['pct of pace']
-                    team_fl_ranks[team].append(rank)
-                    team_fl_pct[team].append(pct)
-
-
-                for index, row in sprint_ranks[race]["Average Laps"].iterrows():
-                    team = row['Team']
-                    rank = row['AverageLapRank']
-                    pct = row['pct of pace']
-                    team_av_ranks[team].append(rank)
-                    team_av_pct[team].append(pct)
-
-
-                # elif selection == "Lead Driver": 
-                FL_LD_ranks = pick_lead_driver(sprint_ranks[race]["Fastest Laps"], selection="FL")
-                AV_LD_ranks = pick_lead_driver(sprint_ranks[race]["Average Laps"], selection="AV")
-
-                for index, row in FL_LD_ranks.iterrows(): #type: ignore
-                    team = row['Team']
-                    rank = row['FastestLapRank']
-                    pct = row['pct of pace']
-                    lead_driver_fl_ranks[team].append(rank)
-                    lead_driver_fl_pct[team].append(pct)
-
-                for index, row in AV_LD_ranks.iterrows(): #type: ignore
-                    team = row['Team']
-                    rank = row['AverageLapRank']
-                    pct = row['pct of pace']
-                    lead_driver_av_ranks[team].append(rank)
-                    lead_driver_av_pct[team].append(pct)
-                    
-                print(f"Calculated {race} sprint averages")
-            
-            except Exception as e:
-                print(f"Cannot calculate {race} sprint as Exception: {e}, This suggests timing data is skewed for this session.")
+    return driver_ranks, lead_driver_ranks
+
 
+def return_track_membership(groupings=None, events=None):
+    """
+    Build the track membership matrix used by the downforce cube.
+
+    Args:
+        groupings (dict, optional): Grouping name -> list of tracks.
+                                    Defaults to 0 (every event) and every downforce level in DF_RACES.
+        events (iterable, optional): The events to build columns for, e.g. every event in a long rank table,
+                                     so events outside the current calendar are not dropped. Defaults to RACES.
+
+    Returns:
+        DataFrame: One row per grouping and one column per event, 1 where the event belongs to the grouping.
+    """
     
-    # if selection == "Driver":
-    for driver in driver_fl_ranks:
-        team = get_constructor(driver)
-        try:
-            average = mean(driver_fl_ranks[driver])
-            pct_avg = mean(driver_fl_pct[driver])
-        except StatisticsError:
-            continue
-        driver_df.loc[len(driver_df)] = {"Driver": driver, "Team": team, "FL Average Rank": average, "Avg pct of FL pace": pct_avg} # type: ignore
+    events = list(RACES) if events is None else list(dict.fromkeys(events))
+    if groupings is None:
+        groupings = {0: events, **DF_RACES}
+    
+    membership = pd.DataFrame(0.0, index=list(groupings), columns=events)
+    for name, tracks in groupings.items():
+        membership.loc[name, [track for track in tracks if track in membership.columns]] = 1.0
+    
+    return membership
+
+
+def return_event_rank_sums(long_ranks, by: str):
+    """
+    Sum ranks and pcts per event for every `by` value and selection.
+
+    Missing values are counted separately and summed as zero, so the sums can be combined across events
+    with a matrix product without nan spreading between tracks.
+
+    Args:
+        long_ranks (DataFrame): Output of `return_long_q_ranks`.
+        by (str): Column to aggregate by, "Driver" or "Team".
+
+    Returns:
+        DataFrame: One row per event, columns (statistic, Selection, `by` value) where statistic is one of
+                   Rank, pct, Rank missing, pct missing and count.
+    """
+    
+    stats = pd.DataFrame({
+        "Event": long_ranks["Event"],
+        "Selection": long_ranks["Selection"],
+        by: long_ranks[by],
+        "Rank": long_ranks["Rank"].fillna(0),
+        "pct": long_ranks["pct"].fillna(0),
+        "Rank missing": long_ranks["Rank"].isna().astype(float),
+        "pct missing": long_ranks["pct"].isna().astype(float),
+        "count": 1.0
+    })
+    
+    return stats.groupby(["Event", "Selection", by]).sum().unstack(["Selection", by]).fillna(0)
+
+
+def average_rank_sums(rank_sums, by: str, order=None):
+    """
+    Turn summed ranks and pcts for one track grouping into averages.
+
+    Args:
+        rank_sums (Series): One row of the combined `return_event_rank_sums` output.
+        by (str): "Driver" or "Team".
+        order (iterable, optional): Preferred row order before sorting, e.g. DRIVERS or CONSTRUCTORS.
+
+    Returns:
+        DataFrame: One row per `by` value with FL Average Rank, Avg pct of FL pace,
+                   AV Average Rank and Avg pct of avg pace.
+    """
+    
+    sums = rank_sums.unstack(["Selection", "statistic"])
+    
+    averages = pd.DataFrame(index=sums.index)
+    for selection in ("FL", "AV"):
+        count = sums.get((selection, "count"), pd.Series(0.0, index=sums.index))
+        for value in ("Rank", "pct"):
+            average = sums.get((selection, value), np.nan) / count.replace(0, np.nan)
+            # statistics.mean returned nan if any value was nan (poor quali laps have no pct), keep that behaviour.
+            averages[f"{selection} {value}"] = average.mask(sums.get((selection, f"{value} missing"), 0) > 0)
+    
+    averages.columns = ["FL Average Rank", "Avg pct of FL pace", "AV Average Rank", "Avg pct of avg pace"]
     
-    av_av_ranks = {driver: mean(ranks) for driver, ranks in driver_av_ranks.items() if ranks}
-    av_av_pct = {driver: mean(pcts) for driver, pcts in driver_av_pct.items() if pcts}
+    # Only keep entries with a fastest lap rank, and keep the preferred order for equal ranks.
+    averages = averages[sums.get(("FL", "count"), pd.Series(0.0, index=sums.index)) > 0]
+    if order is not None:
+        averages = averages.reindex([name for name in order if name in averages.index] + [name for name in averages.index if name not in order])
     
-    driver_df['AV Average Rank'] = [av_av_ranks.get(team, None) for team in driver_df['Driver']]
-    driver_df['Avg pct of avg pace'] = [av_av_pct.get(team, None) for team in driver_df['Driver']]      
+    return averages.rename_axis(by).reset_index()
+
+
+def return_downforce_cube(qualifying_ranks, groupings=None):
+    """
+    Calculate pace rankings for every downforce level (or custom track grouping) at once.
+
+    Per event sums are computed once and combined for all groupings with one matrix product between
+    the track membership matrix and the per event sums, so adding groupings costs almost nothing.
+
+    Args:
+        qualifying_ranks (dict): A dictionary containing qualifying rank data for races and sprints.
+        groupings (dict, optional): Grouping name -> list of tracks.
+                                    Defaults to 0 (every event) and every downforce level in DF_RACES.
+
+    Returns:
+        dict: Grouping name -> {"Lead Driver", "Team", "Driver"} DataFrames as returned by `return_df_q_rankings`.
+    """
     
-    # if selection == "Team":
-    for team in team_fl_ranks:
-        average = mean(team_fl_ranks[team])
-        pct_avg = mean(team_fl_pct[team])
-        team_df.loc[len(team_df)] = {"Team": team, "FL Average Rank": average, "Avg pct of FL pace": pct_avg} # type: ignore TBH I don't understand the error, but it works.
+    print("Calculating pace rankings")
+    with span("aggregate", groupings=len(groupings) if groupings else len(DF_RACES) + 1):
+        driver_ranks, lead_driver_ranks = return_long_q_ranks(qualifying_ranks["Races"], qualifying_ranks["Sprints"])
+        membership = return_track_membership(groupings, events=driver_ranks["Event"].unique())
     
-    av_av_ranks = {team: mean(ranks) for team, ranks in team_av_ranks.items() if ranks}
-    av_av_pct = {team: mean(pcts) for team, pcts in team_av_pct.items() if pcts}
+        totals = {}
+        for name, long_ranks, by in (("Driver", driver_ranks, "Driver"), ("Team", driver_ranks, "Team"), ("Lead Driver", lead_driver_ranks, "Team")):
+            event_sums = return_event_rank_sums(long_ranks, by)
+            event_membership = membership.reindex(columns=event_sums.index, fill_value=0.0)
+        
+            combined = pd.DataFrame(event_membership.values @ event_sums.values, index=membership.index, columns=event_sums.columns)
+            combined.columns = combined.columns.set_names(["statistic", "Selection", by])
+            totals[name] = combined
     
-    team_df['AV Average Rank'] = [av_av_ranks.get(team, None) for team in team_df['Team']]
-    team_df['Avg pct of avg pace'] = [av_av_pct.get(team, None) for team in team_df['Team']] 
+        output = {}
+        for grouping in membership.index:
+            driver_df = average_rank_sums(totals["Driver"].loc[grouping], "Driver", order=DRIVERS)
+            driver_df.insert(1, "Team", LINEUPS.season_teams(driver_df["Driver"]).astype(object))
         
+            team_df = average_rank_sums(totals["Team"].loc[grouping], "Team", order=CONSTRUCTORS)
+            lead_driver_df = average_rank_sums(totals["Lead Driver"].loc[grouping], "Team", order=CONSTRUCTORS)
+
+            driver_df = driver_df.sort_values('FL Average Rank').reset_index(drop=True) 
+            team_df = team_df.sort_values('FL Average Rank').reset_index(drop=True)  
+            lead_driver_df = lead_driver_df.sort_values('FL Average Rank').reset_index(drop=True)  
+
+            output[grouping] = {"Lead Driver": lead_driver_df, "Team": team_df, "Driver": driver_df}
+            print(f"Completed races at downforce level {grouping}")
     
-    # if selection == "Lead Driver":
-    new_rows = [{"Team": team, "FL Average Rank": mean(lead_driver_fl_ranks[team]), "Avg pct of FL pace": mean(lead_driver_fl_pct[team])} for team in lead_driver_fl_ranks]
-    lead_driver_df = lead_driver_df.append(pd.DataFrame(new_rows), ignore_index=True) # type: ignore
-    av_av_ranks = {team: mean(ranks) for team, ranks in lead_driver_av_ranks.items() if ranks}
-    av_av_pct = {team: mean(pcts) for team, pcts in lead_driver_av_pct.items() if pcts}
-    lead_driver_df['AV Average Rank'] = [av_av_ranks.get(team, None) for team in lead_driver_df['Team']] 
-    lead_driver_df['Avg pct of avg pace'] = [av_av_pct.get(team, None) for team in lead_driver_df['Team']]
+        return output
+
 
+def return_df_q_rankings(qualifying_ranks, downforce: int):
+    """
+    Calculate pace rankings based on qualifying lap data.
 
-    driver_df = driver_df.sort_values('FL Average Rank').reset_index(drop=True) 
-    team_df = team_df.sort_values('FL Average Rank').reset_index(drop=True)  
-    lead_driver_df = lead_driver_df.sort_values('FL Average Rank').reset_index(drop=True)  
+    This function calculates pace rankings based on the provided qualifying rank data.
+    Rankings are calculated for drivers and teams based on fastest lap and average lap times.
+    Lead driver rankings are also calculated for both fastest and average lap times.
+    
+    This is the single level case of `return_downforce_cube`, use that directly when several levels are needed.
 
+    Args:
+        qualifying_ranks (dict): A dictionary containing qualifying rank data for races and sprints.
+        downforce (int): The downforce level to filter by, 0 for every event in `qualifying_ranks`.
 
-    output = {"Lead Driver": lead_driver_df, "Team": team_df, "Driver": driver_df}
+    Returns:
+        dict: A dictionary containing DataFrames for different ranking categories:
+            - "Lead Driver": DataFrame containing lead driver rankings for fastest and average lap times.
+            - "Team": DataFrame containing team rankings for fastest and average lap times.
+            - "Driver": DataFrame containing driver rankings for fastest and average lap times.
+              Each DataFrame includes columns for Team/Driver, FL Average Rank, Avg pct of FL pace,
+              AV Average Rank, and Avg pct of avg pace.
+    """    
     
-    print(f"Completed races at downforce level {downforce}")
-    return output
+    # Level 0 is every event in the input, which need not be the current calendar.
+    tracks = DF_RACES[downforce] if downforce else list(dict.fromkeys([*qualifying_ranks["Races"], *qualifying_ranks["Sprints"]]))
+    
+    return return_downforce_cube(qualifying_ranks, groupings={downforce: tracks})[downforce]
 
 
 # res = Q_lap_pace_calculator(selection="Lead Driver", includes_anomalous_quali=False, downforce=3)
@@ -0,0 +1,165 @@
+import math
+
+import numpy as np
+
+#### Streaming quantiles: a merging t-digest
+
+# Values are buffered and periodically merged into a bounded number of weighted centroids. Centroids stay
+# small near the tails (where the k1 scale function is steep) and grow in the middle, so quartiles stay accurate
+# while memory is bounded by the compression. Digests merge by pooling their centroids, which is how pooled
+# per track or per downforce cutoffs are built from per session digests.
+# Reference: Dunning & Ertl, "Computing extremely accurate quantiles using t-digests" (2019).
+
+DEFAULT_COMPRESSION = 100
+
+
+class TDigest:
+    """
+    A mergeable streaming quantile sketch.
+
+    While every centroid holds a single value, quantiles interpolate linearly between the values exactly as
+    `np.percentile` does, so small samples (a session's Q1 times) give the same cutoff as the exact calculation.
+    """
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION):
+        """
+        Args:
+            compression (float, optional): Bounds the number of centroids (about `compression` of them).
+                                           Defaults to DEFAULT_COMPRESSION.
+        """
+
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.buffer = []
+        self.buffer_size = int(5 * compression)
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        """Total weight added, i.e. the number of values for unweighted adds."""
+
+        return int(self.weights.sum()) + len(self.buffer)
+
+    def add(self, value: float):
+        """Add one value."""
+
+        self.buffer.append(value)
+        if len(self.buffer) >= self.buffer_size:
+            self._flush()
+
+    def update(self, values):
+        """Add many values at once, NaNs are skipped."""
+
+        values = np.asarray(values, dtype=float).ravel()
+        self.buffer.extend(values[~np.isnan(values)].tolist())
+        if len(self.buffer) >= self.buffer_size:
+            self._flush()
+
+    def merge(self, other: "TDigest"):
+        """Pool another digest's values into this one. Returns self."""
+
+        other._flush()
+        self._flush()
+        self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    def copy(self):
+        """An independent copy of the digest."""
+
+        self._flush()
+        digest = TDigest(self.compression)
+        digest.means, digest.weights = self.means.copy(), self.weights.copy()
+        digest.min, digest.max = self.min, self.max
+        return digest
+
+    def _flush(self):
+        """Merge the buffered values into the centroids."""
+
+        if not self.buffer:
+            return
+
+        values = np.asarray(self.buffer, dtype=float)
+        self.buffer = []
+        self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, np.ones(len(values))]))
+
+    def _scale(self, q):
+        """The k1 scale function, k(q) = compression / (2 pi) * asin(2q - 1)."""
+
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _inverse_scale(self, k):
+        """Inverse of `_scale`, clamped to q <= 1."""
+
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(2 * math.pi * k / self.compression) + 1) / 2
+
+    def _compress(self, means, weights):
+        """Merge sorted neighbouring centroids while each spans at most one unit of the scale function."""
+
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order].tolist(), weights[order].tolist()
+        total = sum(weights)
+
+        merged_means, merged_weights = [], []
+        current_mean, current_weight = means[0], weights[0]
+        weight_before = 0.0
+        limit = total * self._inverse_scale(self._scale(0) + 1)
+
+        for mean, weight in zip(means[1:], weights[1:]):
+            if weight_before + current_weight + weight <= limit:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                merged_means.append(current_mean)
+                merged_weights.append(current_weight)
+                weight_before += current_weight
+                limit = total * self._inverse_scale(self._scale(weight_before / total) + 1)
+                current_mean, current_weight = mean, weight
+
+        merged_means.append(current_mean)
+        merged_weights.append(current_weight)
+        self.means, self.weights = np.array(merged_means), np.array(merged_weights)
+
+    def quantile(self, q: float):
+        """
+        Estimate the q-th quantile, q between 0 and 1.
+
+        Each centroid sits at the average rank of the values it holds, and quantiles interpolate linearly
+        in rank between centroids (and the exact minimum and maximum), like `np.percentile`'s default method.
+        """
+
+        self._flush()
+        if not len(self.means):
+            return np.nan
+
+        total = self.weights.sum()
+        ranks = np.cumsum(self.weights) - self.weights + (self.weights - 1) / 2
+        ranks = np.concatenate([[0.0], ranks, [total - 1]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * (total - 1), ranks, values))
+
+    def iqr_cutoff(self, k: float = 2):
+        """The anomalous lap cutoff q3 + k * iqr, as `filter_anomalous_Q_laps` computes it."""
+
+        q1, q3 = self.quantile(0.25), self.quantile(0.75)
+        return q3 + k * (q3 - q1)
+
+    def to_dict(self):
+        """The digest as plain JSON-serialisable values."""
+
+        self._flush()
+        return {"compression": self.compression, "means": self.means.tolist(), "weights": self.weights.tolist(),
+                "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        """Rebuild a digest saved with `to_dict`."""
+
+        digest = cls(state["compression"])
+        digest.means, digest.weights = np.array(state["means"], dtype=float), np.array(state["weights"], dtype=float)
+        digest.min, digest.max = state["min"], state["max"]
+        return digest
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+
+from frame_io import save_frames, load_frames
+from instrumentation import increment
+
+#### On-disk memo cache for per-session rank frames
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+RANK_CACHE_DIR = os.path.join(ROOT_DIR, "Cache", "rank_cache")
+RANK_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def cache_path(key: dict, cache_dir: str = RANK_CACHE_DIR):
+    """Return the file holding the frames for `key`, named by a hash of its contents."""
+
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.npz")
+
+
+def cached_frames(key: dict, compute, cache_dir: str = RANK_CACHE_DIR, max_bytes: int = RANK_CACHE_MAX_BYTES, required=()):
+    """
+    Return the frames stored for `key`, computing and storing them on a miss.
+
+    Args:
+        key (dict): JSON-serialisable description of everything the frames depend on,
+                    e.g. session identity, k, includes_anomalous_quali and ANALYSIS_VERSION.
+        compute (callable): Called with no arguments on a miss, returning a dict of DataFrames.
+        cache_dir (str, optional): Cache directory.
+        max_bytes (int, optional): Size bound for the cache, least recently used files are evicted beyond it.
+        required (iterable, optional): Frames a stored entry must hold, entries written without them are recomputed.
+
+    Returns:
+        dict: The cached or freshly computed dict of DataFrames.
+    """
+
+    path = cache_path(key, cache_dir)
+
+    if os.path.exists(path):
+        try:
+            frames = load_frames(path)
+        except (OSError, ValueError, KeyError):  # Unreadable entry, recompute it.
+            frames = None
+        
+        # Entries written before a required frame was added are recomputed too.
+        if frames is not None and all(name in frames for name in required):
+            CACHE_STATS["hits"] += 1
+            increment("rank_cache_hits")
+            os.utime(path)  # Mark as recently used.
+            return frames
+
+    CACHE_STATS["misses"] += 1
+    increment("rank_cache_misses")
+    frames = compute()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    save_frames(path, frames)
+    evict_cache(cache_dir, max_bytes)
+
+    return frames
+
+
+def evict_cache(cache_dir: str = RANK_CACHE_DIR, max_bytes: int = RANK_CACHE_MAX_BYTES):
+    """Remove the least recently used cache files until the cache fits within `max_bytes`."""
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npz") or name.endswith(".tmp.npz"):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:  # Removed by another process.
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+        CACHE_STATS["evictions"] += 1
+        increment("rank_cache_evictions")
+
+
+def cache_stats():
+    """Return the hit/miss/eviction counts for this process along with the hit rate."""
+
+    lookups = CACHE_STATS["hits"] + CACHE_STATS["misses"]
+    return {**CACHE_STATS, "hit_rate": CACHE_STATS["hits"] / lookups if lookups else None}
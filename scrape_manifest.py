@@ -0,0 +1,65 @@
+import json
+import os
+
+#### Manifest of processed qualifying sessions for incremental scrapes
+
+# Only the sessions and the inputs they were ranked with are recorded here, their rank frames live in the rank cache.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_DIR = os.path.join(ROOT_DIR, "Cache", "scrape_manifest")
+MANIFEST_FILE = "manifest.json"
+
+
+def session_key(year: int, race: str, quali_type: str | int, **params):
+    """
+    Build the manifest key for a session.
+
+    Args:
+        year (int): Season of the session.
+        race (str): The name of the race session.
+        quali_type (str or int): "Q" for standard qualifying or 3 for sprint qualifying.
+        **params: Filter and ranking parameters the stored output depends on (e.g. k, includes_anomalous_quali).
+
+    Returns:
+        tuple: (session_id, key) where session_id names the session and key is the full dictionary of inputs.
+    """
+
+    session_id = f"{year}_{race}_{quali_type}"
+    key = {"year": year, "race": race, "quali_type": str(quali_type), **params}
+    return session_id, key
+
+
+def load_manifest(manifest_dir: str = MANIFEST_DIR):
+    """Load the manifest, returning an empty one if nothing has been processed yet."""
+
+    path = os.path.join(manifest_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, encoding="utf-8") as source:
+        return json.load(source)
+
+
+def save_manifest(manifest, manifest_dir: str = MANIFEST_DIR):
+    """Write the manifest, replacing the previous version in one step."""
+
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = os.path.join(manifest_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as target:
+        json.dump(manifest, target, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def is_processed(manifest, session_id: str, key: dict):
+    """Whether a session was already processed with the same inputs."""
+
+    entry = manifest.get(session_id)
+    return entry is not None and entry["key"] == key
+
+
+def record_session(manifest, session_id: str, key: dict):
+    """Record a processed session in the manifest (call `save_manifest` to persist)."""
+
+    manifest[session_id] = {"key": key}
@@ -0,0 +1,210 @@
+import os
+import types
+from collections import OrderedDict
+
+import pandas as pd
+
+from instrumentation import span, increment
+from constants import *
+
+#### Session loading for Quali analysis
+
+FASTF1_CACHE_DIR = os.environ.get("FASTF1_CACHE_DIR", r"M:\Coding\F1DataAnalysis\FastF1Cache")
+FASTF1_CACHE_ENABLED = False
+
+
+# Lap columns read by filter_anomalous_Q_laps, plus the session Time used to split Q1/Q2/Q3.
+LAP_COLUMNS = ["Driver", "Team", "LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "Compound", "TyreLife", "IsAccurate", "Deleted", "Time"]
+
+# Result columns read by filter_anomalous_Q_laps and return_quali_ranks_per_session.
+RESULT_COLUMNS = ["Abbreviation", "TeamName", "Position", "Q1", "Q2", "Q3"]
+
+
+def import_fastf1():
+    """
+    Import FastF1 and enable its cache on first use, so importing the analysis modules stays fast.
+    """
+    global FASTF1_CACHE_ENABLED
+    import fastf1
+    
+    if not FASTF1_CACHE_ENABLED:
+        fastf1.Cache.enable_cache(FASTF1_CACHE_DIR)
+        FASTF1_CACHE_ENABLED = True
+    
+    return fastf1
+
+
+def load_quali_session(race: str, quali_type: str | int = "Q", year: int = SEASON, laps_only: bool = True, livedata=None):
+    """
+    Load a qualifying session for analysis.
+
+    In laps-only mode the session is loaded without car telemetry, position data or weather, and only the lap
+    timing and results columns used by the analysis are kept. Race control messages are still loaded as FastF1
+    needs them to flag laps deleted for track limits.
+
+    Args:
+        race (str): The name of the race session.
+        quali_type (str or int, optional): The type of qualifying session.
+                                           Use "Q" for standard qualifying or 3 for sprint qualifying.
+                                           Defaults to "Q".
+        year (int, optional): The season to load. Defaults to SEASON.
+        laps_only (bool, optional): Whether to keep only lap timing and results. Defaults to True.
+        livedata (LiveTimingData, optional): A recorded live timing feed to load the session from instead of the F1 API.
+
+    Returns:
+        The fully loaded FastF1 session if `laps_only` is False, otherwise a lightweight session holding
+        `laps`, `results` and `session_status` DataFrames along with the `event`, `name` and `year` it was loaded from.
+    """
+
+    fastf1 = import_fastf1()
+    Q = fastf1.get_session(year, race, quali_type)
+
+    if not laps_only:
+        Q.load(livedata=livedata)
+        return Q
+
+    Q.load(laps=True, telemetry=False, weather=False, messages=True, livedata=livedata)
+
+    # Copy the columns out so the FastF1 session and everything else it loaded can be freed.
+    return types.SimpleNamespace(
+        event=race,
+        name=Q.name,
+        year=year,
+        laps=pd.DataFrame(Q.laps[LAP_COLUMNS]).reset_index(drop=True),
+        results=pd.DataFrame(Q.results[RESULT_COLUMNS]).reset_index(drop=True),
+        session_status=pd.DataFrame(Q.session_status)
+    )
+
+
+# First season -> session name FastF1 uses for sprint qualifying from then on. In 2021 "Sprint Qualifying" was the
+# sprint race itself, and in 2021 and 2022 the sprint grid came from the normal qualifying.
+SPRINT_QUALI_NAMES = {2023: "Sprint Shootout", 2024: "Sprint Qualifying"}
+
+
+def sprint_quali_name(year: int):
+    """The name of a season's sprint qualifying session, None if the season had none."""
+
+    seasons = [season for season in SPRINT_QUALI_NAMES if season <= year]
+    return SPRINT_QUALI_NAMES[max(seasons)] if seasons else None
+
+
+def return_season_sessions(year: int = SEASON):
+    """
+    List the qualifying sessions of a season.
+
+    The current season comes from RACES and SPRINTS, other seasons from the FastF1 event schedule,
+    with events named by their location as in RACES. Locations that held more than one event in the season
+    (e.g. Spielberg in 2020 and 2021) name each of those events by its EventName instead, which FastF1 also
+    loads the session by, so every event of the season keeps its own key.
+
+    Args:
+        year (int, optional): The season. Defaults to SEASON.
+
+    Returns:
+        list: (event, quali_type) pairs in calendar order, quali_type being "Q" or the sprint qualifying session number.
+    """
+
+    if year == SEASON:
+        return [(race, quali_type) for race in RACES for quali_type in ("Q", 3) if quali_type == "Q" or race in SPRINTS]
+
+    fastf1 = import_fastf1()
+    schedule = fastf1.get_event_schedule(year, include_testing=False)
+
+    repeated = schedule["Location"].duplicated(keep=False).values
+    sprint_quali = sprint_quali_name(year)
+
+    sessions = []
+    for (_, event), shared_location in zip(schedule.iterrows(), repeated):
+        name = event["EventName"] if shared_location else event["Location"]
+        sessions.append((name, "Q"))
+        for number in range(1, 6):
+            if sprint_quali is not None and event.get(f"Session{number}") == sprint_quali:
+                sessions.append((name, number))
+
+    return sessions
+
+
+#### Shared registry of loaded sessions
+
+# (year, race, quali_type) -> (session, laps_only, estimated bytes), least recently used first.
+SESSION_REGISTRY = OrderedDict()
+SESSION_REGISTRY_MAX_BYTES = 2 * 1024 ** 3
+
+REGISTRY_STATS = {"loads": 0, "reuses": 0, "evictions": 0}
+
+
+def session_memory_usage(session):
+    """
+    Estimate the memory held by a loaded session.
+
+    A laps-only session is sized from every DataFrame it keeps (laps, results and session status),
+    a full FastF1 session from its lap, result, weather and telemetry DataFrames.
+    """
+
+    if isinstance(session, types.SimpleNamespace):
+        frames = list(vars(session).values())
+    else:
+        frames = [getattr(session, "_laps", None), getattr(session, "_results", None), getattr(session, "_weather_data", None),
+                  getattr(session, "_session_status", None)]
+        for attribute in ("_car_data", "_pos_data"):
+            frames.extend(getattr(session, attribute, {}).values())
+
+    return int(sum(frame.memory_usage(deep=True).sum() for frame in frames if isinstance(frame, pd.DataFrame)))
+
+
+def get_quali_session(race: str, quali_type: str | int = "Q", year: int = SEASON, laps_only: bool = True,
+                      max_bytes: int = SESSION_REGISTRY_MAX_BYTES):
+    """
+    Return a loaded qualifying session, loading it only the first time it is requested in this process.
+
+    Sessions are shared between every analysis that goes through the registry, and the least recently used ones
+    are dropped once their estimated memory exceeds `max_bytes`. A fully loaded session is also reused for
+    laps-only requests.
+
+    Args:
+        race (str): The name of the race session.
+        quali_type (str or int, optional): "Q" for standard qualifying or 3 for sprint qualifying. Defaults to "Q".
+        year (int, optional): The season to load. Defaults to SEASON.
+        laps_only (bool, optional): Whether a laps-only session is enough. Defaults to True.
+        max_bytes (int, optional): Memory budget for all registered sessions.
+
+    Returns:
+        The session as returned by `load_quali_session`.
+    """
+
+    key = (year, race, str(quali_type))
+    entry = SESSION_REGISTRY.get(key)
+
+    if entry is not None and (laps_only or not entry[1]):
+        SESSION_REGISTRY.move_to_end(key)
+        REGISTRY_STATS["reuses"] += 1
+        increment("sessions_reused")
+        return entry[0]
+
+    with span("load", year=year, event=race, session=quali_type):
+        session = load_quali_session(race, quali_type, year=year, laps_only=laps_only)
+    REGISTRY_STATS["loads"] += 1
+    increment("sessions_loaded")
+
+    SESSION_REGISTRY[key] = (session, laps_only, session_memory_usage(session))
+    SESSION_REGISTRY.move_to_end(key)
+
+    # Evict the least recently used sessions, always keeping the one just loaded.
+    while len(SESSION_REGISTRY) > 1 and sum(size for _, _, size in SESSION_REGISTRY.values()) > max_bytes:
+        SESSION_REGISTRY.popitem(last=False)
+        REGISTRY_STATS["evictions"] += 1
+        increment("sessions_evicted")
+
+    return session
+
+
+def clear_session_registry():
+    """Drop every registered session."""
+
+    SESSION_REGISTRY.clear()
+
+
+def registry_stats():
+    """Return load/reuse/eviction counts for this process and the memory currently held by registered sessions."""
+
+    return {**REGISTRY_STATS, "sessions": len(SESSION_REGISTRY), "bytes": sum(size for _, _, size in SESSION_REGISTRY.values())}
@@ -0,0 +1,211 @@
+import csv
+import os
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span, increment
+
+#### Batched Google Sheets writing
+
+# A SheetWriter collects everything to be written to one worksheet in memory and pushes it in a single
+# values batch update, instead of one request per DataFrame or cell.
+# Any object with `batch_update`, `resize`, `row_count` and `col_count` can be used as the backend:
+# a gspread Worksheet, or a LocalWorksheet for working offline.
+
+
+# Sheets API status codes worth retrying: quota exceeded and transient server errors.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Ranges sent per batch request.
+MAX_RANGES_PER_REQUEST = 100
+
+
+def rowcol_to_a1(row: int, col: int):
+    """Convert 1-indexed row and column numbers to A1 notation, e.g. (2, 28) -> "AB2"."""
+
+    label = ""
+    while col:
+        col, remainder = divmod(col - 1, 26)
+        label = chr(65 + remainder) + label
+    return f"{label}{row}"
+
+
+def a1_to_rowcol(a1: str):
+    """Convert A1 notation to 1-indexed (row, col), e.g. "AB2" -> (2, 28)."""
+
+    letters = a1.rstrip("0123456789")
+    col = 0
+    for letter in letters.upper():
+        col = col * 26 + ord(letter) - 64
+    return int(a1[len(letters):]), col
+
+
+def _cell_value(value):
+    """Convert a DataFrame value to something the Sheets API accepts, blank for missing values."""
+
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _status_code(exception):
+    """Return the HTTP status code carried by an API exception, if any."""
+
+    response = getattr(exception, "response", None)
+    return getattr(response, "status_code", None)
+
+
+class SheetWriter:
+    """
+    Build a worksheet's layout in memory and write it with the fewest batch requests.
+
+    Args:
+        worksheet: Backend worksheet (gspread Worksheet or LocalWorksheet).
+        max_retries (int, optional): Attempts per request on quota and server errors. Defaults to 5.
+        backoff (float, optional): Initial backoff in seconds, doubled after every failed attempt. Defaults to 1.
+    """
+
+    def __init__(self, worksheet, max_retries: int = 5, backoff: float = 1.0):
+        self.worksheet = worksheet
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.blocks = []
+        self.requests = 0
+
+    def write_cell(self, row: int, col: int, value):
+        """Queue a single cell."""
+
+        self.blocks.append((row, col, [[_cell_value(value)]]))
+
+    def write_frame(self, df, row: int = 1, col: int = 1, include_column_header: bool = True):
+        """Queue a DataFrame with its top left corner at (row, col), laid out like gspread_dataframe.set_with_dataframe."""
+
+        values = [[_cell_value(value) for value in record] for record in df.itertuples(index=False, name=None)]
+        if include_column_header:
+            values.insert(0, [str(column) for column in df.columns])
+
+        if values:
+            self.blocks.append((row, col, values))
+
+    def flush(self):
+        """
+        Write every queued block to the worksheet and clear the queue.
+
+        Returns:
+            int: The number of API requests made.
+        """
+
+        if not self.blocks:
+            return 0
+
+        requests_before = self.requests
+
+        with span("upload", worksheet=getattr(self.worksheet, "title", "")):
+            self._write_blocks()
+
+        self.blocks = []
+        return self.requests - requests_before
+
+    def _write_blocks(self):
+        """Resize the worksheet if the queued blocks need it, then send them in batches."""
+
+        last_row = max(row + len(values) - 1 for row, _, values in self.blocks)
+        last_col = max(col + max(len(line) for line in values) - 1 for _, col, values in self.blocks)
+        if last_row > self.worksheet.row_count or last_col > self.worksheet.col_count:
+            self._request(self.worksheet.resize, rows=max(last_row, self.worksheet.row_count), cols=max(last_col, self.worksheet.col_count))
+
+        data = [
+            {"range": f"{rowcol_to_a1(row, col)}:{rowcol_to_a1(row + len(values) - 1, col + max(len(line) for line in values) - 1)}", "values": values}
+            for row, col, values in self.blocks
+        ]
+        for start in range(0, len(data), MAX_RANGES_PER_REQUEST):
+            self._request(self.worksheet.batch_update, data[start:start + MAX_RANGES_PER_REQUEST], value_input_option="USER_ENTERED")
+
+    def _request(self, method, *args, **kwargs):
+        """Call the backend, retrying with exponential backoff and jitter on quota and server errors."""
+
+        for attempt in range(self.max_retries):
+            self.requests += 1
+            increment("sheet_api_requests", method=method.__name__)
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                increment("sheet_api_errors", status=_status_code(e))
+                if _status_code(e) not in RETRY_STATUS_CODES or attempt == self.max_retries - 1:
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                print(f"Sheets API returned {_status_code(e)}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+
+class LocalWorksheet:
+    """
+    File backed stand-in for a gspread Worksheet, for testing layouts and request counts offline.
+
+    The grid is kept in memory and saved to `path` as CSV after every request.
+
+    Args:
+        path (str, optional): CSV file to load from and save to. If None, the grid is only kept in memory.
+        rows (int, optional): Initial row count. Defaults to 1000, as for a new Google Sheet.
+        cols (int, optional): Initial column count. Defaults to 26.
+    """
+
+    def __init__(self, path: str | None = None, rows: int = 1000, cols: int = 26):
+        self.path = path
+        self.title = os.path.basename(path) if path else "local"
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = {}
+        self.request_count = 0
+
+        if path and os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as source:
+                for r, line in enumerate(csv.reader(source), start=1):
+                    for c, value in enumerate(line, start=1):
+                        if value != "":
+                            self.cells[(r, c)] = value
+
+    def batch_update(self, data, **kwargs):
+        self.request_count += 1
+
+        for block in data:
+            first, last = block["range"].split(":")
+            row, col = a1_to_rowcol(first)
+            last_row, last_col = a1_to_rowcol(last)
+            if last_row > self.row_count or last_col > self.col_count:
+                raise ValueError(f"Range {block['range']} exceeds grid limits")
+
+            for r, line in enumerate(block["values"]):
+                for c, value in enumerate(line):
+                    self.cells[(row + r, col + c)] = value
+
+        self._save()
+
+    def resize(self, rows: int | None = None, cols: int | None = None):
+        self.request_count += 1
+        self.row_count = rows or self.row_count
+        self.col_count = cols or self.col_count
+
+    def update_cell(self, row: int, col: int, value):
+        self.batch_update([{"range": f"{rowcol_to_a1(row, col)}:{rowcol_to_a1(row, col)}", "values": [[value]]}])
+
+    def cell_value(self, row: int, col: int):
+        return self.cells.get((row, col), "")
+
+    def _save(self):
+        if not self.path or not self.cells:
+            return
+
+        rows = max(r for r, _ in self.cells)
+        cols = max(c for _, c in self.cells)
+        with open(self.path, "w", newline="", encoding="utf-8") as target:
+            writer = csv.writer(target)
+            for r in range(1, rows + 1):
+                writer.writerow([self.cells.get((r, c), "") for c in range(1, cols + 1)])
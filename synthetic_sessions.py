@@ -0,0 +1,194 @@
+import types
+
+import numpy as np
+import pandas as pd
+
+from lap_table import ms_to_timedelta
+from lineups import LINEUPS
+from session_loader import LAP_COLUMNS, RESULT_COLUMNS
+from constants import *
+
+#### Synthetic qualifying sessions for offline development and benchmarking
+
+# Sessions are shaped like those returned by `session_loader.load_quali_session` (laps, results and
+# session_status, plus event, name and year), so every analysis stage can run without FastF1.
+
+# Segment lengths in minutes for standard and sprint qualifying.
+SEGMENT_MINUTES = {"Q": (18, 15, 12), "Sprint": (12, 10, 8)}
+
+# Drivers knocked out at the end of Q1 and Q2.
+KNOCKOUTS = (5, 5)
+
+# Minutes between segments, and from the first status to the start of Q1.
+SEGMENT_GAP_MINUTES = 8
+
+# Tyre compound per segment for standard and sprint qualifying (2023 sprint shootout rules).
+SEGMENT_COMPOUNDS = {"Q": ("SOFT", "SOFT", "SOFT"), "Sprint": ("MEDIUM", "MEDIUM", "SOFT")}
+
+# Seconds lost per lap of tyre life, per compound.
+TYRE_DEGRADATION = {"SOFT": 0.06, "MEDIUM": 0.035, "HARD": 0.02}
+
+
+def default_lineup(event: str, year: int = SEASON):
+    """The driver -> team lineup of an event from the lineup registry, or two drivers per constructor if it is unknown."""
+
+    lineup = LINEUPS.lineups.get((year, event)) or LINEUPS.lineups.get((SEASON, event))
+    if lineup:
+        return dict(lineup)
+    return {driver: team for team, drivers in CONSTRUCTORS.items() for driver in drivers[:2]}
+
+
+def make_quali_session(event: str = "Sakhir", quali_type: str | int = "Q", year: int = SEASON, lineup: dict | None = None,
+                       laps_per_segment: int = 3, deleted_rate: float = 0.04, inaccurate_rate: float = 0.04,
+                       outlier_rate: float = 0.15, no_time_drivers=(), track_evolution: float = 0.02, tyre_degradation: dict | None = None,
+                       seed=None):
+    """
+    Generate a realistic qualifying session.
+
+    Every driver has a team and personal pace around a track base time, sets `laps_per_segment` timed laps
+    in each segment they take part in, and is knocked out on their best valid lap as in real qualifying.
+    The track gets faster through the session, tyres lose time with every lap of use, and some laps are slow
+    outliers (cool-down or aborted laps), deleted for track limits or flagged as inaccurate.
+
+    Args:
+        event (str, optional): Event name. Defaults to "Sakhir".
+        quali_type (str or int, optional): "Q" for standard qualifying, anything else for sprint qualifying
+                                           (shorter segments). Defaults to "Q".
+        year (int, optional): Season. Defaults to SEASON.
+        lineup (dict, optional): Driver -> team. Defaults to `default_lineup(event, year)`.
+        laps_per_segment (int, optional): Timed laps per driver per segment. Defaults to 3.
+        deleted_rate (float, optional): Share of laps deleted for track limits. Defaults to 0.04.
+        inaccurate_rate (float, optional): Share of laps flagged as inaccurate. Defaults to 0.04.
+        outlier_rate (float, optional): Share of laps 5-35% slower than the driver's pace. Defaults to 0.15.
+        no_time_drivers (iterable, optional): Drivers with no valid or accurate lap, e.g. after a crash. Defaults to none.
+        track_evolution (float, optional): Seconds of lap time gained per minute of session. Defaults to 0.02.
+        tyre_degradation (dict, optional): Compound -> seconds lost per lap of tyre life. Defaults to TYRE_DEGRADATION.
+        seed (int or sequence of ints, optional): Seed for `numpy.random.default_rng`.
+
+    Returns:
+        SimpleNamespace: event, name, year, laps, results and session_status, as from `load_quali_session`.
+    """
+
+    rng = np.random.default_rng(seed)
+    sprint = quali_type != "Q"
+    tyre_degradation = TYRE_DEGRADATION if tyre_degradation is None else tyre_degradation
+
+    lineup = default_lineup(event, year) if lineup is None else lineup
+    drivers = np.array(list(lineup), dtype=object)
+    teams = np.array(list(lineup.values()), dtype=object)
+
+    # Track base time and sector split, then team and driver pace as a share of it.
+    base_time = rng.uniform(72, 105)
+    sector_split = rng.dirichlet([300, 400, 300])
+    team_names, team_codes = np.unique(teams, return_inverse=True)
+    pace = base_time * (1 + rng.normal(0, 0.005, len(team_names))[team_codes] + rng.normal(0, 0.0015, len(drivers)))
+    no_time = np.isin(drivers, list(no_time_drivers))
+
+    segment_times = []
+    best_times = np.full((len(drivers), 3), np.nan)
+    positions = np.zeros(len(drivers))
+    lap_blocks = []
+
+    running = np.arange(len(drivers))
+    segment_start = SEGMENT_GAP_MINUTES * 60.0
+    for segment, minutes in enumerate(SEGMENT_MINUTES["Sprint" if sprint else "Q"]):
+        segment_end = segment_start + minutes * 60
+        segment_times.append((segment_start, segment_end))
+        shape = (len(running), laps_per_segment)
+
+        # Session time at the end of each lap, the first lap after an out lap, with a cool-down lap between pushes.
+        lap_end = np.sort(rng.uniform(segment_start + 150, segment_end + 60, shape), axis=1)
+        compound = SEGMENT_COMPOUNDS["Sprint" if sprint else "Q"][segment]
+        tyre_life = np.broadcast_to(np.arange(1, laps_per_segment + 1) * 2 - 1, shape).astype(float)
+        lap_times = (pace[running, None] - track_evolution * lap_end / 60 + tyre_degradation.get(compound, 0.0) * (tyre_life - 1)
+                     + np.abs(rng.normal(0, 0.25, shape)))
+        lap_times = np.where(rng.random(shape) < outlier_rate, lap_times * rng.uniform(1.05, 1.35, shape), lap_times)
+
+        deleted = rng.random(shape) < deleted_rate
+        accurate = (rng.random(shape) >= inaccurate_rate) & ~no_time[running, None]
+        deleted |= no_time[running, None]
+
+        sectors = lap_times[..., None] * sector_split + rng.normal(0, 0.03, shape + (3,))
+        sectors[..., 2] = lap_times - sectors[..., 0] - sectors[..., 1]
+
+        lap_blocks.append(pd.DataFrame({
+            "Driver": np.repeat(drivers[running], laps_per_segment),
+            "Team": np.repeat(teams[running], laps_per_segment),
+            "LapTime": lap_times.ravel(),
+            "Sector1Time": sectors[..., 0].ravel(),
+            "Sector2Time": sectors[..., 1].ravel(),
+            "Sector3Time": sectors[..., 2].ravel(),
+            "Compound": compound,
+            "TyreLife": tyre_life.ravel(),
+            "IsAccurate": accurate.ravel(),
+            "Deleted": deleted.ravel(),
+            "Time": lap_end.ravel()
+        }))
+
+        # Knock out the slowest drivers on their best valid lap, drivers without one last.
+        best = np.where(deleted, np.inf, lap_times).min(axis=1)
+        best_times[running, segment] = np.where(np.isfinite(best), best, np.nan)
+        order = running[np.argsort(best, kind="stable")]
+
+        knockouts = KNOCKOUTS[segment] if segment < len(KNOCKOUTS) and len(running) > KNOCKOUTS[segment] else 0
+        if segment == len(SEGMENT_MINUTES["Q"]) - 1 or not knockouts:
+            positions[order] = np.arange(1, len(order) + 1)
+            break
+        positions[order[-knockouts:]] = np.arange(len(order) - knockouts + 1, len(order) + 1)
+        running = order[:-knockouts]
+
+        segment_start = segment_end + SEGMENT_GAP_MINUTES * 60
+
+    laps = pd.concat(lap_blocks, ignore_index=True)
+    for column in ("LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "Time"):
+        laps[column] = ms_to_timedelta(np.round(laps[column].values * 1000))
+    laps = laps.sort_values(["Driver", "Time"], kind="mergesort").reset_index(drop=True)[LAP_COLUMNS]
+
+    results = pd.DataFrame({
+        "Abbreviation": drivers, "TeamName": teams, "Position": positions,
+        **{f"Q{segment + 1}": ms_to_timedelta(np.round(best_times[:, segment] * 1000)) for segment in range(3)}
+    })
+    results = results.sort_values("Position").reset_index(drop=True)[RESULT_COLUMNS]
+
+    status_times = [0.0] + [time for segment in segment_times for time in (segment[0], segment[1] + 60)]
+    status_times += [status_times[-1] + 60, status_times[-1] + 120]
+    session_status = pd.DataFrame({
+        "Time": pd.to_timedelta(status_times, unit="s"),
+        "Status": ["Inactive"] + ["Started", "Finished"] * len(segment_times) + ["Finalised", "Ends"]
+    })
+
+    return types.SimpleNamespace(
+        event=event,
+        name="Sprint Shootout" if sprint else "Qualifying",
+        year=year,
+        laps=laps,
+        results=results,
+        session_status=session_status
+    )
+
+
+def make_season(year: int = SEASON, events=RACES, sprints=SPRINTS, seed: int = 0, **session_kwargs):
+    """
+    Generate every qualifying session of a season.
+
+    Args:
+        year (int, optional): Season. Defaults to SEASON.
+        events (iterable, optional): Events in calendar order. Defaults to RACES.
+        sprints (iterable, optional): Events that also have sprint qualifying. Defaults to SPRINTS.
+        seed (int, optional): Base seed, each session gets its own stream derived from it. Defaults to 0.
+        **session_kwargs: Passed to `make_quali_session`.
+
+    Returns:
+        dict: (event, quali_type) -> session, quali_type being "Q" or 3 as in the scrape functions.
+    """
+
+    sessions = {}
+    for number, event in enumerate(events):
+        for quali_type in ("Q", 3):
+            if quali_type == 3 and event not in sprints:
+                continue
+            sessions[(event, quali_type)] = make_quali_session(
+                event, quali_type, year=year, seed=[seed, year, number, int(quali_type == 3)], **session_kwargs
+            )
+
+    return sessions
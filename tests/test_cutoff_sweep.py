@@ -0,0 +1,49 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import CONSTRUCTORS
+from q_helpers import anomalous_lap_cutoff, filter_anomalous_Q_laps, return_ranked_Q_laps, sweep_anomalous_Q_cutoffs
+from synthetic_sessions import make_quali_session
+
+# A fixed lineup, so the session does not depend on the lineups other tests register.
+LINEUP = {driver: team for team, drivers in CONSTRUCTORS.items() for driver in drivers[:2]}
+
+# Small ks drop drivers whose every lap is over the cutoff, large ones keep the outlier laps.
+KS = [0, 0.1, 0.5, 1, 2, 5]
+
+
+@pytest.fixture(scope="module")
+def session():
+    return make_quali_session("Monza", lineup=LINEUP, no_time_drivers=("STR",), outlier_rate=0.3, seed=5)
+
+
+@pytest.mark.parametrize("includes_anomalous_quali", [False, True])
+def test_sweep_matches_filtering_and_ranking_each_k(session, includes_anomalous_quali):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sweep = sweep_anomalous_Q_cutoffs(session, KS, includes_anomalous_quali=includes_anomalous_quali)
+
+        for k in KS:
+            laps, poor_q_ranks = filter_anomalous_Q_laps(session, k)
+            expected = return_ranked_Q_laps(laps, poor_q_ranks if includes_anomalous_quali else None)
+
+            for table in ("Fastest Laps", "Average Laps"):
+                pd.testing.assert_frame_equal(sweep["Ranks"][k][table], expected[table], check_dtype=False)
+
+            summary = sweep["Summary"].set_index("k").loc[k]
+            assert summary["Laps Kept"] == len(laps)
+            assert summary["Drivers Ranked"] == laps["Driver"].nunique()
+
+    # Removing fewer laps never keeps fewer.
+    assert sweep["Summary"]["Laps Kept"].is_monotonic_increasing
+    assert sweep["Summary"].set_index("k").loc[2, "FL Spearman"] == pytest.approx(1.0)
+
+
+def test_drivers_without_a_q1_time_are_left_out_of_the_cutoff(session):
+    assert session.results["Q1"].isna().any()
+    timed = session.results[session.results["Q1"].notna()]
+    assert anomalous_lap_cutoff(session.results, 2) == anomalous_lap_cutoff(timed, 2)
+    assert not np.isnat(anomalous_lap_cutoff(session.results, np.array(KS, dtype=float))).any()
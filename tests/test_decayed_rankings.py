@@ -0,0 +1,94 @@
+import contextlib
+import io
+import math
+
+import pandas as pd
+import pytest
+
+from constants import DF_RACES
+from decayed_rankings import DecayedRankings, update_decayed_rankings
+from lineups import LINEUPS
+from q_helpers import filter_anomalous_Q_laps, return_ranked_Q_laps
+from quali_analysis import return_downforce_cube
+from synthetic_sessions import make_season
+
+
+@pytest.fixture(scope="module")
+def season_ranks():
+    ranks = {"Races": {}, "Sprints": {}}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for (event, quali_type), session in make_season(2023).items():
+            LINEUPS.add_results(2023, event, session.results)
+            # Without poor qualifying rows, which the decayed means leave out where the cube's means turn nan.
+            laps, _ = filter_anomalous_Q_laps(session)
+            ranks["Races" if quali_type == "Q" else "Sprints"][event] = return_ranked_Q_laps(laps, event=event, season=2023)
+    return ranks
+
+
+def test_infinite_half_life_matches_downforce_cube(season_ranks):
+    with contextlib.redirect_stdout(io.StringIO()):
+        cube = return_downforce_cube(season_ranks)
+
+    rankings = DecayedRankings(half_life=math.inf)
+    rankings.add_season(season_ranks, 2023)
+    for grouping in cube:
+        decayed = rankings.rankings(grouping)
+        for table in cube[grouping]:
+            pd.testing.assert_frame_equal(cube[grouping][table].reset_index(drop=True), decayed[table],
+                                          check_dtype=False, check_exact=False, rtol=1e-9)
+
+
+def test_recent_sessions_weigh_more(season_ranks):
+    races = list(season_ranks["Races"])
+    rankings = DecayedRankings(half_life=1)
+    rankings.add_session(season_ranks["Races"][races[0]], races[0], season=2023)
+    rankings.add_session(season_ranks["Races"][races[1]], races[1], season=2023)
+
+    first, second = (season_ranks["Races"][race]["Fastest Laps"].set_index("Driver")["FastestLapRank"] for race in races[:2])
+    driver = first.index[0]
+    expected = (first[driver] + 2 * second[driver]) / 3
+    assert rankings.rankings()["Driver"].set_index("Driver").loc[driver, "FL Average Rank"] == pytest.approx(expected)
+
+
+def test_sessions_are_folded_once_and_survive_a_round_trip(season_ranks, tmp_path):
+    path = str(tmp_path / "decayed.json")
+    first = dict(list(season_ranks["Races"].items())[:8])
+    partial = {"Races": first, "Sprints": {event: ranks for event, ranks in season_ranks["Sprints"].items() if event in first}}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        update_decayed_rankings(partial, 2023, path=path)
+        incremental = update_decayed_rankings(season_ranks, 2023, path=path)
+
+    one_shot = DecayedRankings()
+    one_shot.add_season(season_ranks, 2023)
+    assert one_shot.add_season(season_ranks, 2023) == 0
+    assert incremental.sessions == one_shot.sessions
+
+    loaded = DecayedRankings.load(path)
+    assert not loaded.add_session(season_ranks["Races"]["Sakhir"], "Sakhir", season=2023)
+    for grouping in one_shot.groupings:
+        pd.testing.assert_frame_equal(loaded.rankings(grouping)["Driver"], one_shot.rankings(grouping)["Driver"])
+
+
+def test_events_outside_the_calendar_count_for_all_tracks(season_ranks):
+    race = list(season_ranks["Races"])[0]
+    rankings = DecayedRankings()
+    rankings.add_session(season_ranks["Races"][race], "Hockenheim", season=2023)
+
+    assert not rankings.rankings(0)["Driver"].empty
+    assert all(rankings.rankings(level)["Driver"].empty for level in DF_RACES)
+
+
+def test_load_checks_the_saved_half_life(season_ranks, tmp_path):
+    path = str(tmp_path / "decayed.json")
+    rankings = DecayedRankings(half_life=3)
+    rankings.add_season(season_ranks, 2023)
+    rankings.save(path)
+
+    assert DecayedRankings.load(path).half_life == 3
+    assert DecayedRankings.load(path, half_life=3).sessions == rankings.sessions
+    with pytest.raises(ValueError):
+        DecayedRankings.load(path, half_life=6)
+    with pytest.raises(ValueError):
+        DecayedRankings.load(path, groupings={0: None})
+    assert DecayedRankings.load(str(tmp_path / "missing.json")).half_life == 6
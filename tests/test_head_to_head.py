@@ -0,0 +1,71 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import head_to_head
+from constants import CONSTRUCTORS
+from head_to_head import update_head_to_head
+from q_helpers import filter_anomalous_Q_laps, return_ranked_Q_laps
+from synthetic_sessions import make_quali_session
+
+EVENTS = ["Sakhir", "Jeddah", "Melbourne", "Baku", "Miami"]
+LINEUP = {driver: team for team, drivers in CONSTRUCTORS.items() for driver in drivers[:2]}
+
+
+def season_ranks():
+    races = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for seed, event in enumerate(EVENTS):
+            laps, _ = filter_anomalous_Q_laps(make_quali_session(event, lineup=LINEUP, seed=seed))
+            races[event] = return_ranked_Q_laps(laps, event=event, season=2001)
+    return {2001: {"Races": races, "Sprints": {}}}
+
+
+@pytest.fixture
+def ranks():
+    return season_ranks()
+
+
+def direct_deltas(ranks, driver, other):
+    deltas = []
+    for event, q_ranks in ranks[2001]["Races"].items():
+        times = q_ranks["Fastest Laps"].set_index("Driver")["FastestLapTime"]
+        deltas.append((times[driver] - times[other]) / pd.Timedelta(1, "ms"))
+    return np.array(deltas)
+
+
+def test_deltas_match_the_rank_frames(ranks, tmp_path):
+    driver, other = list(LINEUP)[:2]
+    with contextlib.redirect_stdout(io.StringIO()):
+        tensor = update_head_to_head(ranks, {"k": 2}, cache_dir=str(tmp_path))
+
+    expected = direct_deltas(ranks, driver, other)
+    np.testing.assert_allclose(tensor.deltas_between(driver, other).values, expected, atol=0.01)
+    assert tensor.median_delta(driver, other) == pytest.approx(np.median(expected), abs=0.01)
+    assert tensor.median_delta(other, driver) == pytest.approx(-np.median(expected), abs=0.01)
+
+
+def test_unchanged_ranks_reuse_the_tensor(ranks, tmp_path, monkeypatch):
+    with contextlib.redirect_stdout(io.StringIO()):
+        update_head_to_head(ranks, {"k": 2}, cache_dir=str(tmp_path))
+
+    def fail(*args):
+        raise AssertionError("the tensor was rebuilt")
+
+    monkeypatch.setattr(head_to_head, "build_head_to_head", fail)
+    update_head_to_head(season_ranks(), {"k": 2}, cache_dir=str(tmp_path))
+
+
+def test_changed_times_of_the_same_sessions_rebuild_the_tensor(ranks, tmp_path):
+    driver, other = list(LINEUP)[:2]
+    with contextlib.redirect_stdout(io.StringIO()):
+        update_head_to_head(ranks, {"k": 2}, cache_dir=str(tmp_path))
+
+        fastest = ranks[2001]["Races"]["Sakhir"]["Fastest Laps"]
+        fastest.loc[fastest["Driver"] == driver, "FastestLapTime"] += pd.Timedelta(1, "s")
+        tensor = update_head_to_head(ranks, {"k": 2}, cache_dir=str(tmp_path))
+
+    np.testing.assert_allclose(tensor.deltas_between(driver, other).values, direct_deltas(ranks, driver, other), atol=0.01)
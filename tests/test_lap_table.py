@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from constants import CONSTRUCTORS
+from lap_table import compact_laps, expand_laps, is_compact, COMPACT_TIME_COLUMNS
+from synthetic_sessions import make_quali_session
+
+# A fixed lineup with a reserve driver missing from DRIVERS.
+LINEUP = {**{driver: team for team, drivers in CONSTRUCTORS.items() for driver in drivers[:2]}, "RES": "Reserve Team"}
+
+
+def test_compact_table_round_trips():
+    laps = make_quali_session("Suzuka", lineup=LINEUP, seed=2).laps.copy()
+    laps.loc[laps.index[:3], "Sector1Time"] = pd.NaT
+    laps.loc[laps.index[3], "TyreLife"] = np.nan
+
+    compact = compact_laps(laps)
+    assert is_compact(compact) and not is_compact(laps)
+    assert compact_laps(compact) is compact
+    for column in COMPACT_TIME_COLUMNS:
+        assert str(compact[column].dtype) == "Int32"
+    assert compact["Driver"].dtype == "category" and "RES" in compact["Driver"].cat.categories
+    assert compact["Sector1Time"].isna().sum() == 3
+
+    expanded = expand_laps(compact)
+    assert expand_laps(laps) is laps
+    # Synthetic times have millisecond resolution, as FastF1 timing does, so nothing is lost.
+    for column in COMPACT_TIME_COLUMNS + ["Driver", "Team", "Compound", "IsAccurate", "Deleted"]:
+        pd.testing.assert_series_equal(expanded[column], laps[column], check_dtype=column not in ("Driver", "Team", "Compound"))
+    np.testing.assert_array_equal(expanded["TyreLife"].to_numpy(dtype=float, na_value=np.nan), laps["TyreLife"].values)
+    assert list(expanded.columns) == list(laps.columns)
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from q_helpers import pick_lead_driver
+
+
+def ranked_frame():
+    return pd.DataFrame({
+        "Driver": ["VER", "PER", "LEC", "SAI", "HAM", "RUS", "DEV"],
+        "Team": ["Red Bull Racing", "Red Bull Racing", "Ferrari", "Ferrari", "Mercedes", "Mercedes", "Red Bull Racing"],
+        "FastestLapTime": pd.to_timedelta([90.1, 90.5, 90.3, 90.2, 90.9, None, 91.0], unit="s"),
+        "FastestLapRank": [1, 4, 3, 2, 5, 7, 6],
+        "Event": ["Sakhir"] * 7,
+        "Session": ["Qualifying"] * 7,
+    })
+
+
+@pytest.mark.parametrize("by", [None, ["Event", "Session"]])
+def test_best_ranked_driver_of_each_team_is_reranked(by):
+    lead = pick_lead_driver(ranked_frame(), "FL", by=by)
+
+    assert lead["Driver"].tolist() == ["VER", "SAI", "HAM"]
+    assert lead["FastestLapRank"].tolist() == [1, 2, 3]
+
+
+def test_sessions_are_picked_separately():
+    first, second = ranked_frame(), ranked_frame()
+    second["Event"] = "Jeddah"
+    second["FastestLapRank"] = [7, 1, 2, 3, 4, 5, 6]
+    second.loc[second["Driver"] == "PER", "FastestLapTime"] = pd.Timedelta(89, "s")
+
+    lead = pick_lead_driver(pd.concat([second, first], ignore_index=True), "FL", by=["Event", "Session"])
+
+    assert lead[["Event", "Driver", "FastestLapRank"]].values.tolist() == [
+        ["Jeddah", "PER", 1], ["Jeddah", "LEC", 2], ["Jeddah", "HAM", 3],
+        ["Sakhir", "VER", 1], ["Sakhir", "SAI", 2], ["Sakhir", "HAM", 3],
+    ]
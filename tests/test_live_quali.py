@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from live_quali import LiveQualiRanker, replay, session_lap_events
+from q_helpers import return_ranked_Q_laps
+from synthetic_sessions import make_quali_session
+
+
+def batch_tables(laps):
+    """The batch tables of every valid lap, which is what a ranker with k=None keeps."""
+
+    valid = laps[laps["IsAccurate"].fillna(False) & ~laps["Deleted"].fillna(False) & laps["LapTime"].notna()]
+    return return_ranked_Q_laps(valid)
+
+
+def assert_same_tables(live, batch):
+    for table in ("Fastest Laps", "Average Laps"):
+        live_table, batch_table = live[table].set_index("Driver"), batch[table].set_index("Driver").loc[live[table]["Driver"]]
+        assert list(live_table.columns) == list(batch_table.columns)
+        for column in live_table.columns:
+            if column.endswith("Time"):
+                assert (live_table[column] - batch_table[column]).abs().max() < pd.Timedelta(1, "us")
+            elif column == "pct of pace":
+                np.testing.assert_allclose(live_table[column].values, batch_table[column].values, atol=1e-9)
+            else:
+                assert live_table[column].tolist() == batch_table[column].tolist()
+
+
+@pytest.fixture(scope="module")
+def session():
+    return make_quali_session("Monza", seed=5)
+
+
+def test_live_replay_matches_batch_tables(session):
+    ranker = replay(session_lap_events(session), LiveQualiRanker(k=None))
+    assert_same_tables(ranker.rank_tables(), batch_tables(session.laps))
+
+
+def test_removed_laps_leave_the_tables_of_the_remaining_laps(session):
+    ranker = replay(session_lap_events(session), LiveQualiRanker(k=None))
+    laps = session.laps[session.laps["IsAccurate"] & ~session.laps["Deleted"] & session.laps["LapTime"].notna()]
+
+    # Remove every driver's fastest lap, so minimums and sector minimums have to be recovered from the rest.
+    removed = laps.loc[laps.groupby("Driver")["LapTime"].idxmin()]
+    for lap in removed.itertuples():
+        sectors = tuple(getattr(lap, column) / pd.Timedelta(1, "ms") for column in ("Sector1Time", "Sector2Time", "Sector3Time"))
+        assert ranker.remove_lap(lap.Driver, lap.LapTime / pd.Timedelta(1, "ms"), sectors)
+
+    assert ranker.counts["removed"] == len(removed)
+    assert_same_tables(ranker.rank_tables(), batch_tables(laps.drop(index=removed.index)))
+
+
+def test_remove_lap_by_identity():
+    ranker = LiveQualiRanker(k=None)
+    ranker.add_lap("VER", "Red Bull Racing", 80000, (25000, 30000, 25000))
+    ranker.add_lap("VER", "Red Bull Racing", 80000, (24000, 31000, 25000))
+    ranker.add_lap("LEC", "Ferrari", 80500, (25500, 30000, 25000))
+
+    assert not ranker.remove_lap("VER", 80000, (26000, 29000, 25000))
+    assert ranker.remove_lap("VER", 80000, (24000, 31000, 25000))
+    assert ranker.stats["min"]["VER"] == [80000, 25000, 30000, 25000]
+    assert ranker.rank("LEC", column="Sector1Time") == 2
+
+    assert ranker.remove_lap("VER", 80000)
+    assert "VER" not in ranker.stats["min"]
+    assert ranker.rank("LEC") == 1
+    assert not ranker.remove_lap("VER", 80000)
+
+
+def test_adding_then_removing_laps_restores_the_state():
+    rng = np.random.default_rng(7)
+    laps = [("VER", "Red Bull Racing"), ("PER", "Red Bull Racing"), ("LEC", "Ferrari")] * 4
+    laps = [(driver, team, float(rng.integers(80000, 80400)), tuple(float(rng.integers(25000, 25100)) for _ in range(3))) for driver, team in laps]
+    laps[1] = laps[1][:3] + ((np.nan, 30000.0, np.nan),)  # Missing sector times.
+    laps[4] = laps[0]  # The same lap twice.
+
+    kept = LiveQualiRanker(k=None)
+    for driver, team, lap_time, sectors in laps[:6]:
+        kept.add_lap(driver, team, lap_time, sectors)
+
+    ranker = LiveQualiRanker(k=None)
+    for driver, team, lap_time, sectors in laps:
+        ranker.add_lap(driver, team, lap_time, sectors)
+    for driver, _, lap_time, sectors in reversed(laps[6:]):
+        assert ranker.remove_lap(driver, lap_time, sectors)
+
+    for name in ("stats", "ordered", "sizes"):
+        assert getattr(ranker, name) == getattr(kept, name)
+    assert ranker.sums == pytest.approx(kept.sums)
+
+    # Removing the rest, minimums first, empties the ranker.
+    for driver, _, lap_time, sectors in sorted(laps[:6], key=lambda lap: lap[2]):
+        assert ranker.remove_lap(driver, lap_time, sectors)
+    assert not ranker.laps and not ranker.heaps and all(not values for columns in ranker.ordered.values() for values in columns)
@@ -0,0 +1,63 @@
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from q_helpers import return_quali_ranks_per_session, return_quali_ranks_batch
+
+
+def session(rows):
+    results = pd.DataFrame(rows, columns=["Position", "Abbreviation", "Q1", "Q2", "Q3"])
+    for segment in ("Q1", "Q2", "Q3"):
+        results[segment] = pd.to_timedelta(results[segment], unit="s")
+    return types.SimpleNamespace(results=results)
+
+
+# Q1, Q2 and Q3 times in seconds, a driver knocked out in Q2, one in Q1, one over the 10 pct threshold and one with no time.
+RESULTS = [
+    (1.0, "VER", 90.0, 89.5, 89.0),
+    (2.0, "LEC", 90.45, 89.9, 89.178),
+    (3.0, "HAM", 90.9, 90.0, np.nan),
+    (4.0, "ALB", 91.8, np.nan, np.nan),
+    (5.0, "SAR", 100.0, np.nan, np.nan),
+    (6.0, "NOR", np.nan, np.nan, np.nan),
+]
+
+
+def test_segment_pcts_are_pinned():
+    ranks = return_quali_ranks_per_session(session(RESULTS))
+
+    assert list(ranks.columns) == ["Position", "Abbreviation", "Q1 pct", "Q2 pct", "Q3 pct", "Av pct"]
+    # Sorted by Av pct, drivers without one last in qualifying order.
+    assert list(ranks["Abbreviation"]) == ["VER", "LEC", "HAM", "ALB", "SAR", "NOR"]
+    # Rows keep the index of their position in Q3, then Q2, then Q1 order.
+    assert list(ranks.index) == [0, 1, 2, 3, 4, 5]
+
+    ranks = ranks.set_index("Abbreviation")
+    lec = [0.5, (89.9 - 89.5) / 89.5 * 100, 0.2]
+    ham = [1.0, (90.0 - 89.5) / 89.5 * 100]
+    expected = {
+        "VER": [0.0, 0.0, 0.0, 0.0],
+        "LEC": lec + [np.mean(lec)],
+        "HAM": ham + [np.nan, np.mean(ham)],
+        "ALB": [2.0, np.nan, np.nan, 2.0],
+        # Over the threshold in Q1, so every pct is removed.
+        "SAR": [np.nan] * 4,
+        "NOR": [np.nan] * 4,
+    }
+    for driver, values in expected.items():
+        np.testing.assert_allclose(ranks.loc[driver, ["Q1 pct", "Q2 pct", "Q3 pct", "Av pct"]].astype(float).values, values, atol=1e-9)
+
+
+def test_threshold_and_batch_match_single_sessions():
+    # With a higher threshold SAR keeps their Q1 pct.
+    ranks = return_quali_ranks_per_session(session(RESULTS), threshold=20).set_index("Abbreviation")
+    assert ranks.loc["SAR", "Q1 pct"] == pytest.approx((100.0 - 90.0) / 90.0 * 100)
+
+    # A session where nobody set a time in Q3, batched with the full one.
+    no_q3 = session([row[:4] + (np.nan,) for row in RESULTS])
+    batch = return_quali_ranks_batch({"full": session(RESULTS), "no Q3": no_q3})
+    pd.testing.assert_frame_equal(batch["full"], return_quali_ranks_per_session(session(RESULTS)))
+    pd.testing.assert_frame_equal(batch["no Q3"], return_quali_ranks_per_session(no_q3))
+    assert batch["no Q3"]["Q3 pct"].isna().all()
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from q_helpers import anomalous_lap_cutoff
+from quantile_sketch import TDigest
+
+QUANTILES = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+
+@pytest.fixture(scope="module")
+def values():
+    # Skewed like lap times relative to the fastest: most close to 1, a long slow tail.
+    rng = np.random.default_rng(3)
+    return 1 + rng.lognormal(-4, 0.8, 50_000)
+
+
+def digest_of(values):
+    digest = TDigest()
+    digest.update(values)
+    return digest
+
+
+def test_quantiles_are_close_to_exact(values):
+    digest = digest_of(values)
+    assert len(digest) == len(values)
+    assert len(digest.means) < 2 * digest.compression
+
+    ordered = np.sort(values)
+    for q in QUANTILES:
+        estimate = digest.quantile(q)
+        # Error in rank, i.e. the share of values between the estimate and the exact quantile.
+        assert abs(np.searchsorted(ordered, estimate) / len(values) - q) < 0.005
+        # In value, relative to the spread over the fastest time. The quartiles the cutoffs use are the tightest.
+        assert estimate - 1 == pytest.approx(np.quantile(values, q) - 1, rel=2e-3 if 0.25 <= q <= 0.75 else 3e-2)
+
+    assert digest.quantile(0) == values.min()
+    assert digest.quantile(1) == values.max()
+
+
+def test_small_samples_are_exact(values):
+    sample = values[:19]
+    for q in QUANTILES:
+        assert digest_of(sample).quantile(q) == pytest.approx(np.quantile(sample, q), rel=1e-12)
+
+
+def test_merging_matches_one_digest_over_all_the_data(values):
+    chunks = np.array_split(values, 3)
+    left = digest_of(chunks[0]).merge(digest_of(chunks[1])).merge(digest_of(chunks[2]))
+    right = digest_of(chunks[0]).merge(digest_of(chunks[1]).merge(digest_of(chunks[2])))
+    whole = digest_of(values)
+
+    assert len(left) == len(right) == len(whole)
+    for q in QUANTILES:
+        assert left.quantile(q) - 1 == pytest.approx(whole.quantile(q) - 1, rel=5e-3)
+        assert right.quantile(q) - 1 == pytest.approx(whole.quantile(q) - 1, rel=5e-3)
+
+    # Merging copies leaves the originals untouched.
+    first = digest_of(chunks[0])
+    before = first.quantile(0.5)
+    first.copy().merge(whole)
+    assert first.quantile(0.5) == before
+
+
+def test_iqr_cutoff_matches_the_exact_cutoff(values):
+    rng = np.random.default_rng(4)
+    q1_times = pd.to_timedelta(np.concatenate([rng.normal(90, 0.4, 19), [np.nan]]), unit="s")
+    results = pd.DataFrame({"Q1": q1_times})
+
+    ks = np.array([0.5, 1, 2, 3])
+    exact = anomalous_lap_cutoff(results, ks)
+
+    # A session's own times alone give the exact cutoff.
+    assert (np.abs(anomalous_lap_cutoff(results, ks, sketch=TDigest()) - exact) <= np.timedelta64(1, "us")).all()
+
+    # Pooled with many other sessions, the cutoff stays within tolerance of the exact quartiles of the pool.
+    relative = q1_times.dropna().values / q1_times.min()
+    pooled = np.concatenate([values, relative.astype(float)])
+    expected = q1_times.min() * (np.quantile(pooled, 0.75) + ks * (np.quantile(pooled, 0.75) - np.quantile(pooled, 0.25)))
+    cutoffs = anomalous_lap_cutoff(results, ks, sketch=digest_of(values))
+    # Compared as the margin over the fastest time, which is what the quartiles decide.
+    fastest = q1_times.min().to_timedelta64()
+    np.testing.assert_allclose((cutoffs - fastest) / np.timedelta64(1, "ms"), (expected - fastest) / np.timedelta64(1, "ms"), rtol=5e-3)
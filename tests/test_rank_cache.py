@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+import quali_analysis
+from lineups import LINEUPS
+from rank_cache import cached_frames, cache_path
+from synthetic_sessions import make_quali_session
+
+
+def test_cached_frames_round_trip(tmp_path):
+    frames = {"Fastest Laps": pd.DataFrame({"Driver": ["VER", "PER"], "FastestLapTime": pd.to_timedelta([90.1, 90.4], unit="s")})}
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return frames
+
+    first = cached_frames({"race": "Sakhir"}, compute, cache_dir=str(tmp_path))
+    second = cached_frames({"race": "Sakhir"}, compute, cache_dir=str(tmp_path))
+
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first["Fastest Laps"], second["Fastest Laps"])
+
+
+def test_cached_frames_recomputes_entries_missing_required_frames(tmp_path):
+    cached_frames({"race": "Sakhir"}, lambda: {"Ranks": pd.DataFrame({"a": [1]})}, cache_dir=str(tmp_path))
+    frames = cached_frames({"race": "Sakhir"}, lambda: {"Ranks": pd.DataFrame({"a": [1]}), "Lineup": pd.DataFrame({"b": [2]})},
+                           cache_dir=str(tmp_path), required=["Lineup"])
+
+    assert "Lineup" in frames
+
+
+def test_cached_frames_evicts_beyond_size_bound(tmp_path):
+    for race in ("Sakhir", "Jeddah", "Melbourne"):
+        cached_frames({"race": race}, lambda: {"Ranks": pd.DataFrame({"a": range(1000)})}, cache_dir=str(tmp_path), max_bytes=1)
+
+    # The entry just written is evicted last.
+    remaining = list(tmp_path.iterdir())
+    assert len(remaining) <= 1
+
+
+@pytest.fixture
+def synthetic_loader(monkeypatch, tmp_path):
+    """Route session loading to synthetic sessions and the rank cache to a temporary directory."""
+
+    loads = []
+
+    def get_quali_session(race, quali_type="Q", year=2023, laps_only=True):
+        loads.append((race, quali_type))
+        session = make_quali_session(race, quali_type, year=year, seed=[7, len(race)])
+        session.results["TeamName"] = session.results["TeamName"].where(session.results["Abbreviation"] != "VER", "Test Team")
+        return session
+
+    monkeypatch.setattr(quali_analysis, "get_quali_session", get_quali_session)
+    monkeypatch.setattr(quali_analysis, "ingest_session", lambda *args, **kwargs: None)
+    monkeypatch.setattr(quali_analysis, "cached_frames", lambda key, compute, **kwargs: cached_frames(key, compute, cache_dir=str(tmp_path), **kwargs))
+    return loads
+
+
+def test_cache_hit_matches_cold_run_and_registers_lineup(synthetic_loader):
+    cold = quali_analysis.return_race_quali_ranks("Sakhir", year=2001)
+    LINEUPS.lineups.pop((2001, "Sakhir"))
+    LINEUPS._index = None
+
+    warm = quali_analysis.return_race_quali_ranks("Sakhir", year=2001)
+
+    assert len(synthetic_loader) == 1
+    assert set(warm) == {"Fastest Laps", "Average Laps"}
+    assert LINEUPS.team("VER", "Sakhir", 2001) == "Test Team"
+    for table in cold:
+        pd.testing.assert_frame_equal(cold[table], warm[table])
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from q_helpers import filter_anomalous_Q_laps, return_ranked_Q_laps, LAP_TIME_COLUMNS
+from constants import CONSTRUCTORS
+from synthetic_sessions import make_quali_session
+
+# A fixed lineup, so the session does not depend on the lineups other tests register.
+LINEUP = {driver: team for team, drivers in CONSTRUCTORS.items() for driver in drivers[:2]}
+
+
+@pytest.fixture(scope="module")
+def filtered():
+    session = make_quali_session("Suzuka", lineup=LINEUP, no_time_drivers=("SAR",), seed=11)
+    return filter_anomalous_Q_laps(session)
+
+
+@pytest.mark.parametrize("table, prefix, agg", [("Fastest Laps", "Fastest", "min"), ("Average Laps", "Average", "mean")])
+def test_ranks_match_per_driver_reference(filtered, table, prefix, agg):
+    laps, _ = filtered
+    ranked = return_ranked_Q_laps(laps)[table].set_index("Driver")
+
+    # Plain per driver reference on the float milliseconds.
+    reference = laps[["Driver"] + LAP_TIME_COLUMNS].astype({column: float for column in LAP_TIME_COLUMNS})
+    reference = reference.groupby("Driver", observed=True)[LAP_TIME_COLUMNS].agg(agg).loc[ranked.index]
+    for column in LAP_TIME_COLUMNS:
+        times = ranked[prefix + column] / pd.Timedelta(1, "ms")
+        np.testing.assert_allclose(times.values, reference[column].values, atol=1e-3)
+
+        expected = reference[column].rank(method="min").astype(int)
+        assert (ranked[prefix + column.replace("Time", "Rank")] == expected).all()
+
+    assert ranked[f"{prefix}LapRank"].is_monotonic_increasing
+    fastest = reference["LapTime"].min()
+    expected_pct = (reference["LapTime"] - fastest) / fastest * 100
+    np.testing.assert_allclose(ranked["pct of pace"].values, expected_pct.loc[ranked.index].values, atol=1e-9)
+
+
+def test_poor_quali_drivers_are_appended_without_times(filtered):
+    laps, poor_q_ranks = filtered
+    assert poor_q_ranks == {"SAR": 20}
+
+    fastest = return_ranked_Q_laps(laps, poor_q_ranks)["Fastest Laps"]
+    assert fastest["Driver"].iloc[-1] == "SAR"
+    assert fastest["FastestLapRank"].iloc[-1] == 20
+    assert pd.isna(fastest["FastestLapTime"].iloc[-1])
+
+    # The appended rows keep the dtypes of the timed rows.
+    assert pd.api.types.is_timedelta64_dtype(fastest["FastestLapTime"])
+    assert pd.api.types.is_float_dtype(fastest["pct of pace"])
+    assert pd.api.types.is_float_dtype(fastest["FastestLapRank"])
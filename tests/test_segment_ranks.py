@@ -0,0 +1,84 @@
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from q_helpers import return_segment_boundaries, return_segment_ranks, return_segment_ranks_batch
+
+# Q2 is red flagged at 1700s and restarted at 1800s, which must not start a new segment.
+STATUS = [("Inactive", 0), ("Started", 100), ("Finished", 1000), ("Started", 1500), ("Aborted", 1700), ("Started", 1800),
+          ("Finished", 2300), ("Started", 2800), ("Finished", 3300), ("Finalised", 3400), ("Ends", 3500)]
+
+TEAMS = {"VER": "Red Bull", "PER": "Red Bull", "LEC": "Ferrari", "SAI": "Ferrari", "HAM": "Mercedes", "RUS": "Mercedes"}
+
+# (driver, lap time, session time at the end of the lap) in seconds.
+LAPS = [
+    ("VER", 80.0, 50),  # Before Q1 started, not in any segment.
+    # Q1: VER and PER tie, HAM and RUS are knocked out.
+    ("VER", 90.0, 400), ("PER", 90.0, 420), ("LEC", 90.5, 440), ("LEC", 120.0, 600), ("SAI", 91.0, 460),
+    ("HAM", 91.5, 480), ("RUS", 92.0, 500),
+    # Q2: PER and LEC tie, SAI sets their lap under the red flag, LEC and SAI are knocked out.
+    ("VER", 89.0, 2000), ("PER", 89.2, 2010), ("LEC", 89.2, 2020), ("SAI", 89.5, 1750),
+    # Q3
+    ("VER", 88.5, 3000), ("PER", 88.3, 3010),
+]
+
+
+def session():
+    laps = pd.DataFrame(LAPS, columns=["Driver", "LapTime", "Time"])
+    laps.insert(1, "Team", laps["Driver"].map(TEAMS))
+    laps["LapTime"] = pd.to_timedelta(laps["LapTime"], unit="s")
+    laps["Time"] = pd.to_timedelta(laps["Time"], unit="s")
+    laps["IsAccurate"] = True
+    laps["Deleted"] = False
+
+    status = pd.DataFrame(STATUS, columns=["Status", "Time"])
+    status["Time"] = pd.to_timedelta(status["Time"], unit="s")
+    return types.SimpleNamespace(laps=laps, session_status=status)
+
+
+def test_boundaries_ignore_restarts_after_a_red_flag():
+    boundaries = return_segment_boundaries(session().session_status)
+    np.testing.assert_array_equal(boundaries, np.array([100, 1500, 2800, 3500]) * 10**9)
+
+
+def test_laps_are_ranked_within_their_segment():
+    segments = return_segment_ranks(session())["Segments"]
+
+    assert list(segments["Segment"].unique()) == ["Q1", "Q2", "Q3"]
+    drivers_per_segment = segments.groupby("Segment")["Driver"].apply(set).to_dict()
+    assert drivers_per_segment == {"Q1": set(TEAMS), "Q2": {"VER", "PER", "LEC", "SAI"}, "Q3": {"VER", "PER"}}
+
+    q1 = segments[segments["Segment"] == "Q1"].set_index("Driver")
+    # The lap before Q1 started does not count, and LEC's slow lap is over the cutoff.
+    assert q1.loc["VER", "BestLapTime"] == pd.Timedelta(90, "s")
+    assert q1.loc["LEC", "Laps"] == 1
+    # Tied times share the best rank and the next driver skips a rank.
+    assert q1["SegmentRank"].to_dict() == {"VER": 1, "PER": 1, "LEC": 3, "SAI": 4, "HAM": 5, "RUS": 6}
+    assert q1["SegmentRank"].is_monotonic_increasing
+    assert q1.loc["HAM", "pct of pace"] == pytest.approx(1.5 / 90 * 100)
+
+    q2 = segments[segments["Segment"] == "Q2"].set_index("Driver")
+    assert q2["SegmentRank"].to_dict() == {"VER": 1, "PER": 2, "LEC": 2, "SAI": 4}
+    assert q2.loc["SAI", "BestLapTime"] == pd.Timedelta(89.5, "s")
+
+
+def test_driver_averages_cover_the_segments_they_reached():
+    drivers = return_segment_ranks(session())["Drivers"].set_index("Driver")
+
+    assert drivers["Segments"].to_dict() == {"VER": 3, "PER": 3, "LEC": 2, "SAI": 2, "HAM": 1, "RUS": 1}
+    assert drivers.loc["VER", "Average Segment Rank"] == pytest.approx((1 + 1 + 2) / 3)
+    assert drivers.loc["LEC", "Average Segment Rank"] == pytest.approx((3 + 2) / 2)
+    assert drivers.loc["RUS", "Average Segment Rank"] == 6
+    assert drivers["Avg pct of segment pace"].is_monotonic_increasing
+
+
+def test_batch_matches_single_sessions():
+    batch = return_segment_ranks_batch({"first": session(), "second": session()})
+    single = return_segment_ranks(session())
+
+    for name in ("Segments", "Drivers"):
+        for key in ("first", "second"):
+            rows = batch[name][batch[name]["Session"] == key].drop(columns="Session").reset_index(drop=True)
+            pd.testing.assert_frame_equal(rows, single[name].reset_index(drop=True))
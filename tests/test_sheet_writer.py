@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from sheet_writer import LocalWorksheet, SheetWriter, MAX_RANGES_PER_REQUEST
+
+
+class CountingWorksheet(LocalWorksheet):
+    """LocalWorksheet counting batch_update and resize calls separately."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = {"batch_update": 0, "resize": 0}
+
+    def batch_update(self, data, **kwargs):
+        self.calls["batch_update"] += 1
+        super().batch_update(data, **kwargs)
+
+    def resize(self, rows=None, cols=None):
+        self.calls["resize"] += 1
+        super().resize(rows, cols)
+
+
+def rank_frame(by, names):
+    return pd.DataFrame({by: names, "FL Average Rank": np.arange(1.0, len(names) + 1),
+                         "Avg pct of FL pace": [0.0] + [np.nan] * (len(names) - 1)})
+
+
+def test_rank_layout_is_written_in_one_batch(tmp_path):
+    worksheet = CountingWorksheet(str(tmp_path / "ranks.csv"), rows=20, cols=10)
+    writer = SheetWriter(worksheet)
+
+    # Two downforce levels laid out as record_quali_ranks does, the second one below the grid.
+    for level in range(2):
+        row = 2 + level * 23
+        writer.write_cell(row - 1, 1, f"Level {level}")
+        writer.write_frame(rank_frame("Team", ["Red Bull", "Ferrari"]), row=row, col=1)
+        writer.write_frame(rank_frame("Driver", ["VER", "LEC", "SAI"]), row=row, col=7)
+
+    assert writer.flush() == 2
+    assert worksheet.calls == {"batch_update": 1, "resize": 1}
+    assert (worksheet.row_count, worksheet.col_count) == (28, 10)
+
+    assert worksheet.cell_value(1, 1) == "Level 0"
+    assert [worksheet.cell_value(2, col) for col in range(1, 4)] == ["Team", "FL Average Rank", "Avg pct of FL pace"]
+    assert [worksheet.cell_value(3, col) for col in range(1, 4)] == ["Red Bull", 1.0, 0.0]
+    assert worksheet.cell_value(4, 3) == ""
+    assert [worksheet.cell_value(28, col) for col in range(7, 10)] == ["SAI", 3.0, ""]
+
+    # Nothing queued, nothing sent.
+    assert writer.flush() == 0
+    assert worksheet.calls == {"batch_update": 1, "resize": 1}
+
+    # The CSV holds the same grid.
+    assert LocalWorksheet(worksheet.path).cell_value(25, 7) == "Driver"
+
+
+def test_many_ranges_are_split_across_requests():
+    worksheet = CountingWorksheet()
+    writer = SheetWriter(worksheet)
+    for row in range(1, MAX_RANGES_PER_REQUEST + 2):
+        writer.write_cell(row, 1, row)
+
+    assert writer.flush() == 2
+    assert worksheet.calls == {"batch_update": 2, "resize": 0}
+    assert worksheet.cell_value(MAX_RANGES_PER_REQUEST + 1, 1) == MAX_RANGES_PER_REQUEST + 1
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks import compare_to_baseline
+from session_loader import LAP_COLUMNS, RESULT_COLUMNS
+from synthetic_sessions import make_quali_session, make_season, KNOCKOUTS
+
+
+def test_session_layout_matches_loaded_sessions():
+    session = make_quali_session("Monaco", seed=1)
+
+    assert list(session.laps.columns) == LAP_COLUMNS
+    assert list(session.results.columns) == RESULT_COLUMNS
+    assert pd.api.types.is_timedelta64_dtype(session.laps["LapTime"])
+    assert session.results["Position"].tolist() == list(range(1, len(session.results) + 1))
+
+
+def test_knockouts_follow_qualifying_format():
+    session = make_quali_session(seed=2)
+    drivers = len(session.results)
+
+    assert session.results["Q1"].notna().sum() == drivers
+    assert session.results["Q2"].notna().sum() == drivers - KNOCKOUTS[0]
+    assert session.results["Q3"].notna().sum() == drivers - sum(KNOCKOUTS)
+
+
+def test_same_seed_gives_same_session():
+    first, second = make_quali_session(seed=[3, 4]), make_quali_session(seed=[3, 4])
+
+    pd.testing.assert_frame_equal(first.laps, second.laps)
+    assert not first.laps.equals(make_quali_session(seed=[3, 5]).laps)
+
+
+def test_no_time_drivers_have_no_valid_lap():
+    laps = make_quali_session(no_time_drivers=("SAR",), seed=5).laps
+    valid = laps[laps["IsAccurate"] & ~laps["Deleted"]]
+
+    assert "SAR" in set(laps["Driver"])
+    assert "SAR" not in set(valid["Driver"])
+
+
+def test_season_has_every_race_and_sprint():
+    season = make_season(2023, events=["Sakhir", "Baku", "Monaco"], sprints=["Baku"])
+
+    assert list(season) == [("Sakhir", "Q"), ("Baku", "Q"), ("Baku", 3), ("Monaco", "Q")]
+    assert set(season[("Baku", 3)].laps["Compound"]) == {"MEDIUM", "SOFT"}
+
+
+def test_compare_to_baseline_flags_regressions_and_missing_baselines():
+    baseline = {"calibration": 1.0, "scales": {"season": {"fast": 1.0, "slow": 1.0}}}
+    comparison = compare_to_baseline(2.0, {"season": {"fast": 2.0, "slow": 3.0, "new": 1.0}}, baseline, tolerance=1.3)
+    comparison = comparison.set_index("Benchmark")
+
+    assert comparison.loc["fast", "Ratio"] == 1.0
+    assert not comparison.loc["fast", "Regression"]
+    assert comparison.loc["slow", "Regression"]
+    assert comparison.loc["new", "Missing"] and np.isnan(comparison.loc["new", "Ratio"])
@@ -0,0 +1,65 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import quali_analysis
+from q_helpers import filter_anomalous_Q_laps, return_ranked_Q_laps
+from synthetic_sessions import make_quali_session
+from track_evolution import correct_track_evolution, correct_track_evolution_batch
+
+EVENTS = ["Sakhir", "Jeddah", "Melbourne", "Baku", "Miami", "Imola"]
+
+
+def filtered_laps(event, seed, **session_kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return filter_anomalous_Q_laps(make_quali_session(event, seed=seed, **session_kwargs))
+
+
+@pytest.fixture(scope="module")
+def sessions():
+    # No tyre degradation, which would otherwise add to the trend through the session.
+    return [filtered_laps(event, seed, track_evolution=0.02, tyre_degradation={})[0] for seed, event in enumerate(EVENTS)]
+
+
+def test_fit_recovers_generated_trend(sessions):
+    _, fit = correct_track_evolution_batch(sessions)
+
+    assert fit["LapTime slope"].mean() == pytest.approx(-20, abs=3)
+    assert (fit["Laps"] == [len(laps) for laps in sessions]).all()
+
+
+def test_batch_matches_single_sessions(sessions):
+    corrected, fit = correct_track_evolution_batch(sessions)
+
+    for laps, batch_laps, (_, batch_fit) in zip(sessions, corrected, fit.iterrows()):
+        single_laps, single_fit = correct_track_evolution(laps)
+        pd.testing.assert_frame_equal(single_laps, batch_laps)
+        pd.testing.assert_series_equal(single_fit, batch_fit, check_names=False)
+
+
+def test_laps_without_session_time_are_left_as_they_are(sessions):
+    laps = sessions[0].drop(columns="Time")
+    with pytest.warns(UserWarning, match="no Time column"):
+        corrected, fit = correct_track_evolution_batch([laps, sessions[1]])
+
+    assert corrected[0]["LapTime"].equals(laps["LapTime"])
+    assert fit.loc[0, "Laps"] == 0
+    assert fit.loc[1, "LapTime slope"] < 0
+
+
+def test_season_scrape_corrects_sessions_together(monkeypatch, sessions):
+    events = dict(zip(EVENTS[:3], sessions[:3]))
+    monkeypatch.setattr(quali_analysis, "return_season_sessions", lambda year: [(event, "Q") for event in events])
+    monkeypatch.setattr(quali_analysis, "load_filtered_session", lambda race, quali_type, year: (events[race], {}))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        scraped = quali_analysis.scrape_all_quali_laps(year=2001, track_evolution=True)
+
+    assert scraped["Status"]["Success"].all()
+    for event, laps in events.items():
+        expected = return_ranked_Q_laps(correct_track_evolution(laps)[0], event=event, season=2001)
+        for table in expected:
+            pd.testing.assert_frame_equal(scraped["Races"][event][table], expected[table])
@@ -0,0 +1,79 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+import tyre_normalisation
+from q_helpers import filter_anomalous_Q_laps
+from synthetic_sessions import make_quali_session, TYRE_DEGRADATION
+from tyre_normalisation import fit_tyre_degradation, load_tyre_coefficients, normalise_tyre_life, season_tyre_coefficients
+
+EVENTS = ["Sakhir", "Jeddah", "Melbourne", "Baku"]
+
+
+def filtered_laps(event, quali_type="Q", seed=0):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return filter_anomalous_Q_laps(make_quali_session(event, quali_type, seed=[seed, len(event)]))[0]
+
+
+@pytest.fixture(scope="module")
+def weekends():
+    """Qualifying and sprint qualifying laps of a few sprint weekends: (laps, track) pairs."""
+
+    return [(filtered_laps(event, quali_type, seed), event) for seed, event in enumerate(EVENTS) for quali_type in ("Q", 3)]
+
+
+def test_fit_recovers_generated_degradation(weekends):
+    fit = fit_tyre_degradation(*zip(*weekends))
+    slopes = fit["LapTime"].groupby(level="Compound").mean()
+
+    assert slopes["SOFT"] == pytest.approx(TYRE_DEGRADATION["SOFT"] * 1000, abs=8)
+    assert slopes["MEDIUM"] == pytest.approx(TYRE_DEGRADATION["MEDIUM"] * 1000, abs=8)
+
+
+def test_cached_slopes_are_reused(weekends, tmp_path, monkeypatch):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fitted = season_tyre_coefficients(*zip(*weekends), season=2001, cache_dir=str(tmp_path))
+
+    def fail(*args):
+        raise AssertionError("cached tracks were fitted again")
+
+    monkeypatch.setattr(tyre_normalisation, "fit_tyre_degradation", fail)
+    cached = season_tyre_coefficients(*zip(*weekends), season=2001, cache_dir=str(tmp_path))
+    for track in EVENTS:
+        np.testing.assert_allclose(cached[track].to_numpy(dtype=float), fitted[track].to_numpy(dtype=float))
+
+
+def test_sprint_after_qualifying_adds_its_compounds(weekends, tmp_path):
+    (qualifying, track), (sprint, _) = weekends[:2]
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = season_tyre_coefficients([qualifying], [track], season=2001, cache_dir=str(tmp_path))[track]
+        second = season_tyre_coefficients([sprint], [track], season=2001, cache_dir=str(tmp_path))[track]
+
+    assert list(first.index) == ["SOFT"]
+    assert set(second.index) == {"SOFT", "MEDIUM"}
+    assert second.loc["SOFT", "LapTime"] == first.loc["SOFT", "LapTime"]
+    assert set(load_tyre_coefficients(2001, track, str(tmp_path)).index) == {"SOFT", "MEDIUM"}
+
+
+def test_normalised_laps_move_to_a_fresh_tyre(weekends):
+    laps, track = weekends[0]
+    coefficients = fit_tyre_degradation([laps], [track]).droplevel("Track")
+    normalised = normalise_tyre_life(laps, coefficients)
+
+    tyre_age = laps["TyreLife"].to_numpy(dtype=float) - 1
+    expected = laps["LapTime"].to_numpy(dtype=float) - coefficients.loc["SOFT", "LapTime"] * tyre_age
+    np.testing.assert_allclose(normalised["LapTime"].to_numpy(dtype=float), expected, atol=0.5)
+
+
+def test_laps_without_tyre_columns_warn(weekends):
+    laps, track = weekends[0]
+    old_laps = laps.drop(columns=["Compound", "TyreLife"])
+
+    with pytest.warns(UserWarning, match="left out of the tyre fit"):
+        fit = fit_tyre_degradation([old_laps, laps], [track, track])
+    assert list(fit.index.get_level_values("Compound")) == ["SOFT"]
+
+    with pytest.warns(UserWarning, match="not normalised"):
+        assert normalise_tyre_life(old_laps, fit.droplevel("Track"))["LapTime"].equals(old_laps["LapTime"])
@@ -0,0 +1,68 @@
+import contextlib
+import io
+import types
+
+import pandas as pd
+
+import session_loader
+from q_helpers import filter_anomalous_Q_laps
+from session_loader import return_season_sessions
+from synthetic_sessions import make_quali_session
+from warehouse import ingest_session, partition_path, query_catalog, read_laps
+
+
+def ingest(tmp_path, season, event, k=2):
+    session = make_quali_session(event, seed=[season, len(event)])
+    with contextlib.redirect_stdout(io.StringIO()):
+        laps, poor_q_ranks = filter_anomalous_Q_laps(session, k=k)
+    return ingest_session(season, event, "Qualifying", laps, poor_q_ranks, session.results, k=k, version=3, warehouse_dir=str(tmp_path))
+
+
+def test_partitions_are_written_once_and_k_is_normalised(tmp_path):
+    assert ingest(tmp_path, 2022, "Monaco")
+    assert not ingest(tmp_path, 2022, "Monaco", k=2.0)
+    assert partition_path(2022, "Monaco", "Qualifying", 2, 3) == partition_path(2022, "Monaco", "Qualifying", 2.0, 3)
+
+    catalog = query_catalog(2022, warehouse_dir=str(tmp_path))
+    assert catalog[["Season", "Event", "Session", "Version"]].values.tolist() == [[2022, "Monaco", "Qualifying", 3]]
+    assert len(read_laps(2022, warehouse_dir=str(tmp_path))) == catalog["Laps"].sum()
+
+
+def test_queries_only_read_the_requested_directories(tmp_path):
+    ingest(tmp_path, 2021, "Monaco")
+    ingest(tmp_path, 2022, "Monaco")
+    ingest(tmp_path, 2022, "Monza")
+
+    # An unreadable catalog entry outside the query must not be opened.
+    (tmp_path / "2021" / "Monaco" / "broken.json").write_text("{")
+
+    assert query_catalog(2022, warehouse_dir=str(tmp_path))["Event"].tolist() == ["Monaco", "Monza"]
+    assert query_catalog([2022], events="Monza", warehouse_dir=str(tmp_path))["Event"].tolist() == ["Monza"]
+    assert query_catalog(2023, warehouse_dir=str(tmp_path)).empty
+
+
+def fake_schedule(monkeypatch, events):
+    schedule = pd.DataFrame(events, columns=["Location", "EventName", "Session2", "Session3"])
+    fastf1 = types.SimpleNamespace(get_event_schedule=lambda year, include_testing=False: schedule)
+    monkeypatch.setattr(session_loader, "import_fastf1", lambda: fastf1)
+
+
+def test_events_sharing_a_location_keep_their_own_keys(monkeypatch):
+    fake_schedule(monkeypatch, [
+        ["Spielberg", "Austrian Grand Prix", "Practice 2", "Practice 3"],
+        ["Spielberg", "Styrian Grand Prix", "Practice 2", "Practice 3"],
+        ["Budapest", "Hungarian Grand Prix", "Practice 2", "Practice 3"],
+    ])
+
+    assert return_season_sessions(2020) == [("Austrian Grand Prix", "Q"), ("Styrian Grand Prix", "Q"), ("Budapest", "Q")]
+
+
+def test_sprint_qualifying_is_picked_by_season(monkeypatch):
+    events = [["Silverstone", "British Grand Prix", "Qualifying", "Sprint Qualifying"],
+              ["Baku", "Azerbaijan Grand Prix", "Qualifying", "Sprint Shootout"]]
+    fake_schedule(monkeypatch, events)
+
+    # In 2021 "Sprint Qualifying" was the sprint race, and there was no shootout yet.
+    assert return_season_sessions(2021) == [("Silverstone", "Q"), ("Baku", "Q")]
+    assert return_season_sessions(2022) == [("Silverstone", "Q"), ("Baku", "Q")]
+    assert return_season_sessions(2024) == [("Silverstone", "Q"), ("Silverstone", 3), ("Baku", "Q")]
@@ -0,0 +1,125 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from lap_table import compact_laps
+from q_helpers import LAP_TIME_COLUMNS
+from constants import *
+
+#### Track evolution correction
+
+# The track rubbers in through a session, so laps set late (Q3) look faster than the car is. For every session
+# the lap and sector times are fitted against session time with a per driver intercept, i.e. the slope comes from
+# how each driver's own laps changed through the session, so it is not skewed by only the fastest drivers running
+# late. The slope of every session is solved at once from grouped sums (the normal equations of the batched least
+# squares problem), then each lap is moved to the track state of the session's last lap.
+
+MS_PER_MINUTE = 60_000
+
+
+def fit_and_correct(times, session_time, sessions, drivers, n_sessions: int):
+    """
+    Fit and remove the track evolution of many sessions at once.
+
+    Args:
+        times (ndarray): (laps, columns) lap and sector times in ms, NaN where missing.
+        session_time (ndarray): Session time at the end of each lap in ms, NaN where missing.
+        sessions (ndarray): Session code (0 to n_sessions - 1) of each lap.
+        drivers (ndarray): Driver code of each lap, any integers.
+        n_sessions (int): Number of sessions.
+
+    Returns:
+        tuple: (corrected times, slopes (sessions, columns) in ms per minute, reference session time per session in ms,
+                laps used per session).
+    """
+
+    minutes = session_time / MS_PER_MINUTE
+    timed = ~np.isnan(minutes)
+
+    # One group per (session, driver), the per driver intercepts.
+    groups = pd.factorize(sessions.astype(np.int64) * (int(drivers.max(initial=0)) + 1) + drivers)[0]
+    n_groups = groups.max(initial=-1) + 1
+
+    slopes = np.zeros((n_sessions, times.shape[1]))
+    for column in range(times.shape[1]):
+        used = timed & ~np.isnan(times[:, column])
+        group, session, x, y = groups[used], sessions[used], minutes[used], times[used, column]
+
+        count = np.bincount(group, minlength=n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x_mean = np.bincount(group, x, minlength=n_groups) / count
+            y_mean = np.bincount(group, y, minlength=n_groups) / count
+        dx, dy = x - x_mean[group], y - y_mean[group]
+
+        sxy = np.bincount(session, dx * dy, minlength=n_sessions)
+        sxx = np.bincount(session, dx * dx, minlength=n_sessions)
+        slopes[:, column] = np.divide(sxy, sxx, out=np.zeros(n_sessions), where=sxx > 0)
+
+    reference = np.full(n_sessions, np.nan)
+    np.fmax.at(reference, sessions[timed], minutes[timed])
+    laps_used = np.bincount(sessions[timed & ~np.isnan(times[:, 0])], minlength=n_sessions)
+
+    # Move every lap to the track state at the session's last lap, laps without a session time are left as they are.
+    shift = np.where(timed, reference[sessions] - minutes, 0.0)
+    corrected = times + slopes[sessions] * shift[:, None]
+
+    return corrected, slopes, reference * MS_PER_MINUTE, laps_used
+
+
+def correct_track_evolution_batch(lap_frames):
+    """
+    Remove the track evolution from every session's laps in one batched fit.
+
+    Args:
+        lap_frames (list): One lap frame per session with Driver, LapTime, sector times and Time,
+                           as returned by `filter_anomalous_Q_laps`. Sessions without Time (e.g. warehouse
+                           partitions ingested before it was kept) are left as they are, with a warning.
+
+    Returns:
+        tuple:
+            - list of the corrected lap frames, compact, with LapTime and sector times moved to the track state
+              of each session's last lap.
+            - DataFrame with one row per session: a slope per time column (ms per minute of session, negative when
+              the track got faster), Reference Time (ms) and Laps (laps used for the fit).
+    """
+
+    lap_frames = [compact_laps(laps) for laps in lap_frames]
+    untimed = sum("Time" not in laps for laps in lap_frames)
+    if untimed:
+        warnings.warn(f"{untimed} of {len(lap_frames)} sessions have no Time column and are not corrected for track evolution, "
+                      f"re-ingest them with the current ANALYSIS_VERSION")
+    sizes = [len(laps) for laps in lap_frames]
+
+    times = np.concatenate([laps[LAP_TIME_COLUMNS].to_numpy(dtype=float, na_value=np.nan) for laps in lap_frames]) if lap_frames else np.empty((0, len(LAP_TIME_COLUMNS)))
+    session_time = np.concatenate([laps["Time"].to_numpy(dtype=float, na_value=np.nan) if "Time" in laps else np.full(len(laps), np.nan)
+                                   for laps in lap_frames]) if lap_frames else np.empty(0)
+    sessions = np.repeat(np.arange(len(lap_frames)), sizes)
+    drivers = pd.factorize(np.concatenate([laps["Driver"].astype(object).values for laps in lap_frames]) if lap_frames else np.empty(0, dtype=object))[0]
+
+    corrected, slopes, reference, laps_used = fit_and_correct(times, session_time, sessions, drivers, len(lap_frames))
+
+    output = []
+    for laps, start, stop in zip(lap_frames, np.cumsum([0] + sizes[:-1]), np.cumsum(sizes)):
+        laps = laps.copy()
+        for i, column in enumerate(LAP_TIME_COLUMNS):
+            values = corrected[start:stop, i]
+            laps[column] = pd.arrays.IntegerArray(np.round(np.nan_to_num(values)).astype(np.int32), np.isnan(values))
+        output.append(laps)
+
+    fit = pd.DataFrame(slopes, columns=[f"{column} slope" for column in LAP_TIME_COLUMNS])
+    fit["Reference Time"] = reference
+    fit["Laps"] = laps_used
+    return output, fit
+
+
+def correct_track_evolution(laps):
+    """
+    Remove the track evolution from one session's laps, see `correct_track_evolution_batch`.
+
+    Returns:
+        tuple: (corrected laps, fit as a Series).
+    """
+
+    corrected, fit = correct_track_evolution_batch([laps])
+    return corrected[0], fit.iloc[0]
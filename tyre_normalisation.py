@@ -0,0 +1,228 @@
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from lap_table import compact_laps
+from q_helpers import LAP_TIME_COLUMNS, ANALYSIS_VERSION
+from track_evolution import MS_PER_MINUTE
+from constants import *
+
+#### Tyre life normalisation
+
+# A lap on a set of softs that has already done a run is slower than one on a fresh set, so ranking raw times
+# favours drivers who could afford more new sets. For every (track, compound) a degradation slope (ms per lap of
+# tyre life) is fitted with a per (session, driver) intercept and a per session track evolution slope, so it comes
+# from how each driver's own laps changed with tyre age rather than from who ran on used tyres. All tracks of a
+# season are fitted at once as one least squares problem on the within-driver demeaned design matrix, then every
+# lap is moved to a fresh tyre (TyreLife 1). Slopes are cached per (season, track), so a report run only fits the
+# tracks it has not seen before. A cached track is refitted when new sessions bring compounds it has no slope for
+# (e.g. the sprint's mediums after the qualifying softs), and the new compounds are added to its entry.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TYRE_CACHE_DIR = os.path.join(ROOT_DIR, "Cache", "tyre_coefficients")
+
+COEFFICIENT_COLUMNS = LAP_TIME_COLUMNS + ["Laps"]
+
+
+def fit_tyre_degradation(lap_frames, tracks):
+    """
+    Fit the degradation slope of every (track, compound) in one batched least squares fit.
+
+    Args:
+        lap_frames (list): One lap frame per session with Driver, LapTime, sector times, Compound, TyreLife and Time,
+                           as returned by `filter_anomalous_Q_laps`.
+        tracks (list): The track of each session. Sessions at the same track share their slopes.
+
+    Returns:
+        DataFrame: Indexed by (Track, Compound), a slope per time column (ms per lap of tyre life, positive when
+                   older tyres are slower) and Laps (laps used for the fit). Slopes that the laps cannot identify
+                   (e.g. no driver used the compound at two tyre ages) are 0.
+    """
+
+    # Sessions ingested before Compound was kept cannot contribute.
+    sessions = [(compact_laps(laps), track) for laps, track in zip(lap_frames, tracks)
+                if {"Compound", "TyreLife", "Time"}.issubset(laps.columns)]
+    if len(sessions) < len(lap_frames):
+        warnings.warn(f"{len(lap_frames) - len(sessions)} of {len(lap_frames)} sessions have no Compound, TyreLife or Time column "
+                      f"and are left out of the tyre fit, re-ingest them with the current ANALYSIS_VERSION")
+    if not sessions:
+        return pd.DataFrame(columns=COEFFICIENT_COLUMNS, index=pd.MultiIndex.from_arrays([[], []], names=["Track", "Compound"]))
+    lap_frames, tracks = zip(*sessions)
+
+    sizes = [len(laps) for laps in lap_frames]
+    times = np.concatenate([laps[LAP_TIME_COLUMNS].to_numpy(dtype=float, na_value=np.nan) for laps in lap_frames])
+    minutes = np.concatenate([laps["Time"].to_numpy(dtype=float, na_value=np.nan) for laps in lap_frames]) / MS_PER_MINUTE
+    tyre_age = np.concatenate([laps["TyreLife"].to_numpy(dtype=float, na_value=np.nan) for laps in lap_frames]) - 1
+    compounds = np.concatenate([laps["Compound"].astype(object).values for laps in lap_frames])
+    drivers = np.concatenate([laps["Driver"].astype(object).values for laps in lap_frames])
+    sessions = np.repeat(np.arange(len(lap_frames)), sizes)
+
+    rows = np.flatnonzero(~np.isnan(minutes) & ~np.isnan(tyre_age) & pd.notna(compounds))
+    times, minutes, tyre_age, sessions = times[rows], minutes[rows], tyre_age[rows], sessions[rows]
+    pairs, pair_keys = pd.factorize(pd.MultiIndex.from_arrays([np.asarray(tracks, dtype=object)[sessions], compounds[rows]]))
+    groups = pd.factorize(pd.MultiIndex.from_arrays([sessions, drivers[rows]]))[0]
+
+    # Design matrix: tyre age in the column of the lap's (track, compound), session minutes in the column of its session.
+    n_pairs, n_sessions = len(pair_keys), len(lap_frames)
+    design = np.zeros((len(rows), n_pairs + n_sessions))
+    design[np.arange(len(rows)), pairs] = tyre_age
+    design[np.arange(len(rows)), n_pairs + sessions] = minutes
+
+    slopes = np.zeros((n_pairs, len(LAP_TIME_COLUMNS)))
+    for column in range(len(LAP_TIME_COLUMNS)):
+        used = ~np.isnan(times[:, column])
+        x, y, group = design[used], times[used, column], pd.factorize(groups[used])[0]
+        if not len(y):
+            continue
+
+        # Removing each (session, driver) mean is the same as fitting a per driver intercept.
+        count = np.bincount(group)[:, None]
+        x_sums = np.zeros((count.shape[0], x.shape[1]))
+        np.add.at(x_sums, group, x)
+        x = x - (x_sums / count)[group]
+        y = y - (np.bincount(group, y) / count[:, 0])[group]
+
+        # Unidentified columns are all zero after demeaning, and the minimum norm solution leaves them at 0.
+        solution = np.linalg.lstsq(x, y, rcond=None)[0]
+        slopes[:, column] = solution[:n_pairs]
+
+    fit = pd.DataFrame(slopes, columns=LAP_TIME_COLUMNS,
+                       index=pd.MultiIndex.from_tuples(list(pair_keys), names=["Track", "Compound"]))
+    fit["Laps"] = np.bincount(pairs[~np.isnan(times[:, 0])], minlength=n_pairs)
+    return fit.sort_index()
+
+
+def tyre_cache_path(season: int, track: str, cache_dir: str = TYRE_CACHE_DIR):
+    """File holding the cached slopes of one (season, track)."""
+
+    return os.path.join(cache_dir, str(season), f"{track}.json")
+
+
+def load_tyre_coefficients(season: int, track: str, cache_dir: str = TYRE_CACHE_DIR):
+    """
+    Cached slopes of one (season, track).
+
+    Returns:
+        DataFrame or None: Indexed by Compound with COEFFICIENT_COLUMNS, None if nothing is cached for
+                           this ANALYSIS_VERSION.
+    """
+
+    path = tyre_cache_path(season, track, cache_dir)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as source:
+        cached = json.load(source)
+    if cached.get("version") != ANALYSIS_VERSION:
+        return None
+
+    coefficients = pd.DataFrame.from_dict(cached["coefficients"], orient="index", columns=COEFFICIENT_COLUMNS)
+    coefficients.index.name = "Compound"
+    return coefficients
+
+
+def save_tyre_coefficients(season: int, track: str, coefficients, cache_dir: str = TYRE_CACHE_DIR):
+    """Cache the Compound indexed slopes of one (season, track), replacing the file atomically."""
+
+    path = tyre_cache_path(season, track, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    state = {
+        "version": ANALYSIS_VERSION,
+        "coefficients": {compound: {column: float(row[column]) for column in COEFFICIENT_COLUMNS} for compound, row in coefficients.iterrows()}
+    }
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as target:
+        json.dump(state, target)
+    os.replace(tmp_path, path)
+
+
+def fittable_compounds(laps):
+    """The compounds of a lap frame that `fit_tyre_degradation` fits a slope for."""
+
+    if not {"Compound", "TyreLife", "Time"}.issubset(laps.columns):
+        return set()
+    return set(laps.loc[laps["TyreLife"].notna() & laps["Time"].notna(), "Compound"].dropna().astype(object))
+
+
+def season_tyre_coefficients(lap_frames, tracks, season: int = SEASON, use_cache: bool = True, cache_dir: str = TYRE_CACHE_DIR):
+    """
+    The slopes of every track in `tracks`, fitting all uncached tracks of the season in one batch.
+
+    A cached track whose sessions here have compounds missing from its cached slopes is fitted again from these
+    sessions, and the missing compounds are added to the cached ones.
+
+    Args:
+        lap_frames (list): One lap frame per session, see `fit_tyre_degradation`.
+        tracks (list): The track of each session.
+        season (int, optional): The season of the sessions. Defaults to SEASON.
+        use_cache (bool, optional): Reuse and store cached slopes. Defaults to True.
+        cache_dir (str, optional): Cache directory.
+
+    Returns:
+        dict: Track -> DataFrame indexed by Compound with COEFFICIENT_COLUMNS.
+    """
+
+    coefficients = {}
+    if use_cache:
+        for track in dict.fromkeys(tracks):
+            cached = load_tyre_coefficients(season, track, cache_dir)
+            if cached is not None:
+                coefficients[track] = cached
+
+    compounds = {}
+    for laps, track in zip(lap_frames, tracks):
+        compounds.setdefault(track, set()).update(fittable_compounds(laps))
+    stale = {track for track in compounds if track not in coefficients or not compounds[track].issubset(coefficients[track].index)}
+
+    missing = [(laps, track) for laps, track in zip(lap_frames, tracks) if track in stale]
+    if missing:
+        fit = fit_tyre_degradation(*zip(*missing))
+        fitted_tracks = list(dict.fromkeys(track for _, track in missing))
+        for track in fitted_tracks:
+            fitted = fit[fit.index.get_level_values("Track") == track].droplevel("Track")
+            if track in coefficients:
+                # Keep the cached slopes, which were fitted from the sessions that used those compounds.
+                fitted = pd.concat([coefficients[track], fitted[~fitted.index.isin(coefficients[track].index)]])
+            coefficients[track] = fitted
+            if use_cache:
+                save_tyre_coefficients(season, track, coefficients[track], cache_dir)
+        print(f"Fitted tyre degradation for {len(fitted_tracks)} tracks of {season}")
+
+    return coefficients
+
+
+def normalise_tyre_life(laps, coefficients):
+    """
+    Move every lap to a fresh tyre, subtracting its compound's slope times the laps already on the tyre.
+
+    Laps on compounds without a slope are left as they are, and so are laps without a Compound or TyreLife column
+    (with a warning).
+
+    Args:
+        laps (DataFrame): Lap frame as returned by `filter_anomalous_Q_laps`.
+        coefficients (DataFrame): Slopes indexed by Compound, see `season_tyre_coefficients`.
+
+    Returns:
+        DataFrame: The compact laps with normalised LapTime and sector times.
+    """
+
+    laps = compact_laps(laps)
+    if not {"Compound", "TyreLife"}.issubset(laps.columns):
+        warnings.warn("Laps without Compound or TyreLife are not normalised for tyre life, re-ingest them with the current ANALYSIS_VERSION")
+        return laps
+    if not len(coefficients):
+        return laps
+
+    positions = coefficients.index.get_indexer(laps["Compound"].astype(object).values)
+    slopes = np.where(positions[:, None] >= 0, coefficients[LAP_TIME_COLUMNS].to_numpy(dtype=float)[positions], 0.0)
+    tyre_age = np.nan_to_num(laps["TyreLife"].to_numpy(dtype=float, na_value=np.nan) - 1)
+
+    laps = laps.copy()
+    times = laps[LAP_TIME_COLUMNS].to_numpy(dtype=float, na_value=np.nan) - slopes * tyre_age[:, None]
+    for i, column in enumerate(LAP_TIME_COLUMNS):
+        laps[column] = pd.arrays.IntegerArray(np.round(np.nan_to_num(times[:, i])).astype(np.int32), np.isnan(times[:, i]))
+    return laps
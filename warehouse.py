@@ -0,0 +1,200 @@
+import json
+import os
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from frame_io import save_frames, load_frames
+from lap_table import compact_laps
+from constants import *
+
+#### Partitioned warehouse of filtered qualifying laps
+
+# Every ingested session is one partition, stored as
+#   <season>/<event>/<session>-k<k>-v<version>.npz   (frames "Laps", "Results" and "PoorQuali")
+#   <season>/<event>/<session>-k<k>-v<version>.json  (catalog entry)
+# Partitions are only ever added, never rewritten, so concurrent scrapes can ingest without coordinating.
+# Queries only list the season and event directories they ask for, filter those catalog entries and only open
+# the partitions that match.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+WAREHOUSE_DIR = os.path.join(ROOT_DIR, "Cache", "lap_warehouse")
+
+# Compact lap columns kept per partition, when present in the filtered laps.
+WAREHOUSE_LAP_COLUMNS = ["Driver", "Team", "LapTime", "Sector1Time", "Sector2Time", "Sector3Time", "Compound", "TyreLife", "Time"]
+
+CATALOG_COLUMNS = ["Season", "Event", "Session", "Downforce", "k", "Version", "Laps", "File"]
+
+
+def partition_path(season: int, event: str, session: str, k: float, version: int, warehouse_dir: str = WAREHOUSE_DIR):
+    """Return the partition file for a session, without extension. Equal k values (2 and 2.0) name the same file."""
+
+    return os.path.join(warehouse_dir, str(season), event, f"{session}-k{float(k):g}-v{version}")
+
+
+def ingest_session(season: int, event: str, session: str, filtered_laps, poor_q_ranks, results, k: float, version: int,
+                   warehouse_dir: str = WAREHOUSE_DIR):
+    """
+    Add one session's filtered laps and results to the warehouse.
+
+    A session already ingested with the same k and version is left as it is.
+
+    Args:
+        season (int): Season of the session.
+        event (str): Event name, e.g. "Monaco".
+        session (str): "Qualifying" or "Sprint".
+        filtered_laps (DataFrame): Laps as returned by `filter_anomalous_Q_laps`.
+        poor_q_ranks (dict or None): Drivers without a competitive lap -> position, as returned by `filter_anomalous_Q_laps`.
+        results (DataFrame): The session results (Abbreviation, TeamName, Position, Q1, Q2, Q3).
+        k (float): IQR multiplier the laps were filtered with.
+        version (int): ANALYSIS_VERSION the laps were filtered with.
+        warehouse_dir (str, optional): Warehouse root directory.
+
+    Returns:
+        bool: True if a new partition was written.
+    """
+
+    path = partition_path(season, event, session, k, version, warehouse_dir)
+    if os.path.exists(f"{path}.json"):
+        return False
+
+    laps = compact_laps(filtered_laps[[column for column in WAREHOUSE_LAP_COLUMNS if column in filtered_laps]])
+    poor_q_ranks = poor_q_ranks or {}
+    poor_q = pd.DataFrame({
+        "Driver": pd.Series(list(poor_q_ranks), dtype=object), "Position": pd.Series(list(poor_q_ranks.values()), dtype=float)
+    })
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_frames(f"{path}.npz", {"Laps": laps.reset_index(drop=True), "Results": results.reset_index(drop=True), "PoorQuali": poor_q})
+
+    entry = {
+        "Season": season, "Event": event, "Session": session, "Downforce": RACE_DF_RATING.get(event),
+        "k": float(k), "Version": version, "Laps": len(laps), "File": os.path.relpath(f"{path}.npz", warehouse_dir)
+    }
+
+    # The catalog entry goes last, so a partition is only visible once its data is complete.
+    tmp_path = f"{path}.json.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as target:
+        json.dump(entry, target, ensure_ascii=False)
+    os.replace(tmp_path, f"{path}.json")
+
+    return True
+
+
+def _as_list(values):
+    """A predicate value as a list, None (everything) stays None."""
+
+    if values is None:
+        return None
+    return [values] if pd.api.types.is_scalar(values) else list(values)
+
+
+def _subdirectories(directory: str, names=None):
+    """The subdirectories of `directory`, only those in `names` when given."""
+
+    if not os.path.isdir(directory):
+        return []
+    if names is None:
+        return [entry.path for entry in os.scandir(directory) if entry.is_dir()]
+    return [os.path.join(directory, str(name)) for name in names if os.path.isdir(os.path.join(directory, str(name)))]
+
+
+def load_catalog(warehouse_dir: str = WAREHOUSE_DIR, seasons=None, events=None):
+    """
+    Return one row per ingested partition with columns Season, Event, Session, Downforce, k, Version, Laps and File.
+
+    Only the season and event directories asked for are listed, so a query never reads the rest of the catalog.
+
+    Args:
+        warehouse_dir (str, optional): Warehouse root directory.
+        seasons (int or list, optional): Seasons to read. Defaults to all.
+        events (str or list, optional): Events to read. Defaults to all.
+    """
+
+    entries = []
+    for season_dir in _subdirectories(warehouse_dir, _as_list(seasons)):
+        for event_dir in _subdirectories(season_dir, _as_list(events)):
+            for entry in os.scandir(event_dir):
+                if entry.name.endswith(".json"):
+                    with open(entry.path, encoding="utf-8") as source:
+                        entries.append(json.load(source))
+
+    catalog = pd.DataFrame(entries, columns=CATALOG_COLUMNS)
+    return catalog.sort_values(["Season", "Event", "Session"], kind="mergesort").reset_index(drop=True)
+
+
+def _matches(column, values):
+    """Catalog mask for one predicate: None matches everything, otherwise a value or list of values."""
+
+    if values is None:
+        return pd.Series(True, index=column.index)
+    return column.isin(_as_list(values))
+
+
+def query_catalog(seasons=None, events=None, sessions=None, downforce=None, k: float = 2, version: int | None = None,
+                  warehouse_dir: str = WAREHOUSE_DIR):
+    """
+    Select the partitions matching every given predicate.
+
+    Args:
+        seasons (int or list, optional): Seasons to keep. Defaults to all.
+        events (str or list, optional): Events to keep. Defaults to all.
+        sessions (str or list, optional): "Qualifying" and/or "Sprint". Defaults to both.
+        downforce (int or list, optional): RACE_DF_RATING levels to keep. Defaults to all.
+        k (float, optional): IQR multiplier the laps were filtered with. Defaults to 2.
+        version (int, optional): ANALYSIS_VERSION to read. Defaults to the latest ingested for each session.
+        warehouse_dir (str, optional): Warehouse root directory.
+
+    Returns:
+        DataFrame: The matching catalog rows.
+    """
+
+    catalog = load_catalog(warehouse_dir, seasons, events)
+
+    mask = (
+        _matches(catalog["Season"], seasons) & _matches(catalog["Event"], events) & _matches(catalog["Session"], sessions)
+        & _matches(catalog["Downforce"], downforce) & _matches(catalog["k"], k) & _matches(catalog["Version"], version)
+    )
+    catalog = catalog[mask]
+
+    # Keep only the latest version of each session.
+    catalog = catalog.sort_values("Version", kind="mergesort").drop_duplicates(["Season", "Event", "Session"], keep="last")
+    return catalog.sort_values(["Season", "Event", "Session"], kind="mergesort").reset_index(drop=True)
+
+
+def read_partition(entry, frames=("Laps", "PoorQuali"), warehouse_dir: str = WAREHOUSE_DIR):
+    """Load the requested frames of one catalog row."""
+
+    return load_frames(os.path.join(warehouse_dir, entry["File"]), names=frames)
+
+
+def read_laps(seasons=None, events=None, sessions=None, downforce=None, k: float = 2, version: int | None = None,
+              warehouse_dir: str = WAREHOUSE_DIR):
+    """
+    Read the filtered laps of every matching partition into one compact lap table.
+
+    Takes the same predicates as `query_catalog`, which are applied before any partition is opened.
+
+    Returns:
+        DataFrame: Compact laps with Season, Event, Session and Downforce columns added.
+    """
+
+    catalog = query_catalog(seasons, events, sessions, downforce, k, version, warehouse_dir)
+
+    frames = []
+    for _, entry in catalog.iterrows():
+        laps = read_partition(entry, frames=("Laps",), warehouse_dir=warehouse_dir)["Laps"]
+        frames.append(laps.assign(Season=entry["Season"], Event=entry["Event"], Session=entry["Session"], Downforce=entry["Downforce"]))
+
+    if not frames:
+        return pd.DataFrame(columns=WAREHOUSE_LAP_COLUMNS + ["Season", "Event", "Session", "Downforce"])
+
+    # Partitions carry their own categories, unify them so Driver and Team stay categorical.
+    categorical = {column: union_categoricals([frame[column] for frame in frames], sort_categories=True) for column in ("Driver", "Team")}
+    laps = pd.concat(frames, ignore_index=True)
+    for column, values in categorical.items():
+        laps[column] = values
+    for column in ("Event", "Session"):
+        laps[column] = laps[column].astype("category")
+
+    return laps